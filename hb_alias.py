@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Peer, subscriber and talkgroup aliases in a compact index file instead of a
+dictionary. The CSV files from [ALIASES] are compiled once into a sorted,
+fixed width index next to them (peer_ids.csv -> peer_ids.idx), which every
+process maps read-only: lookups bisect the mapped IDs, and the pages are
+shared through the page cache, so millions of subscribers cost next to no
+memory in each application.
+
+An ALIASDB answers "in" and [] like the dictionary dmr_utils.mk_id_dict
+makes, so dmr_utils.get_alias works with either.
+
+All fields are little-endian.
+
+    Header, 16 bytes
+        0   4   'HBAL'
+        4   2   version (1)
+        6   2   width of each alias
+        8   4   number of aliases
+        12  4   reserved (0)
+
+    IDs, number of aliases x 4 bytes, unsigned, in ascending order
+
+    Aliases, number of aliases x width bytes, in the same order, NUL padded
+
+ALIAS and ID put off the lookups for log lines until a handler formats them:
+
+    logger.info('SUB: %s (%s)', ALIAS(_rf_src, subscriber_ids), ID(_rf_src))
+
+costs two small objects, and nothing is looked up or converted if INFO is
+turned off. Lookups that are made go through a small LRU, since the same few
+subscribers, repeaters and talkgroups make most of the calls.
+
+ALIASES keeps the tables up to date for an application without holding it up:
+it starts on the indexes already on hand, then downloads (PEER_URL and
+SUBSCRIBER_URL, which may also be a local file) and indexes in a thread,
+checking again every ALIAS_CHECK seconds for files older than STALE_DAYS.
+Tables are handed to the application whole, and only when they change.
+
+Run this file with a CSV and an index file name to build one by hand.
+'''
+
+from __future__ import print_function
+
+import os
+import mmap
+from bisect import bisect_left
+from collections import OrderedDict
+from csv import reader as csv_reader
+from httplib import HTTPException
+from shutil import copyfileobj
+from struct import Struct
+from time import time
+from urllib2 import urlopen
+
+from twisted.internet import task, defer
+from twisted.internet.threads import deferToThread
+
+from dmr_utils.utils import int_id, get_alias
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+ALIAS_VERSION = 1
+MAX_WIDTH = 64              # longer aliases are cut short
+LRU_SIZE = 1024             # aliases kept for log lines
+ALIAS_CHECK = 3600          # seconds between looks for new alias files
+DOWNLOAD_TIMEOUT = 60
+
+# Tables an application gets: table, file option, download URL option
+ALIAS_TABLES = (
+    ('PEER',       'PEER_FILE',       'PEER_URL'),
+    ('SUBSCRIBER', 'SUBSCRIBER_FILE', 'SUBSCRIBER_URL'),
+    ('TGID',       'TGID_FILE',       None),
+)
+
+_HEADER = Struct('<4sHHII')
+_ID = Struct('<I')
+
+
+# Index file for an alias CSV file
+def index_file(_csv_file):
+    return os.path.splitext(_csv_file)[0] + '.idx'
+
+
+# Compile an alias CSV file (ID, alias, anything else...) into an index.
+# Rows that don't start with an ID are skipped, and the last row for an ID
+# wins, as they do in mk_id_dict. The index is written beside its final name
+# and renamed over it, so processes with the old one mapped keep reading it
+# undisturbed. Returns the number of aliases.
+def build_index(_csv_file, _index_file):
+    _aliases = {}
+    with open(_csv_file, 'rU') as _handle:
+        for _row in csv_reader(_handle, dialect='excel', delimiter=','):
+            try:
+                _id = int(_row[0])
+                if 0 <= _id <= 0xFFFFFFFF:
+                    _aliases[_id] = _row[1][:MAX_WIDTH]
+            except (ValueError, IndexError):
+                pass
+
+    _ids = sorted(_aliases)
+    _width = max([len(_alias) for _alias in _aliases.itervalues()] or [1])
+    _temp = '{}.{}.tmp'.format(_index_file, os.getpid())
+    with open(_temp, 'wb') as _handle:
+        _handle.write(_HEADER.pack('HBAL', ALIAS_VERSION, _width, len(_ids), 0))
+        _handle.write(''.join(_ID.pack(_id) for _id in _ids))
+        _handle.write(''.join(_aliases[_id].ljust(_width, '\x00') for _id in _ids))
+    os.rename(_temp, _index_file)
+    return len(_ids)
+
+
+# The IDs in a mapped index as a sequence, for bisect
+class _IDS(object):
+    def __init__(self, _map, _count):
+        self._map = _map
+        self._count = _count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, _index):
+        return _ID.unpack_from(self._map, _HEADER.size + _index * _ID.size)[0]
+
+
+class ALIASDB(object):
+    def __init__(self, _index_file):
+        with open(_index_file, 'rb') as _handle:
+            self._map = mmap.mmap(_handle.fileno(), 0, access=mmap.ACCESS_READ)
+            _stat = os.fstat(_handle.fileno())
+        # Which index file this is, to tell when it has been replaced
+        self.stamp = (_stat.st_ino, _stat.st_mtime, _stat.st_size)
+        if len(self._map) < _HEADER.size:
+            self._map.close()
+            raise ValueError('{} is not an HBlink alias index'.format(_index_file))
+        _magic, _version, self._width, self._count, _reserved = _HEADER.unpack_from(self._map, 0)
+        if _magic != 'HBAL' or _version != ALIAS_VERSION or len(self._map) != _HEADER.size + self._count * (_ID.size + self._width):
+            self._map.close()
+            raise ValueError('{} is not an HBlink alias index'.format(_index_file))
+        self._ids = _IDS(self._map, self._count)
+        self._aliases = _HEADER.size + self._count * _ID.size
+
+    # Position of an ID in the index, or -1
+    def _find(self, _id):
+        _index = bisect_left(self._ids, _id)
+        if _index < self._count and self._ids[_index] == _id:
+            return _index
+        return -1
+
+    def __contains__(self, _id):
+        return self._find(_id) >= 0
+
+    def __getitem__(self, _id):
+        _index = self._find(_id)
+        if _index < 0:
+            raise KeyError(_id)
+        _offset = self._aliases + _index * self._width
+        return self._map[_offset:_offset + self._width].rstrip('\x00')
+
+    def get(self, _id, _default = None):
+        try:
+            return self[_id]
+        except KeyError:
+            return _default
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+
+# What the applications use in place of mk_id_dict: the alias file's index,
+# built first if it is missing, older than the file or unreadable. An empty
+# dictionary when there is no alias file at all, like mk_id_dict.
+def mk_alias_db(_path, _file):
+    _csv_file = _path + _file
+    _index_file = index_file(_csv_file)
+    _have_csv = os.path.isfile(_csv_file)
+    if _have_csv and (not os.path.isfile(_index_file) or os.path.getmtime(_index_file) < os.path.getmtime(_csv_file)):
+        build_index(_csv_file, _index_file)
+    if not os.path.isfile(_index_file):
+        return {}
+    try:
+        return ALIASDB(_index_file)
+    except ValueError:
+        if not _have_csv:
+            return {}
+        build_index(_csv_file, _index_file)
+        return ALIASDB(_index_file)
+
+
+# The index already built for an alias file, without building or rebuilding
+# it, or an empty dictionary if there isn't a good one
+def open_alias_db(_path, _file):
+    try:
+        return ALIASDB(index_file(_path + _file))
+    except (IOError, ValueError):
+        return {}
+
+
+# Like dmr_utils.try_download: fetch an alias file if it is missing or older
+# than _stale seconds. The file is only replaced once the whole download is
+# in, so a failed one leaves the last good file in place. _url may also be a
+# local file, by path or file:// URL.
+def download(_path, _file, _url, _stale):
+    _target = _path + _file
+    if os.path.isfile(_target) and os.path.getmtime(_target) + _stale > time():
+        return 'ID ALIAS MAPPER: \'{}\' is current, not downloaded'.format(_file)
+
+    _temp = '{}.{}.tmp'.format(_target, os.getpid())
+    try:
+        if '://' in _url:
+            _source = urlopen(_url, timeout=DOWNLOAD_TIMEOUT)
+        else:
+            _source = open(_url, 'rb')
+        try:
+            with open(_temp, 'wb') as _handle:
+                copyfileobj(_source, _handle)
+        finally:
+            _source.close()
+        os.rename(_temp, _target)
+    except (IOError, OSError, ValueError, HTTPException):
+        if os.path.isfile(_temp):
+            os.remove(_temp)
+        return 'ID ALIAS MAPPER: \'{}\' could not be downloaded'.format(_file)
+    return 'ID ALIAS MAPPER: \'{}\' successfully downloaded'.format(_file)
+
+
+# Keeps an application's alias tables current. _set is called in the reactor
+# thread with {'PEER': ..., 'SUBSCRIBER': ..., 'TGID': ...} when start() is
+# called and again whenever a table changes. Replaced tables are not closed,
+# log records already made may still look up in them; they are unmapped when
+# the last of those is gone.
+class ALIASES(object):
+    def __init__(self, _config, _logger, _set):
+        self._config = _config
+        self._logger = _logger
+        self._set = _set
+        self.tables = {}
+        self._refreshing = None
+        self._loop = task.LoopingCall(self.refresh)
+
+    def start(self):
+        for _table, _file, _url in ALIAS_TABLES:
+            self.tables[_table] = open_alias_db(self._config['PATH'], self._config[_file])
+            if self.tables[_table]:
+                self._logger.info('ID ALIAS MAPPER: %s aliases available: %s', _table, len(self.tables[_table]))
+        self._set(dict(self.tables))
+        self._loop.start(ALIAS_CHECK)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    # One refresh at a time: asking again while one is running waits on it
+    def refresh(self):
+        if self._refreshing is None:
+            self._refreshing = deferToThread(self._load).addCallbacks(self._loaded, self._failed).addBoth(self._refreshed)
+        _done = defer.Deferred()
+        self._refreshing.addBoth(lambda _result: _done.callback(None))
+        return _done
+
+    def _refreshed(self, _result):
+        self._refreshing = None
+
+    # In a thread: download what is due, build what has changed, map it all
+    def _load(self):
+        _results = []
+        _tables = {}
+        for _table, _file, _url in ALIAS_TABLES:
+            if self._config['TRY_DOWNLOAD'] and _url:
+                _results.append(download(self._config['PATH'], self._config[_file], self._config[_url], self._config['STALE_TIME']))
+            _tables[_table] = mk_alias_db(self._config['PATH'], self._config[_file])
+        return _results, _tables
+
+    def _loaded(self, _loaded):
+        _results, _tables = _loaded
+        for _result in _results:
+            self._logger.info(_result)
+        _changed = False
+        for _table, _aliases in _tables.iteritems():
+            if getattr(_aliases, 'stamp', None) != getattr(self.tables[_table], 'stamp', None):
+                self.tables[_table] = _aliases
+                _changed = True
+                self._logger.info('ID ALIAS MAPPER: %s aliases available: %s', _table, len(_aliases))
+        if _changed:
+            clear_aliases()
+            self._set(dict(self.tables))
+
+    def _failed(self, _failure):
+        self._logger.error('ID ALIAS MAPPER: could not refresh aliases: %s', _failure.getErrorMessage())
+
+
+# Recently used aliases: (table, ID as received) -> alias, oldest first
+_lru = OrderedDict()
+
+def alias(_id, _table):
+    _key = (id(_table), _id)
+    try:
+        _alias = _lru.pop(_key)
+    except KeyError:
+        _alias = get_alias(_id, _table)
+        if len(_lru) >= LRU_SIZE:
+            _lru.popitem(last=False)
+    _lru[_key] = _alias
+    return _alias
+
+# Forget every alias looked up so far, for when a table is replaced
+def clear_aliases():
+    _lru.clear()
+
+
+# The alias for an ID from a packet, looked up when the log record is formatted
+class ALIAS(object):
+    __slots__ = ('_id', '_table')
+
+    def __init__(self, _id, _table):
+        self._id = _id
+        self._table = _table
+
+    def __str__(self):
+        return str(alias(self._id, self._table))
+
+
+# An ID from a packet as a number, converted when the log record is formatted
+class ID(object):
+    __slots__ = ('_id',)
+
+    def __init__(self, _id):
+        self._id = _id
+
+    def __str__(self):
+        return str(int_id(self._id))
+
+
+#************************************************
+#      MAIN PROGRAM LOOP STARTS HERE
+#************************************************
+
+if __name__ == '__main__':
+
+    import argparse
+    from time import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('CSV_FILE', help='/full/path/to/aliases.csv')
+    parser.add_argument('INDEX_FILE', nargs='?', help='/full/path/to/aliases.idx (default: next to the CSV file)')
+    cli_args = parser.parse_args()
+
+    start = time()
+    count = build_index(cli_args.CSV_FILE, cli_args.INDEX_FILE or index_file(cli_args.CSV_FILE))
+    print('{} aliases indexed in {:.2f}s'.format(count, time() - start))
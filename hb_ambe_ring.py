@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+AMBE export through a ring buffer in a memory-mapped file, for decoders,
+recorders and monitors running on the same machine. HBlink writes, any number
+of readers map the same file read-only and follow along. Nothing ever waits:
+a reader that falls more than a ring behind loses the oldest frames, and is
+told how many.
+
+All fields are little-endian (native on everything we run on).
+
+    Header, 64 bytes
+        0   4   'HBAR'
+        4   2   version (1)
+        6   2   record size (72)
+        8   4   number of records in the ring
+        16  8   write sequence -- how many records have ever been written
+
+    Records, starting at byte 64. Record n lives at index n % records.
+        0   8   stamp -- n + 1 once record n is complete, 0 while being written
+        8   8   time received (float, seconds since the epoch)
+        16  1   slot (1 or 2)
+        17  1   HBP sequence number
+        18  3   RF source (subscriber ID)
+        21  3   destination ID
+        24  4   stream ID
+        28  16  system name, NUL padded
+        44  27  the three 72 bit AMBE frames
+        71  1   pad
+
+To write record n the writer zeroes its stamp, fills it in, sets the stamp to
+n + 1 and only then moves the write sequence to n + 1. A reader wanting record
+n checks the write sequence, reads the stamp, copies the record and reads the
+stamp again. If either stamp isn't n + 1 the writer lapped the reader while it
+was copying, and the record is counted as lost.
+
+There is only ever one writer per ring -- every system exporting AMBE in an
+HBlink process shares it through get_writer().
+
+Run this file with the ring's file name to watch frames go by.
+'''
+
+from __future__ import print_function
+
+import mmap
+import os
+from struct import Struct
+from time import time
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+RING_VERSION = 1
+HEADER_SIZE = 64
+
+_HEADER = Struct('<4sHHI')
+_WSEQ   = Struct('<Q')
+_STAMP  = Struct('<Q')
+_BODY   = Struct('<dBc3s3s4s16s27sx')
+_WSEQ_OFFSET = 16
+RECORD_SIZE = _STAMP.size + _BODY.size
+
+# One writer per ring file, shared by every system exporting to it
+_writers = {}
+
+def get_writer(_file, _records):
+    if _file not in _writers:
+        _writers[_file] = RINGWRITER(_file, _records)
+    return _writers[_file]
+
+
+class RINGWRITER(object):
+    def __init__(self, _file, _records):
+        self._records = _records
+        _size = HEADER_SIZE + RECORD_SIZE * _records
+
+        # Always start a new ring -- readers see the write sequence go
+        # backwards and start over
+        _fd = os.open(_file, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            os.ftruncate(_fd, _size)
+            self._map = mmap.mmap(_fd, _size)
+        finally:
+            os.close(_fd)
+        self._map[:HEADER_SIZE] = '\x00' * HEADER_SIZE
+        _HEADER.pack_into(self._map, 0, 'HBAR', RING_VERSION, RECORD_SIZE, _records)
+        self._wseq = 0
+
+    # _frame is an hb_frame.DMRD object, _ambe its 27 bytes of AMBE
+    def write(self, _system, _frame, _ambe):
+        _offset = HEADER_SIZE + (self._wseq % self._records) * RECORD_SIZE
+        _STAMP.pack_into(self._map, _offset, 0)
+        _BODY.pack_into(self._map, _offset + _STAMP.size, time(), _frame.slot, _frame.seq, _frame.rf_src, _frame.dst_id, _frame.stream_id, _system, _ambe)
+        self._wseq += 1
+        _STAMP.pack_into(self._map, _offset, self._wseq)
+        _WSEQ.pack_into(self._map, _WSEQ_OFFSET, self._wseq)
+
+
+class RINGREADER(object):
+    def __init__(self, _file):
+        with open(_file, 'rb') as _handle:
+            self._map = mmap.mmap(_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        _magic, _version, _record_size, self._records = _HEADER.unpack_from(self._map, 0)
+        if _magic != 'HBAR' or _version != RING_VERSION or _record_size != RECORD_SIZE:
+            raise ValueError('{} is not an HBlink AMBE ring'.format(_file))
+        self.lost = 0
+        self._rseq = self.wseq()    # Start with whatever is written next
+
+    def wseq(self):
+        return _WSEQ.unpack_from(self._map, _WSEQ_OFFSET)[0]
+
+    # Every record written since the last call, oldest first, as tuples of:
+    # (time, slot, sequence, rf source, destination, stream ID, system, ambe)
+    def read(self):
+        _records = []
+        _wseq = self.wseq()
+        if _wseq < self._rseq:
+            self._rseq = 0          # The writer restarted
+        if _wseq - self._rseq > self._records:
+            self.lost += _wseq - self._rseq - self._records
+            self._rseq = _wseq - self._records
+
+        while self._rseq < _wseq:
+            _offset = HEADER_SIZE + (self._rseq % self._records) * RECORD_SIZE
+            _stamp = _STAMP.unpack_from(self._map, _offset)[0]
+            _body = _BODY.unpack_from(self._map, _offset + _STAMP.size)
+            self._rseq += 1
+            if _stamp != self._rseq or _STAMP.unpack_from(self._map, _offset)[0] != self._rseq:
+                self.lost += 1
+                continue
+            _records.append(_body[:6] + (_body[6].rstrip('\x00'),) + _body[7:])
+        return _records
+
+
+# Watch a ring from the command line
+if __name__ == '__main__':
+    import argparse
+    from binascii import b2a_hex as ahex
+    from time import sleep
+
+    from dmr_utils.utils import int_id
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('RING_FILE', help='/full/path/to/the/ring/file (RING_FILE in [AMBE])')
+    parser.add_argument('-i', '--interval', action='store', dest='INTERVAL', type=float, default=0.06, help='Seconds between polls of the ring')
+    cli_args = parser.parse_args()
+
+    ring = RINGREADER(cli_args.RING_FILE)
+    lost = 0
+    while True:
+        for _time, _slot, _seq, _rf_src, _dst_id, _stream_id, _system, _ambe in ring.read():
+            print('{:.3f} ({}) TS{} SEQ {} SUB {} DST {} STREAM {} {}'.format(_time, _system, _slot, int_id(_seq), int_id(_rf_src), int_id(_dst_id), int_id(_stream_id), ahex(_ambe)))
+        if ring.lost != lost:
+            print('*** {} frames lost, reader too slow'.format(ring.lost - lost))
+            lost = ring.lost
+        sleep(cli_args.INTERVAL)
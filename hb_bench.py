@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Benchmarks for the packet path, with no network and no config file. Each case
+is run with synthetic rule sets of every size given (10, 100, 1000 and 10000
+by default):
+
+    confbridge      hb_confbridge routerSYSTEM.dmrd_received, SIZE bridge
+                    entries over SYSTEMS systems, two per bridge
+    router          hb_router routerSYSTEM.dmrd_received, SIZE routing rules
+                    for the system the calls come from
+    bridge_all      hb_bridge_all bridgeallSYSTEM.dmrd_received, SIZE entries
+                    in every subscriber and talkgroup ACL
+    acl_check       acl.acl_check against an ACL of SIZE entries, for IDs
+                    inside and outside it
+    master          a MASTER's whole receive path, datagramReceived through
+                    repeating, with SIZE clients logged in. The copies go
+                    out with hb_fanout's sendmmsg() where it is available,
+                    as they do in service, to a socket of the benchmark's
+                    own that never reads them; FANOUT in the results says
+                    which way it was
+
+The applications run their own rule loading code (make_bridges, make_rules,
+acl_build) on the synthetic rules, and every system sends to an in-memory
+transport that only counts. Calls are real: a voice header, superframes of
+bursts and a terminator, as hb_loadgen.py makes them, from a new stream ID
+each time round.
+
+Every case runs for at least TIME seconds, REPEATS times, and the fastest run's
+frames per second and cost per frame are stored, with a little about the machine, as JSON. Given an
+earlier result file, each case is compared with it and anything slower by
+more than the tolerance is reported -- and the exit status is 1.
+'''
+
+from __future__ import print_function
+
+import sys
+import json
+import socket
+import logging
+import platform
+import argparse
+from types import ModuleType
+from time import time
+
+from hblink import HBSYSTEM, systems
+from hb_frame import DMRD
+from hb_loadgen import CALL
+from hb_replay import MEMORYTRANSPORT
+import hb_fanout
+from acl import acl_build, acl_check
+from dmr_utils.utils import hex_str_3, hex_str_4
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+BENCH_VERSION = 2
+
+SIZES = (10, 100, 1000, 10000)
+SYSTEMS = 10
+SUPERFRAMES = 10
+STREAMS = 16
+
+# The call every case replays: TGID 1000 on TS1, from this subscriber and
+# repeater. Rule sets are built so exactly one entry matches it.
+TGID = 1000
+RF_SRC = 3120001
+RADIO_ID = 312000
+
+# Enough of a config for HBSYSTEM and the applications
+def make_config(_systems):
+    _config = {
+        'GLOBAL': {'PATH': './', 'PING_TIME': 5, 'MAX_MISSED': 3, 'SHARDS': 1, 'CAPTURE_FILE': '', 'DNS_TTL': 60},
+        'REPORTS': {'REPORT': False},
+        'AMBE': {},
+        'SYSTEMS': {},
+    }
+    for _index in range(_systems):
+        _config['SYSTEMS']['SYS-{}'.format(_index)] = {
+            'MODE': 'MASTER',
+            'ENABLED': True,
+            'REPEAT': True,
+            'EXPORT_AMBE': False,
+            'IP': '',
+            'PORT': 0,
+            'PASSPHRASE': '',
+            'GROUP_HANGTIME': 5,
+            'TRACE': [],
+            'CAPTURE': False,
+            'CLIENTS': {},
+        }
+    return _config
+
+# A stand-in for the repeater a CALL is sent from
+class PEER(object):
+    def __init__(self, _radio_id):
+        self.radio_id = hex_str_4(_radio_id)
+
+# One call's worth of DMRD packets
+def make_call():
+    _call = CALL(PEER(RADIO_ID), 1, hex_str_3(TGID), hex_str_3(RF_SRC), SUPERFRAMES, 1)
+    _frames = []
+    while True:
+        _frame = _call.next_frame(0.0)
+        if _frame is None:
+            return _frames
+        _frames.append(_frame)
+
+# The call under STREAMS different stream IDs, taken in turn so each call is
+# a new stream without building packets while the clock is running
+def make_streams():
+    _frames = make_call()
+    return [[_frame[:16] + hex_str_4(_stream) + _frame[20:] for _frame in _frames] for _stream in range(1, STREAMS + 1)]
+
+# Every system is a master with one repeater on it, so what's routed to it
+# is sent somewhere. They have been quiet for longer than the group hangtime,
+# or nothing would be routed to them at all.
+def make_systems(_class, _config, _logger):
+    systems.clear()
+    for _index, _system in enumerate(sorted(_config['SYSTEMS'])):
+        systems[_system] = _class(_system, _config, _logger, None)
+        systems[_system].transport = MEMORYTRANSPORT(_system, None, None)
+        _clients = systems[_system]._clients
+        _clients.connected(_clients.add(hex_str_4(RADIO_ID + _index), '127.0.0.1', 50000 + _index))
+        for _slot in (1, 2):
+            systems[_system].STATUS[_slot]['RX_TIME'] = systems[_system].STATUS[_slot]['TX_TIME'] = 0
+
+# The master case's transport: counted like MEMORYTRANSPORT, with a real UDP
+# socket under it for FANOUT to sendmmsg() on. The clients are all at its own
+# port on different loopback addresses, so the copies end up in its receive
+# buffer, which is never read, and not at anybody else's port.
+class FANOUTTRANSPORT(MEMORYTRANSPORT):
+    def __init__(self, _system):
+        MEMORYTRANSPORT.__init__(self, _system, None, None)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('', 0))
+        self.port = self._socket.getsockname()[1]
+
+    def getHandle(self):
+        return self._socket
+
+# FANOUT counting what it sends, as MEMORYTRANSPORT counts what's written
+class COUNTINGFANOUT(hb_fanout.FANOUT):
+    def send(self, _data, _clients):
+        _packets = self._transport.packets
+        hb_fanout.FANOUT.send(self, _data, _clients)
+        self._transport.packets = _packets + len(_clients)
+
+# Set an application up the way its main program does, around our config
+def setup_app(_name, _config, _logger, _rules):
+    _app = __import__(_name)
+    _app.CONFIG = _config
+    _app.logger = _logger
+    _app.peer_ids = _app.subscriber_ids = _app.talkgroup_ids = {}
+    _app.report_server = None
+    if _rules:
+        sys.modules['hb_bench_rules'] = _rules
+    return _app
+
+def sent():
+    return sum(_system.transport.packets for _system in systems.values())
+
+
+#************************************************
+#     THE CASES
+#************************************************
+
+# Each returns a function that processes one call and gives back the number
+# of frames it handled
+
+def case_confbridge(_size, _logger):
+    _config = make_config(SYSTEMS)
+    _rules = ModuleType('hb_bench_rules')
+    _rules.BRIDGES = {}
+    for _bridge in range(max(1, _size // 2)):
+        _rules.BRIDGES['BRIDGE-{}'.format(_bridge)] = [
+            {'SYSTEM': 'SYS-{}'.format(_bridge % SYSTEMS), 'TS': 1, 'TGID': TGID + _bridge, 'ACTIVE': True, 'TIMEOUT': 2, 'TO_TYPE': 'NONE', 'ON': [], 'OFF': [], 'RESET': []},
+            {'SYSTEM': 'SYS-{}'.format((_bridge + 1) % SYSTEMS), 'TS': 1, 'TGID': TGID + _bridge, 'ACTIVE': True, 'TIMEOUT': 2, 'TO_TYPE': 'NONE', 'ON': [], 'OFF': [], 'RESET': []},
+        ]
+    _app = setup_app('hb_confbridge', _config, _logger, _rules)
+    _app.BRIDGES = _app.make_bridges('hb_bench_rules')
+    _app.ACL = _app.build_acl('sub_acl')
+    make_systems(_app.routerSYSTEM, _config, _logger)
+    return app_runner(systems['SYS-0'])
+
+def case_router(_size, _logger):
+    _config = make_config(SYSTEMS)
+    _rules = ModuleType('hb_bench_rules')
+    _rules.RULES = dict((_system, {'GROUP_HANGTIME': 5, 'GROUP_VOICE': []}) for _system in _config['SYSTEMS'])
+    for _rule in range(_size):
+        _rules.RULES['SYS-0']['GROUP_VOICE'].append({'NAME': 'RULE-{}'.format(_rule), 'DST_NET': 'SYS-{}'.format(1 + _rule % (SYSTEMS - 1)), 'SRC_TS': 1, 'SRC_GROUP': TGID + _rule, 'DST_TS': 1, 'DST_GROUP': TGID + _rule, 'ACTIVE': True, 'TO_TYPE': 'NONE', 'TIMEOUT': 2, 'ON': [], 'OFF': []})
+    _app = setup_app('hb_router', _config, _logger, _rules)
+    _app.RULES = _app.make_rules('hb_bench_rules')
+    _app.ACL = _app.build_acl('sub_acl')
+    make_systems(_app.routerSYSTEM, _config, _logger)
+    return app_runner(systems['SYS-0'])
+
+def case_bridge_all(_size, _logger):
+    _config = make_config(SYSTEMS)
+    _app = setup_app('hb_bridge_all', _config, _logger, None)
+    # Permit lists of _size IDs, the last of them the one we call with
+    _sids = 'PERMIT:' + ','.join(str(RF_SRC + 10 + _id) for _id in range(_size - 1)) + ',{}'.format(RF_SRC)
+    _tgids = 'PERMIT:' + ','.join(str(TGID + 10 + _id) for _id in range(_size - 1)) + ',{}'.format(TGID)
+    _app.ACL = {'SID': {}, 'TGID': {}}
+    for _system in ['GLOBAL'] + sorted(_config['SYSTEMS']):
+        _app.ACL['SID'][_system] = {1: acl_build(_sids), 2: acl_build(_sids)}
+        _app.ACL['TGID'][_system] = {1: acl_build(_tgids), 2: acl_build(_tgids)}
+    make_systems(_app.bridgeallSYSTEM, _config, _logger)
+    return app_runner(systems['SYS-0'])
+
+# The applications get a decoded frame straight into dmrd_received
+def app_runner(_system):
+    _streams = make_streams()
+    _state = {'NEXT': 0}
+    def run():
+        _call = _streams[_state['NEXT'] % STREAMS]
+        _state['NEXT'] += 1
+        for _data in _call:
+            _system.dmrd_received(DMRD(_data))
+        return len(_call)
+    return run
+
+def case_acl_check(_size, _logger):
+    _acl = acl_build('PERMIT:' + ','.join('{}-{}'.format(RF_SRC + _id * 10, RF_SRC + _id * 10 + 4) for _id in range(_size)))
+    _ids = [hex_str_3(RF_SRC + _id * 10 + _offset) for _id in range(0, _size, max(1, _size // 50)) for _offset in (2, 7)]
+    def run():
+        for _id in _ids:
+            acl_check(_id, _acl)
+        return len(_ids)
+    return run
+
+def case_master(_size, _logger):
+    _config = make_config(1)
+    systems.clear()
+    _master = systems['SYS-0'] = HBSYSTEM('SYS-0', _config, _logger, None)
+    _master.transport = FANOUTTRANSPORT('SYS-0')
+    if hb_fanout.AVAILABLE:
+        _master._fanout = COUNTINGFANOUT(_master.transport)
+    for _client in range(_size):
+        _master._clients.connected(_master._clients.add(hex_str_4(RADIO_ID + _client), '127.1.{}.{}'.format(_client >> 8, _client & 0xFF), _master.transport.port))
+    _source = ('127.1.0.0', _master.transport.port)
+    _streams = make_streams()
+    _state = {'NEXT': 0}
+    def run():
+        _call = _streams[_state['NEXT'] % STREAMS]
+        _state['NEXT'] += 1
+        for _data in _call:
+            _master.datagramReceived(_data, _source)
+        return len(_call)
+    return run
+
+CASES = (
+    ('confbridge', case_confbridge),
+    ('router', case_router),
+    ('bridge_all', case_bridge_all),
+    ('acl_check', case_acl_check),
+    ('master', case_master),
+)
+
+
+#************************************************
+#     RUNNING AND COMPARING
+#************************************************
+
+def bench(_case, _size, _seconds, _repeats, _logger):
+    _run = _case(_size, _logger)
+    _run()                                  # warm up, and first-call setup out of the way
+    _best = None
+    for _repeat in range(_repeats):
+        _before = sent()
+        _frames = 0
+        _start = time()
+        while True:
+            _frames += _run()
+            _elapsed = time() - _start
+            if _elapsed >= _seconds:
+                break
+        _result = {
+            'FRAMES': _frames,
+            'SECONDS': _elapsed,
+            'FPS': _frames / _elapsed,
+            'US_PER_FRAME': _elapsed / _frames * 1e6,
+            'SENT_PER_FRAME': float(sent() - _before) / _frames,
+        }
+        if _best is None or _result['FPS'] > _best['FPS']:
+            _best = _result
+    return _best
+
+# Cases that are slower than in _old by more than _tolerance, as
+# (case, size, old frames/s, new frames/s)
+def compare(_old, _new, _tolerance):
+    _slower = []
+    for _case in sorted(_new['RESULTS']):
+        # Repeating with and without sendmmsg() are different things to time
+        if _case == 'master' and _old.get('FANOUT') != _new['FANOUT']:
+            print('{:<12} not compared, FANOUT was {}'.format(_case, _old.get('FANOUT')))
+            continue
+        for _size in sorted(_new['RESULTS'][_case], key=int):
+            _old_result = _old['RESULTS'].get(_case, {}).get(_size)
+            if _old_result is None:
+                continue
+            _old_fps, _new_fps = _old_result['FPS'], _new['RESULTS'][_case][_size]['FPS']
+            print('{:<12} {:>6}  {:>12.0f} -> {:>12.0f} frames/s  {:+7.1f}%'.format(_case, _size, _old_fps, _new_fps, (_new_fps / _old_fps - 1) * 100))
+            if _new_fps < _old_fps * (1 - _tolerance):
+                _slower.append((_case, _size, _old_fps, _new_fps))
+    return _slower
+
+
+#************************************************
+#      MAIN PROGRAM LOOP STARTS HERE
+#************************************************
+
+if __name__ == '__main__':
+
+    import os
+
+    # Run from our own directory, for the ACL file and the applications
+    os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
+
+    def size_list(_string):
+        return [int(_size) for _size in _string.split(',')]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--cases', action='store', dest='CASES', default=','.join(_name for _name, _case in CASES), help='Comma separated cases to run (default all)')
+    parser.add_argument('-s', '--sizes', action='store', dest='SIZES', type=size_list, default=list(SIZES), help='Comma separated rule set sizes (default 10,100,1000,10000)')
+    parser.add_argument('-t', '--time', action='store', dest='TIME', type=float, default=1.0, help='Seconds to run each case for (default 1)')
+    parser.add_argument('-r', '--repeats', action='store', dest='REPEATS', type=int, default=3, help='Times to run each case, the fastest is kept (default 3)')
+    parser.add_argument('-o', '--output', action='store', dest='OUTPUT', help='Write the results to this JSON file')
+    parser.add_argument('--compare', action='store', dest='COMPARE', help='Compare with the results in this JSON file')
+    parser.add_argument('--tolerance', action='store', dest='TOLERANCE', type=float, default=0.1, help='Fraction slower than the comparison that counts as a regression (default 0.1)')
+    parser.add_argument('--label', action='store', dest='LABEL', default='', help='Anything to remember the run by, e.g. a version')
+    cli_args = parser.parse_args()
+
+    # The applications log at INFO on every call -- with nobody listening, so
+    # the cost is the same as a production system logging at WARNING
+    logger = logging.getLogger('hb_bench')
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+
+    _cases = dict(CASES)
+    _selected = cli_args.CASES.split(',')
+    for _name in _selected:
+        if _name not in _cases:
+            sys.exit('Unknown case {}, choose from: {}'.format(_name, ', '.join(_name for _name, _case in CASES)))
+
+    results = {
+        'BENCH_VERSION': BENCH_VERSION,
+        'LABEL': cli_args.LABEL,
+        'TIME': time(),
+        'PYTHON': platform.python_version(),
+        'IMPLEMENTATION': platform.python_implementation(),
+        'MACHINE': platform.machine(),
+        'PLATFORM': platform.platform(),
+        'FANOUT': hb_fanout.AVAILABLE,
+        'RESULTS': {},
+    }
+
+    print('{:<12} {:>6}  {:>12} {:>12} {:>8}'.format('CASE', 'SIZE', 'FRAMES/S', 'US/FRAME', 'SENT'))
+    for _name, _case in CASES:
+        if _name not in _selected:
+            continue
+        results['RESULTS'][_name] = {}
+        for _size in cli_args.SIZES:
+            _result = results['RESULTS'][_name][str(_size)] = bench(_case, _size, cli_args.TIME, cli_args.REPEATS, logger)
+            print('{:<12} {:>6}  {:>12.0f} {:>12.2f} {:>8.1f}'.format(_name, _size, _result['FPS'], _result['US_PER_FRAME'], _result['SENT_PER_FRAME']))
+
+    if cli_args.OUTPUT:
+        with open(cli_args.OUTPUT, 'w') as _file:
+            json.dump(results, _file, indent=2, sort_keys=True, separators=(',', ': '))
+
+    if cli_args.COMPARE:
+        with open(cli_args.COMPARE) as _file:
+            _old = json.load(_file)
+        print('\nCompared with {} ({})'.format(cli_args.COMPARE, _old.get('LABEL') or 'no label'))
+        _slower = compare(_old, results, cli_args.TOLERANCE)
+        if _slower:
+            print('\n{} cases more than {:.0f}% slower:'.format(len(_slower), cli_args.TOLERANCE * 100))
+            for _case, _size, _old_fps, _new_fps in _slower:
+                print('    {} at {}: {:.0f} -> {:.0f} frames/s'.format(_case, _size, _old_fps, _new_fps))
+            sys.exit(1)
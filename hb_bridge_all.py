@@ -34,6 +34,7 @@ from __future__ import print_function
 
 # Python modules we need
 import sys
+import logging
 from bitarray import bitarray
 from time import time
 from importlib import import_module
@@ -45,8 +46,9 @@ from twisted.protocols.basic import NetstringReceiver
 from twisted.internet import reactor, task
 
 # Things we import from the main hblink module
-from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports
-from dmr_utils.utils import hex_str_3, int_id, get_alias
+from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports, rebuild_config, reload_systems
+from hb_alias import ALIAS, ID
+from dmr_utils.utils import hex_str_3, int_id
 from dmr_utils import decode, bptc, const
 from acl import acl_check, acl_build
 import hb_config
@@ -78,6 +80,55 @@ def import_rules(_rules):
         return rules_file
 
 
+# Build the ACLs from the rules file, with PERMIT:ALL for GLOBAL and for
+# every system that doesn't have its own
+def make_acl(_rules_file, _config = None):
+    _config = _config or CONFIG
+    _acl = {}
+    for acl_type in _rules_file.ACL:
+        if acl_type != 'SID' and acl_type != 'TGID':
+            sys.exit(('TERMINATE: SID or TGID stanzas not in ACL!!! Exiting to save you grief later'))
+        _acl[acl_type] = {'GLOBAL': {1: acl_build('PERMIT:ALL'), 2: acl_build('PERMIT:ALL')}}
+        
+        for system_acl in _rules_file.ACL[acl_type]:
+            if system_acl not in _config['SYSTEMS'] and system_acl != 'GLOBAL':
+                sys.exit(('TERMINATE: {} ACL configured for system {} that does not exist!!! Exiting to save you grief later'.format(acl_type, system_acl)))
+            _acl[acl_type][system_acl] = {}
+            for slot in _rules_file.ACL[acl_type][system_acl]:
+                _acl[acl_type][system_acl][slot] = acl_build(_rules_file.ACL[acl_type][system_acl][slot])
+            
+    for system in _config['SYSTEMS']:
+        for acl_type in _acl:
+            if system not in _acl[acl_type]:
+                logger.warning('No %s  ACL for system %s - initializing \'PERMIT:ALL\'', acl_type, system)
+                _acl[acl_type].update({system: {1: acl_build('PERMIT:ALL'), 2: acl_build('PERMIT:ALL')}})
+    return _acl
+
+
+# Re-read the config file and the ACLs (SIGHUP or RELOAD) and put them in
+# place without a restart. Nothing changes if either of them won't load.
+def reload_config(_config_file, _log_level):
+    logger.info('RELOAD: reading %s', _config_file)
+    _new_config = rebuild_config(_config_file, logger, _log_level)
+    if not _new_config:
+        return
+    try:
+        if 'hb_bridge_all_rules' in sys.modules:
+            reload(sys.modules['hb_bridge_all_rules'])
+        _acl = make_acl(import_rules('hb_bridge_all_rules'), _new_config)
+    except (SystemExit, Exception) as err:
+        logger.error('RELOAD: ACL not usable, nothing changed: %s', err)
+        return
+
+    def swap():
+        global ACL
+        ACL = _acl
+        logger.info('RELOAD: ACL replaced')
+
+    if reload_systems(CONFIG, _new_config, logger, report_server, bridgeallSYSTEM, swap) and CONFIG['REPORTS']['REPORT']:
+        report_server.send_config()
+
+
 class bridgeallSYSTEM(HBSYSTEM):
     
     def __init__(self, _name, _config, _logger, _report):
@@ -133,10 +184,21 @@ class bridgeallSYSTEM(HBSYSTEM):
                 }
             }
 
-    def dmrd_received(self, _radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data):
+    def dmrd_received(self, _frame):
         pkt_time = time()
-        dmrpkt = _data[20:53]
-        _bits = int_id(_data[15])
+        _radio_id   = _frame.radio_id
+        _rf_src     = _frame.rf_src
+        _dst_id     = _frame.dst_id
+        _seq        = _frame.seq
+        _slot       = _frame.slot
+        _call_type  = _frame.call_type
+        _frame_type = _frame.frame_type
+        _dtype_vseq = _frame.dtype_vseq
+        _stream_id  = _frame.stream_id
+        _data       = _frame.data
+        dmrpkt = _frame.payload
+        _bits = _frame.bits
+        _metrics = self._metrics.slot[_slot]
 
         if _call_type == 'group':
             
@@ -145,12 +207,14 @@ class bridgeallSYSTEM(HBSYSTEM):
                 if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                     self._logger.warning('(%s) Group Voice Call ***REJECTED BY INGRESS GLOBAL ACL***    SID: %s SLOT: %s HBP Peer %s', self._system, int_id(_rf_src), _slot, int_id(_radio_id))
                     self.STATUS[_slot]['RX_STREAM_ID'] = _stream_id
+                _metrics.drop_acl += 1
                 return
             # Check for SYSTEM Subscriber ID ACL Match
             if acl_check(_rf_src, ACL['SID'][self._system][_slot]) == False:
                 if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                     self._logger.warning('(%s) Group Voice Call ***REJECTED BY INGRESS SYSTEM ACL***    SID: %s SLOT: %s HBP Peer %s', self._system, int_id(_rf_src), _slot, int_id(_radio_id))
                     self.STATUS[_slot]['RX_STREAM_ID'] = _stream_id
+                _metrics.drop_acl += 1
                 return
             
             # Check for GLOBAL Talkgroup ID ACL Match    
@@ -158,25 +222,29 @@ class bridgeallSYSTEM(HBSYSTEM):
                 if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                     self._logger.warning('(%s) Group Voice Call ***REJECTED BY INGRESS GLOBAL ACL***    TGID: %s SLOT: %s HBP Peer %s', self._system, int_id(_dst_id), _slot, int_id(_radio_id))
                     self.STATUS[_slot]['RX_STREAM_ID'] = _stream_id
+                _metrics.drop_acl += 1
                 return
             # Check for SYSTEM Talkgroup ID ID ACL Match
             if acl_check(_dst_id, ACL['TGID'][self._system][_slot]) == False:
                 if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                     self._logger.warning('(%s) Group Voice Call ***REJECTED BY INGRESS SYSTEM ACL***    TGID: %s SLOT: %s HBP Peer %s', self._system, int_id(_dst_id), _slot, int_id(_radio_id))
                     self.STATUS[_slot]['RX_STREAM_ID'] = _stream_id
+                _metrics.drop_acl += 1
                 return
             
             # Is this is a new call stream?
             if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                 self.STATUS['RX_START'] = pkt_time
-                self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
-                        self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
+                            self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot)
             
             # Final actions - Is this a voice terminator?
             if (_frame_type == hb_const.HBPF_DATA_SYNC) and (_dtype_vseq == hb_const.HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != hb_const.HBPF_SLT_VTERM):
                 call_duration = pkt_time - self.STATUS['RX_START']
-                self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
-                        self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot, call_duration)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
+                            self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot, call_duration)
             
             # Mark status variables for use later
             self.STATUS[_slot]['RX_RFS']       = _rf_src
@@ -197,12 +265,14 @@ class bridgeallSYSTEM(HBSYSTEM):
                             if (_stream_id != _target_status[_slot]['TX_STREAM_ID']):
                                 self._logger.warning('(%s) Group Voice Call ***REJECTED BY EGRESS GLOBAL ACL***    SID: %s SLOT: %s HBP Peer %s', _target, int_id(_rf_src), _slot, int_id(_radio_id))
                                 _target_status[_slot]['TX_STREAM_ID'] = _stream_id
+                            _metrics.drop_acl += 1
                             return
                         # Check for SYSTEM Subscriber ID ACL Match
                         if acl_check(_rf_src, ACL['SID'][_target][_slot]) == False:
                             if (_stream_id != _target_status[_slot]['TX_STREAM_ID']):
                                 self._logger.warning('(%s) Group Voice Call ***REJECTED BY EGRESS SYSTEM ACL***    SID: %s SLOT: %s HBP Peer %s', _target, int_id(_rf_src), _slot, int_id(_radio_id))
                                 _target_status[_slot]['TX_STREAM_ID'] = _stream_id
+                            _metrics.drop_acl += 1
                             return
             
                         # Check for GLOBAL Talkgroup ID ACL Match    
@@ -210,16 +280,22 @@ class bridgeallSYSTEM(HBSYSTEM):
                             if (_stream_id != _target_status[_slot]['TX_STREAM_ID']):
                                 self._logger.warning('(%s) Group Voice Call ***REJECTED BY EGRESS GLOBAL ACL***    TGID: %s SLOT: %s HBP Peer %s', _target, int_id(_dst_id), _slot, int_id(_radio_id))
                                 _target_status[_slot]['TX_STREAM_ID'] = _stream_id
+                            _metrics.drop_acl += 1
                             return
                         # Check for SYSTEM Talkgroup ID ID ACL Match
                         if acl_check(_dst_id, ACL['TGID'][_target][_slot]) == False:
                             if (_stream_id != _target_status[_slot]['TX_STREAM_ID']):
                                 self._logger.warning('(%s) Group Voice Call ***REJECTED BY EGRESS SYSTEM ACL***    TGID: %s HBP Peer %s', _target, int_id(_dst_id), int_id(_radio_id))
                                 _target_status[_slot]['TX_STREAM_ID'] = _stream_id
+                            _metrics.drop_acl += 1
                             return
                         
                         systems[_target].send_system(_data)
-                        #self._logger.debug('(%s) Packet routed to system: %s', self._system, _target)
+                        _metrics.fwd_frames += 1
+                        _metrics.fwd_bytes += len(_data)
+                        self._metrics.forwarded(_target, _frame.rx_time, time())
+                        if self._trace.tx:
+                            self._trace.log('tx', 'Packet routed to system: %s', _target)
             
             
             
@@ -235,7 +311,7 @@ if __name__ == '__main__':
     import sys
     import os
     import signal
-    from dmr_utils.utils import try_download, mk_id_dict
+    from hb_alias import ALIASES
     
     # Change the current directory to the location of the application
     os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -271,56 +347,30 @@ if __name__ == '__main__':
         signal.signal(sig, sig_handler)
     
     # ID ALIAS CREATION
-    # Download
-    if CONFIG['ALIASES']['TRY_DOWNLOAD'] == True:
-        # Try updating peer aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'], CONFIG['ALIASES']['PEER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        # Try updating subscriber aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'], CONFIG['ALIASES']['SUBSCRIBER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        
-    # Make Dictionaries
-    peer_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'])
-    if peer_ids:
-        logger.info('ID ALIAS MAPPER: peer_ids dictionary is available')
-        
-    subscriber_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'])
-    if subscriber_ids:
-        logger.info('ID ALIAS MAPPER: subscriber_ids dictionary is available')
-    
-    talkgroup_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['TGID_FILE'])
-    if talkgroup_ids:
-        logger.info('ID ALIAS MAPPER: talkgroup_ids dictionary is available')
+    # Start on the aliases already indexed; downloading and indexing new ones
+    # happens in a thread, and they're swapped in when they're ready
+    def set_aliases(_tables):
+        global peer_ids, subscriber_ids, talkgroup_ids
+        peer_ids, subscriber_ids, talkgroup_ids = _tables['PEER'], _tables['SUBSCRIBER'], _tables['TGID']
+
+    ALIASES(CONFIG['ALIASES'], logger, set_aliases).start()
         
     # Import rules file
     rules_file = import_rules('hb_bridge_all_rules')
         
     # Create ACLs
-    ACL = rules_file.ACL
-    
-    for acl_type in ACL:
-        if acl_type != 'SID' and acl_type != 'TGID':
-            sys.exit(('TERMINATE: SID or TGID stanzas not in ACL!!! Exiting to save you grief later'))
-        
-        if 'GLOBAL' not in ACL[acl_type]:
-            ACL[acl_type].update({'GLOBAL': {1:'PERMIT:ALL',2:'PERMIT:ALL'}})
-            
-        for system_acl in ACL[acl_type]:
-            if system_acl not in CONFIG['SYSTEMS'] and system_acl != 'GLOBAL':
-                sys.exit(('TERMINATE: {} ACL configured for system {} that does not exist!!! Exiting to save you grief later'.format(acl_type, system_acl)))
-            for slot in ACL[acl_type][system_acl]:
-                ACL[acl_type][system_acl][slot] = acl_build(ACL[acl_type][system_acl][slot])
-            
-    for system in CONFIG['SYSTEMS']:
-        for acl_type in ACL:
-            if system not in ACL[acl_type]:
-                logger.warning('No %s  ACL for system %s - initializing \'PERMIT:ALL\'', acl_type, system)
-                ACL[acl_type].update({system: {1: acl_build('PERMIT:ALL'), 2: acl_build('PERMIT:ALL')}})
+    ACL = make_acl(rules_file)
     
     # INITIALIZE THE REPORTING LOOP
     report_server = config_reports(CONFIG, logger, reportFactory)
     
+    # Reload the config file and ACLs on SIGHUP or RELOAD
+    def reload_handler(_signal, _frame):
+        reactor.callFromThread(reload_config, cli_args.CONFIG_FILE, cli_args.LOG_LEVEL)
+
+    signal.signal(signal.SIGHUP, reload_handler)
+    report_server.reload = lambda: reload_config(cli_args.CONFIG_FILE, cli_args.LOG_LEVEL)
+
     # HBlink instance creation
     logger.info('HBlink \'hb_bridge_all.py\' (c) 2016 N0MJS & the K0USY Group - SYSTEM STARTING...')
     for system in CONFIG['SYSTEMS']:
@@ -0,0 +1,132 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Packet capture files. A system with CAPTURE set appends every datagram it
+receives, before anything else looks at it, so the file can be fed back
+through hb_replay.py to reproduce the traffic offline.
+
+All fields are little-endian.
+
+    Header, 8 bytes
+        0   4   'HBCP'
+        4   2   version (1)
+        6   2   record header size (14)
+
+    Records, one after another
+        0   8   time received (float, seconds since the epoch)
+        8   2   source port
+        10  1   length of the system name
+        11  1   length of the source address (4 for IPv4, 16 for IPv6)
+        12  2   length of the datagram
+        14  -   system name, source address, datagram
+
+Writes are buffered -- a capture is only complete once the program has
+exited cleanly (the file is flushed and closed at exit). Starting again adds
+to the same file; a record left half written by a crash is cut off first.
+'''
+
+import atexit
+import os
+import socket
+from struct import Struct
+from time import time
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+CAPTURE_VERSION = 1
+
+_HEADER = Struct('<4sHH')
+_RECORD = Struct('<dHBBH')
+
+# One writer per capture file, shared by every system capturing to it
+_writers = {}
+
+def get_writer(_file, _append = True):
+    if _file not in _writers:
+        _writers[_file] = CAPTUREWRITER(_file, _append)
+        atexit.register(_writers[_file].close)
+    return _writers[_file]
+
+
+# How much of an existing capture file is whole records, so appending starts
+# on a record boundary
+def _complete_length(_file):
+    with open(_file, 'rb') as _handle:
+        _header = _handle.read(_HEADER.size)
+        if len(_header) < _HEADER.size:
+            return 0
+        if _HEADER.unpack(_header) != ('HBCP', CAPTURE_VERSION, _RECORD.size):
+            raise ValueError('{} is not an HBlink capture file'.format(_file))
+        _size = os.fstat(_handle.fileno()).st_size
+        _offset = _HEADER.size
+        while _offset + _RECORD.size <= _size:
+            _handle.seek(_offset)
+            _time, _port, _name_len, _addr_len, _data_len = _RECORD.unpack(_handle.read(_RECORD.size))
+            if _offset + _RECORD.size + _name_len + _addr_len + _data_len > _size:
+                break
+            _offset += _RECORD.size + _name_len + _addr_len + _data_len
+        return _offset
+
+
+class CAPTUREWRITER(object):
+    # _append False starts the file over
+    def __init__(self, _file, _append = True):
+        _length = _complete_length(_file) if _append and os.path.isfile(_file) else 0
+        self._file = open(_file, 'ab', 1 << 16)
+        if _length:
+            self._file.truncate(_length)
+        else:
+            self._file.truncate(0)
+            self._file.write(_HEADER.pack('HBCP', CAPTURE_VERSION, _RECORD.size))
+        self._addrs = {}            # host string -> packed address, hosts repeat a lot
+
+    def write(self, _system, _host, _port, _data, _time=None):
+        _addr = self._addrs.get(_host)
+        if _addr is None:
+            _addr = self._addrs[_host] = socket.inet_pton(socket.AF_INET6 if ':' in _host else socket.AF_INET, _host)
+        self._file.write(_RECORD.pack(time() if _time is None else _time, _port, len(_system), len(_addr), len(_data)) + _system + _addr + _data)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+# Every record in a capture file, in order, as tuples of:
+# (time, system, host, port, data)
+def read_capture(_file):
+    with open(_file, 'rb') as _handle:
+        _magic, _version, _record_size = _HEADER.unpack(_handle.read(_HEADER.size))
+        if _magic != 'HBCP' or _version != CAPTURE_VERSION or _record_size != _RECORD.size:
+            raise ValueError('{} is not an HBlink capture file'.format(_file))
+        while True:
+            _record = _handle.read(_RECORD.size)
+            if len(_record) < _RECORD.size:
+                return
+            _time, _port, _name_len, _addr_len, _data_len = _RECORD.unpack(_record)
+            _rest = _handle.read(_name_len + _addr_len + _data_len)
+            if len(_rest) < _name_len + _addr_len + _data_len:
+                return              # Cut short, the writer didn't exit cleanly
+            _host = socket.inet_ntop(socket.AF_INET6 if _addr_len == 16 else socket.AF_INET, _rest[_name_len:_name_len + _addr_len])
+            yield _time, _rest[:_name_len], _host, _port, _rest[_name_len + _addr_len:]
@@ -0,0 +1,259 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+The client registry for MASTER systems. Each repeater logged in to a master
+is an HBCLIENT record, and the registry indexes them both by radio ID and by
+the (host, port) they talk to us from. A packet can then be validated with
+one dictionary probe on the source address instead of four lookups and three
+string compares.
+
+Clients that stop pinging are found with a heap of deadlines rather than by
+looking at every client on every maintenance run. There is one heap entry per
+client, and a ping only moves last_ping -- nothing is pushed. When an entry
+comes due, the client is either expired or, if it has pinged since, pushed
+back with its new deadline. Each run only touches clients whose deadline has
+actually passed.
+
+For reporting, the registry pickles as the same dictionary of dictionaries
+that used to live in CONFIG['SYSTEMS'][system]['CLIENTS'], so anything on the
+other end of the reporting socket does not need to know this module exists.
+Between those full snapshots it keeps track of which clients changed, went
+away or pinged, so the reporting loop can send just that (CONFIG_UPD).
+'''
+
+from heapq import heapify, heappush, heappop
+from itertools import count
+from random import randint
+from time import time
+
+from dmr_utils.utils import int_id
+
+import hb_const
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+class HBCLIENT(object):
+    __slots__ = ('radio_id', 'connection', 'pings_received', 'last_ping', 'ip', 'port', 'salt',
+                 'callsign', 'rx_freq', 'tx_freq', 'tx_power', 'colorcode', 'latitude', 'longitude',
+                 'height', 'location', 'description', 'slots', 'url', 'software_id', 'package_id',
+                 'fanout')
+
+    def __init__(self, _radio_id, _ip, _port):
+        self.radio_id = _radio_id
+        self.connection = hb_const.HBPC_RPTL_RECEIVED
+        self.pings_received = 0
+        self.last_ping = time()
+        self.ip = _ip
+        self.port = _port
+        self.salt = randint(0,0xFFFFFFFF)
+        self.callsign = ''
+        self.rx_freq = ''
+        self.tx_freq = ''
+        self.tx_power = ''
+        self.colorcode = ''
+        self.latitude = ''
+        self.longitude = ''
+        self.height = ''
+        self.location = ''
+        self.description = ''
+        self.slots = ''
+        self.url = ''
+        self.software_id = ''
+        self.package_id = ''
+        self.fanout = None      # Cached by hb_fanout the first time we repeat to this client
+
+    # Pull the repeater configuration out of an RPTC packet
+    def configure(self, _data):
+        self.callsign = _data[8:16]
+        self.rx_freq = _data[16:25]
+        self.tx_freq =  _data[25:34]
+        self.tx_power = _data[34:36]
+        self.colorcode = _data[36:38]
+        self.latitude = _data[38:46]
+        self.longitude = _data[46:55]
+        self.height = _data[55:58]
+        self.location = _data[58:78]
+        self.description = _data[78:97]
+        self.slots = _data[97:98]
+        self.url = _data[98:222]
+        self.software_id = _data[222:262]
+        self.package_id = _data[262:302]
+
+    # The dictionary form reporting clients expect
+    def export(self):
+        return {
+            'CONNECTION': hb_const.HBPC_STATES[self.connection],
+            'PINGS_RECEIVED': self.pings_received,
+            'LAST_PING': self.last_ping,
+            'IP': self.ip,
+            'PORT': self.port,
+            'SALT': self.salt,
+            'RADIO_ID': str(int_id(self.radio_id)),
+            'CALLSIGN': self.callsign,
+            'RX_FREQ': self.rx_freq,
+            'TX_FREQ': self.tx_freq,
+            'TX_POWER': self.tx_power,
+            'COLORCODE': self.colorcode,
+            'LATITUDE': self.latitude,
+            'LONGITUDE': self.longitude,
+            'HEIGHT': self.height,
+            'LOCATION': self.location,
+            'DESCRIPTION': self.description,
+            'SLOTS': self.slots,
+            'URL': self.url,
+            'SOFTWARE_ID': self.software_id,
+            'PACKAGE_ID': self.package_id,
+        }
+
+
+class HBCLIENTS(object):
+    def __init__(self, _timeout):
+        self._by_id = {}
+        self._by_addr = {}
+        self._timeout = _timeout
+        self._deadlines = []        # heap of (deadline, tie breaker, client)
+        self._order = count()
+        self.shard = None       # hb_shard.SHARDTABLE when this master is sharded
+        self._changed = set()   # radio IDs added or changed since the last changes()
+        self._removed = set()   # ... removed
+        self._pinged = set()    # ... heard from, only last_ping and pings_received are new
+
+    def __contains__(self, _radio_id):
+        return _radio_id in self._by_id
+
+    def __getitem__(self, _radio_id):
+        return self._by_id[_radio_id]
+
+    def __iter__(self):
+        return iter(self._by_id)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    # Pickle as a plain dictionary so the reporting side sees what it always has
+    def __reduce__(self):
+        return (dict, (self.export(),))
+
+    def get(self, _radio_id):
+        return self._by_id.get(_radio_id)
+
+    def values(self):
+        return self._by_id.values()
+
+    # A new login replaces whatever was there before for the same radio ID, or
+    # from the same host and port -- one HBP peer per UDP socket.
+    def add(self, _radio_id, _ip, _port):
+        self.remove(_radio_id)
+        _stale = self._by_addr.get((_ip, _port))
+        if _stale is not None:
+            self.remove(_stale.radio_id)
+        _client = HBCLIENT(_radio_id, _ip, _port)
+        self._by_id[_radio_id] = _client
+        self._by_addr[(_ip, _port)] = _client
+        self._changed.add(_radio_id)
+        self._removed.discard(_radio_id)
+        heappush(self._deadlines, (_client.last_ping + self._timeout, next(self._order), _client))
+        return _client
+
+    def remove(self, _radio_id):
+        _client = self._by_id.pop(_radio_id, None)
+        if _client is not None:
+            del self._by_addr[(_client.ip, _client.port)]
+            self._changed.discard(_radio_id)
+            self._pinged.discard(_radio_id)
+            self._removed.add(_radio_id)
+            if self.shard:
+                self.shard.withdraw(_radio_id)
+        return _client
+
+    # We've heard from the client (RPTK, RPTC or RPTP). Its heap entry is left
+    # where it is and sorted out when it comes due.
+    def touch(self, _client):
+        _client.last_ping = time()
+        self._pinged.add(_client.radio_id)
+
+    # Anything else about the client has been changed, e.g. its connection state
+    def changed(self, _client):
+        self._changed.add(_client.radio_id)
+
+    # A new timeout counts for every client from its last ping
+    def set_timeout(self, _timeout):
+        self._timeout = _timeout
+        self._deadlines = [(_client.last_ping + _timeout, next(self._order), _client) for _client in self._by_id.itervalues()]
+        heapify(self._deadlines)
+
+    # Remove and return every client that hasn't been heard from in _timeout
+    # seconds. Entries for clients that have since been removed or replaced
+    # are simply dropped.
+    def expire(self, _now):
+        _expired = []
+        _deadlines = self._deadlines
+        while _deadlines and _deadlines[0][0] <= _now:
+            _client = heappop(_deadlines)[2]
+            if self._by_id.get(_client.radio_id) is not _client:
+                continue
+            _deadline = _client.last_ping + self._timeout
+            if _deadline > _now:
+                heappush(_deadlines, (_deadline, next(self._order), _client))
+            else:
+                self.remove(_client.radio_id)
+                _expired.append(_client)
+        return _expired
+
+    # The client has completed login and sent its configuration
+    def connected(self, _client):
+        _client.connection = hb_const.HBPC_YES
+        self._changed.add(_client.radio_id)
+        if self.shard:
+            self.shard.publish(_client)
+
+    # Clients logged in to this master in other shard workers, if any
+    def peers(self):
+        if self.shard:
+            return self.shard.peers()
+        return []
+
+    # Returns the client if _radio_id is logged in from _ip:_port in state _state,
+    # otherwise None. This is the single hash probe per packet.
+    def validate(self, _radio_id, _ip, _port, _state):
+        _client = self._by_addr.get((_ip, _port))
+        if _client is not None and _client.radio_id == _radio_id and _client.connection == _state:
+            return _client
+        return None
+
+    def export(self):
+        return dict((_radio_id, _client.export()) for _radio_id, _client in self._by_id.iteritems())
+
+    # What happened since the last call, and start over: the changed clients
+    # in full, the radio IDs removed, and (pings received, last ping) for
+    # clients that only pinged. There is one caller, the reporting loop.
+    def changes(self):
+        _changed = dict((_radio_id, self._by_id[_radio_id].export()) for _radio_id in self._changed)
+        _pinged = dict((_radio_id, (self._by_id[_radio_id].pings_received, self._by_id[_radio_id].last_ping)) for _radio_id in self._pinged.difference(self._changed))
+        _removed = list(self._removed)
+        self._changed = set()
+        self._removed = set()
+        self._pinged = set()
+        return _changed, _removed, _pinged
@@ -35,6 +35,7 @@ from __future__ import print_function
 
 # Python modules we need
 import sys
+import logging
 from bitarray import bitarray
 from time import time
 from importlib import import_module
@@ -45,8 +46,9 @@ from twisted.protocols.basic import NetstringReceiver
 from twisted.internet import reactor, task
 
 # Things we import from the main hblink module
-from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports
-from dmr_utils.utils import hex_str_3, int_id, get_alias
+from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports, subset, subset_update, rebuild_config, reload_systems
+from hb_alias import ALIAS, ID
+from dmr_utils.utils import hex_str_3, int_id
 from dmr_utils import decode, bptc, const
 import hb_config
 import hb_log
@@ -66,11 +68,15 @@ __status__     = 'pre-alpha'
 
 # Module gobal varaibles
 
+# Bridges whose rules changed state since the last BRIDGE_UPD
+BRIDGES_CHANGED = set()
+
 # Import Bridging rules
 # Note: A stanza *must* exist for any MASTER or CLIENT configured in the main
 # configuration file and listed as "active". It can be empty, 
 # but it has to exist.
-def make_bridges(_hb_confbridge_bridges):
+def make_bridges(_hb_confbridge_bridges, _config = None):
+    _config = _config or CONFIG
     try:
         bridge_file = import_module(_hb_confbridge_bridges)
         logger.info('Routing bridges file found and bridges imported')
@@ -81,7 +87,7 @@ def make_bridges(_hb_confbridge_bridges):
     # we need to send in the actual data packets.
     for _bridge in bridge_file.BRIDGES:
         for _system in bridge_file.BRIDGES[_bridge]:
-            if _system['SYSTEM'] not in CONFIG['SYSTEMS']:
+            if _system['SYSTEM'] not in _config['SYSTEMS']:
                 sys.exit('ERROR: Conference bridges found for system not configured main configuration')
                 
             _system['TGID']       = hex_str_3(_system['TGID'])
@@ -99,7 +105,8 @@ def make_bridges(_hb_confbridge_bridges):
 # ACL may be a single list of subscriber IDs
 # Global action is to allow or deny them. Multiple lists with different actions and ranges
 # are not yet implemented.
-def build_acl(_sub_acl):
+# Builds the ACL and the function that checks it, without putting either in place
+def make_acl(_sub_acl):
     try:
         logger.info('ACL file found, importing entries. This will take about 1.5 seconds per 1 million IDs')
         acl_file = import_module(_sub_acl)
@@ -126,7 +133,6 @@ def build_acl(_sub_acl):
 
     # Depending on which type of ACL is used (PERMIT, DENY... or there isn't one)
     # define a differnet function to be used to check the ACL
-    global allow_sub
     if ACL_ACTION == 'PERMIT':
         def allow_sub(_sub):
             if _sub in ACL:
@@ -143,9 +149,58 @@ def build_acl(_sub_acl):
         def allow_sub(_sub):
             return True
     
+    return ACL, allow_sub
+
+
+# Put the ACL from make_acl() in place
+def build_acl(_sub_acl):
+    global allow_sub
+    ACL, allow_sub = make_acl(_sub_acl)
     return ACL
 
 
+# Bridge rules that are still there after a reload keep their state: whether
+# they are ACTIVE, and when their timer runs out
+def carry_bridges(_old, _new):
+    for _bridge in _new:
+        _was = dict(((_system['SYSTEM'], _system['TS'], _system['TGID'], _system['TO_TYPE']), _system) for _system in _old.get(_bridge, []))
+        for _system in _new[_bridge]:
+            _key = (_system['SYSTEM'], _system['TS'], _system['TGID'], _system['TO_TYPE'])
+            if _key in _was:
+                _system['ACTIVE'] = _was[_key]['ACTIVE']
+                _system['TIMER'] = _was[_key]['TIMER']
+    return _new
+
+
+# Re-read the config file, the bridges and the ACL (SIGHUP or RELOAD) and put
+# them in place without a restart. Nothing changes if any of them won't load.
+def reload_config(_config_file, _log_level):
+    logger.info('RELOAD: reading %s', _config_file)
+    _new_config = rebuild_config(_config_file, logger, _log_level)
+    if not _new_config:
+        return
+    try:
+        for _module in ('hb_confbridge_rules', 'sub_acl'):
+            if _module in sys.modules:
+                reload(sys.modules[_module])
+        _bridges = make_bridges('hb_confbridge_rules', _new_config)
+        _acl, _allow_sub = make_acl('sub_acl')
+    except (SystemExit, Exception) as err:
+        logger.error('RELOAD: bridges or ACL not usable, nothing changed: %s', err)
+        return
+
+    def swap():
+        global BRIDGES, ACL, allow_sub
+        BRIDGES_CHANGED.update(set(BRIDGES) | set(_bridges))
+        BRIDGES = carry_bridges(BRIDGES, _bridges)
+        ACL, allow_sub = _acl, _allow_sub
+        logger.info('RELOAD: bridges and ACL replaced')
+
+    if reload_systems(CONFIG, _new_config, logger, report_server, routerSYSTEM, swap) and CONFIG['REPORTS']['REPORT']:
+        report_server.send_config()
+        report_server.send_bridge()
+
+
 # Run this every minute for rule timer updates
 def rule_timer_loop():
     logger.info('(ALL HBSYSTEMS) Rule timer loop started')
@@ -157,6 +212,7 @@ def rule_timer_loop():
                 if _system['ACTIVE'] == True:
                     if _system['TIMER'] < _now:
                         _system['ACTIVE'] = False
+                        BRIDGES_CHANGED.add(_bridge)
                         logger.info('Conference Bridge TIMEOUT: DEACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
                     else:
                         timeout_in = _system['TIMER'] - _now
@@ -167,6 +223,7 @@ def rule_timer_loop():
                 if _system['ACTIVE'] == False:
                     if _system['TIMER'] < _now:
                         _system['ACTIVE'] = True
+                        BRIDGES_CHANGED.add(_bridge)
                         logger.info('Conference Bridge TIMEOUT: ACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
                     else:
                         timeout_in = _system['TIMER'] - _now
@@ -177,7 +234,7 @@ def rule_timer_loop():
                 logger.debug('Conference Bridge NO ACTION: System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
 
     if CONFIG['REPORTS']['REPORT']:
-        report_server.send_clients('bridge updated')
+        report_server.send_bridge_update()
 
 class routerSYSTEM(HBSYSTEM):
     
@@ -234,30 +291,44 @@ class routerSYSTEM(HBSYSTEM):
                 }
             }
 
-    def dmrd_received(self, _radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data):
+    def dmrd_received(self, _frame):
         pkt_time = time()
-        dmrpkt = _data[20:53]
-        _bits = int_id(_data[15])
+        _radio_id   = _frame.radio_id
+        _rf_src     = _frame.rf_src
+        _dst_id     = _frame.dst_id
+        _seq        = _frame.seq
+        _slot       = _frame.slot
+        _call_type  = _frame.call_type
+        _frame_type = _frame.frame_type
+        _dtype_vseq = _frame.dtype_vseq
+        _stream_id  = _frame.stream_id
+        _data       = _frame.data
+        dmrpkt = _frame.payload
+        _bits = _frame.bits
+        _metrics = self._metrics.slot[_slot]
 
         if _call_type == 'group':
             
             # Check for ACL match, and return if the subscriber is not allowed
             if allow_sub(_rf_src) == False:
                 self._logger.warning('(%s) Group Voice Packet ***REJECTED BY ACL*** From: %s, HBP Peer %s, Destination TGID %s', self._system, int_id(_rf_src), int_id(_radio_id), int_id(_dst_id))
+                _metrics.drop_acl += 1
                 return
             
             # Is this a new call stream?   
             if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                 if (self.STATUS[_slot]['RX_TYPE'] != hb_const.HBPF_SLT_VTERM) and (pkt_time < (self.STATUS[_slot]['RX_TIME'] + hb_const.STREAM_TO)) and (_rf_src != self.STATUS[_slot]['RX_RFS']):
                     self._logger.warning('(%s) Packet received with STREAM ID: %s <FROM> SUB: %s REPEATER: %s <TO> TGID %s, SLOT %s collided with existing call', self._system, int_id(_stream_id), int_id(_rf_src), int_id(_radio_id), int_id(_dst_id), _slot)
+                    _metrics.drop_collision += 1
                     return
                 
                 # This is a new call stream
                 self.STATUS['RX_START'] = pkt_time
-                self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
-                        self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
+                            self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot)
                 if CONFIG['REPORTS']['REPORT']:
-                    self._report.send_bridgeEvent('GROUP VOICE,START,{},{},{},{},{},{}'.format(self._system, int_id(_stream_id), int_id(_radio_id), int_id(_rf_src), _slot, int_id(_dst_id)))
+                    self._report.send_bridgeEvent('GROUP VOICE', 'START', self._system, int_id(_stream_id), int_id(_radio_id), int_id(_rf_src), _slot, int_id(_dst_id))
                 
                 # If we can, use the LC from the voice header as to keep all options intact
                 if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD:
@@ -293,18 +364,22 @@ class routerSYSTEM(HBSYSTEM):
                                     if ((_target['TGID'] != _target_status[_target['TS']]['RX_TGID']) and ((pkt_time - _target_status[_target['TS']]['RX_TIME']) < _target_system['GROUP_HANGTIME'])):
                                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _seq:
                                             self._logger.info('(%s) Call not routed to TGID %s, target active or in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
+                                        _metrics.drop_contention += 1
                                         continue
                                     if ((_target['TGID'] != _target_status[_target['TS']]['TX_TGID']) and ((pkt_time - _target_status[_target['TS']]['TX_TIME']) < _target_system['GROUP_HANGTIME'])):
                                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _seq:
                                             self._logger.info('(%s) Call not routed to TGID%s, target in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']))
+                                        _metrics.drop_contention += 1
                                         continue
                                     if (_target['TGID'] == _target_status[_target['TS']]['RX_TGID']) and ((pkt_time - _target_status[_target['TS']]['RX_TIME']) < hb_const.STREAM_TO):
                                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _seq:
                                             self._logger.info('(%s) Call not routed to TGID%s, matching call already active on target: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
+                                        _metrics.drop_contention += 1
                                         continue
                                     if (_target['TGID'] == _target_status[_target['TS']]['TX_TGID']) and (_rf_src != _target_status[_target['TS']]['TX_RFS']) and ((pkt_time - _target_status[_target['TS']]['TX_TIME']) < hb_const.STREAM_TO):
                                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD and self.STATUS[_slot]['RX_STREAM_ID'] != _seq:
                                             self._logger.info('(%s) Call not routed for subscriber %s, call route in progress on target: HBSystem: %s, TS: %s, TGID: %s, SUB: %s', self._system, int_id(_rf_src), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']), int_id(_target_status[_target['TS']]['TX_RFS']))
+                                        _metrics.drop_contention += 1
                                         continue
                                 
                                     # Set values for the contention handler to test next time there is a frame to forward
@@ -351,17 +426,22 @@ class routerSYSTEM(HBSYSTEM):
                     
                                     # Transmit the packet to the destination system
                                     systems[_target['SYSTEM']].send_system(_tmp_data)
-                                    #self._logger.debug('(%s) Packet routed by bridge: %s to system: %s TS: %s, TGID: %s', self._system, _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
+                                    _metrics.fwd_frames += 1
+                                    _metrics.fwd_bytes += len(_tmp_data)
+                                    self._metrics.forwarded(_target['SYSTEM'], _frame.rx_time, time())
+                                    if self._trace.tx:
+                                        self._trace.log('tx', 'Packet routed by bridge: %s to system: %s TS: %s, TGID: %s', _bridge, _target['SYSTEM'], _target['TS'], int_id(_target['TGID']))
             
             
             
             # Final actions - Is this a voice terminator?
             if (_frame_type == hb_const.HBPF_DATA_SYNC) and (_dtype_vseq == hb_const.HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != hb_const.HBPF_SLT_VTERM):
                 call_duration = pkt_time - self.STATUS['RX_START']
-                self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
-                        self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot, call_duration)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
+                            self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot, call_duration)
                 if CONFIG['REPORTS']['REPORT']:
-                   self._report.send_bridgeEvent('GROUP VOICE,END,{},{},{},{},{},{},{:.2f}'.format(self._system, int_id(_stream_id), int_id(_radio_id), int_id(_rf_src), _slot, int_id(_dst_id), call_duration))
+                   self._report.send_bridgeEvent('GROUP VOICE', 'END', self._system, int_id(_stream_id), int_id(_radio_id), int_id(_rf_src), _slot, int_id(_dst_id), round(call_duration, 2))
                 
                 #
                 # Begin in-band signalling for call end. This has nothign to do with routing traffic directly.
@@ -376,10 +456,12 @@ class routerSYSTEM(HBSYSTEM):
                             # TGID matches a rule source, reset its timer
                             if _slot == _system['TS'] and _dst_id == _system['TGID'] and ((_system['TO_TYPE'] == 'ON' and (_system['ACTIVE'] == True)) or (_system['TO_TYPE'] == 'OFF' and _system['ACTIVE'] == False)):
                                 _system['TIMER'] = pkt_time + _system['TIMEOUT']
+                                BRIDGES_CHANGED.add(_bridge)
                                 self._logger.info('(%s) Transmission match for Bridge: %s. Reset timeout to %s', self._system, _bridge, _system['TIMER'])
             
                             # TGID matches an ACTIVATION trigger
                             if (_dst_id in _system['ON'] or _dst_id in _system['RESET']) and _slot == _system['TS']:
+                                BRIDGES_CHANGED.add(_bridge)
                                 # Set the matching rule as ACTIVE
                                 if _dst_id in _system['ON']:
                                     if _system['ACTIVE'] == False:
@@ -397,6 +479,7 @@ class routerSYSTEM(HBSYSTEM):
                         
                             # TGID matches an DE-ACTIVATION trigger
                             if (_dst_id in _system['OFF']  or _dst_id in _system['RESET']) and _slot == _system['TS']:
+                                BRIDGES_CHANGED.add(_bridge)
                                 # Set the matching rule as ACTIVE
                                 if _dst_id in _system['OFF']:
                                     if _system['ACTIVE'] == True:
@@ -433,12 +516,29 @@ class routerSYSTEM(HBSYSTEM):
 #
 class confbridgeReportFactory(reportFactory):
         
-    def send_bridge(self):
-        serialized = pickle.dumps(BRIDGES, protocol=pickle.HIGHEST_PROTOCOL)
-        self.send_clients(REPORT_OPCODES['BRIDGE_SND']+serialized)
+    # Full snapshot, to the reporting clients given (the one that asked) or to
+    # all of them, after any update due so it is exactly the state at VERSION
+    def send_bridge(self, _clients = None):
+        self.send_bridge_update()
+        _snapshot = {'VERSION': self._versions.get('BRIDGE_UPD', 0), 'BRIDGES': BRIDGES}
+        self.send_filtered('BRIDGE_SND', _snapshot, lambda _snapshot, _topics: {'VERSION': _snapshot['VERSION'], 'BRIDGES': subset(_snapshot['BRIDGES'], _topics[1])}, _clients)
+
+    # Just the bridges that changed, each one in full, and those a reload removed
+    def send_bridge_update(self):
+        if BRIDGES_CHANGED:
+            self.send_update('BRIDGE_UPD', {
+                'BRIDGES': dict((_bridge, BRIDGES[_bridge]) for _bridge in BRIDGES_CHANGED if _bridge in BRIDGES),
+                'REMOVED': [_bridge for _bridge in BRIDGES_CHANGED if _bridge not in BRIDGES],
+            }, lambda _update, _topics: subset_update(_update, _topics[1]))
+            BRIDGES_CHANGED.clear()
+
+    def send_updates(self):
+        reportFactory.send_updates(self)
+        self.send_bridge_update()
         
-    def send_bridgeEvent(self, _data):
-        self.send_clients(REPORT_OPCODES['BRDG_EVENT']+_data)
+    # ('GROUP VOICE', 'START' or 'END', system, ...), see reporting_const
+    def send_bridgeEvent(self, *_event):
+        self.send_event('BRDG_EVENT', _event, _event[2])
 
 
 #************************************************
@@ -451,7 +551,7 @@ if __name__ == '__main__':
     import sys
     import os
     import signal
-    from dmr_utils.utils import try_download, mk_id_dict
+    from hb_alias import ALIASES
     
     # Change the current directory to the location of the application
     os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -487,27 +587,13 @@ if __name__ == '__main__':
         signal.signal(sig, sig_handler)
     
     # ID ALIAS CREATION
-    # Download
-    if CONFIG['ALIASES']['TRY_DOWNLOAD'] == True:
-        # Try updating peer aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'], CONFIG['ALIASES']['PEER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        # Try updating subscriber aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'], CONFIG['ALIASES']['SUBSCRIBER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        
-    # Make Dictionaries
-    peer_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'])
-    if peer_ids:
-        logger.info('ID ALIAS MAPPER: peer_ids dictionary is available')
-        
-    subscriber_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'])
-    if subscriber_ids:
-        logger.info('ID ALIAS MAPPER: subscriber_ids dictionary is available')
-    
-    talkgroup_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['TGID_FILE'])
-    if talkgroup_ids:
-        logger.info('ID ALIAS MAPPER: talkgroup_ids dictionary is available')
+    # Start on the aliases already indexed; downloading and indexing new ones
+    # happens in a thread, and they're swapped in when they're ready
+    def set_aliases(_tables):
+        global peer_ids, subscriber_ids, talkgroup_ids
+        peer_ids, subscriber_ids, talkgroup_ids = _tables['PEER'], _tables['SUBSCRIBER'], _tables['TGID']
+
+    ALIASES(CONFIG['ALIASES'], logger, set_aliases).start()
     
     # Build the routing rules file
     BRIDGES = make_bridges('hb_confbridge_rules')
@@ -517,6 +603,13 @@ if __name__ == '__main__':
     
     # INITIALIZE THE REPORTING LOOP
     report_server = config_reports(CONFIG, logger, confbridgeReportFactory)
+
+    # Reload the config file, bridges and ACL on SIGHUP or RELOAD
+    def reload_handler(_signal, _frame):
+        reactor.callFromThread(reload_config, cli_args.CONFIG_FILE, cli_args.LOG_LEVEL)
+
+    signal.signal(signal.SIGHUP, reload_handler)
+    report_server.reload = lambda: reload_config(cli_args.CONFIG_FILE, cli_args.LOG_LEVEL)
     
     # HBlink instance creation
     logger.info('HBlink \'hb_router.py\' (c) 2016 N0MJS & the K0USY Group - SYSTEM STARTING...')
@@ -29,8 +29,6 @@ change.
 import ConfigParser
 import sys
 
-from socket import gethostbyname 
-
 # Does anybody read this stuff? There's a PEP somewhere that says I should do this.
 __author__     = 'Cortney T. Buffington, N0MJS'
 __copyright__  = 'Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group'
@@ -60,7 +58,10 @@ def build_config(_config_file):
                 CONFIG['GLOBAL'].update({
                     'PATH': config.get(section, 'PATH'),
                     'PING_TIME': config.getint(section, 'PING_TIME'),
-                    'MAX_MISSED': config.getint(section, 'MAX_MISSED')
+                    'MAX_MISSED': config.getint(section, 'MAX_MISSED'),
+                    'SHARDS': config.getint(section, 'SHARDS') if config.has_option(section, 'SHARDS') else 1,
+                    'CAPTURE_FILE': config.get(section, 'CAPTURE_FILE') if config.has_option(section, 'CAPTURE_FILE') else 'hblink.capture',
+                    'DNS_TTL': config.getint(section, 'DNS_TTL') if config.has_option(section, 'DNS_TTL') else 60
                 })
 
             elif section == 'REPORTS':
@@ -68,7 +69,10 @@ def build_config(_config_file):
                     'REPORT': config.getboolean(section, 'REPORT'),
                     'REPORT_INTERVAL': config.getint(section, 'REPORT_INTERVAL'),
                     'REPORT_PORT': config.getint(section, 'REPORT_PORT'),
-                    'REPORT_CLIENTS': config.get(section, 'REPORT_CLIENTS').split(',')
+                    'REPORT_CLIENTS': config.get(section, 'REPORT_CLIENTS').split(','),
+                    'REPORT_QUEUE_BYTES': config.getint(section, 'REPORT_QUEUE_BYTES') if config.has_option(section, 'REPORT_QUEUE_BYTES') else 1048576,
+                    'METRICS_PORT': config.getint(section, 'METRICS_PORT') if config.has_option(section, 'METRICS_PORT') else 0,
+                    'METRICS_IP': config.get(section, 'METRICS_IP') if config.has_option(section, 'METRICS_IP') else '127.0.0.1'
                 })
 
             elif section == 'LOGGER':
@@ -76,7 +80,9 @@ def build_config(_config_file):
                     'LOG_FILE': config.get(section, 'LOG_FILE'),
                     'LOG_HANDLERS': config.get(section, 'LOG_HANDLERS'),
                     'LOG_LEVEL': config.get(section, 'LOG_LEVEL'),
-                    'LOG_NAME': config.get(section, 'LOG_NAME')
+                    'LOG_NAME': config.get(section, 'LOG_NAME'),
+                    'LOG_QUEUE': config.getint(section, 'LOG_QUEUE') if config.has_option(section, 'LOG_QUEUE') else 0,
+                    'LOG_OVERFLOW': config.get(section, 'LOG_OVERFLOW').upper() if config.has_option(section, 'LOG_OVERFLOW') else 'DROP_OLDEST'
                 })
 
             elif section == 'ALIASES':
@@ -93,8 +99,12 @@ def build_config(_config_file):
 
             elif section == 'AMBE':
                 CONFIG['AMBE'].update({
-                    'EXPORT_IP': gethostbyname(config.get(section, 'EXPORT_IP')),
+                    'EXPORT_IP': config.get(section, 'EXPORT_IP'),
                     'EXPORT_PORT': config.getint(section, 'EXPORT_PORT'),
+                    'EXPORT_BUNDLE': config.getboolean(section, 'EXPORT_BUNDLE') if config.has_option(section, 'EXPORT_BUNDLE') else False,
+                    'EXPORT_BACKEND': config.get(section, 'EXPORT_BACKEND').upper() if config.has_option(section, 'EXPORT_BACKEND') else 'UDP',
+                    'RING_FILE': config.get(section, 'RING_FILE') if config.has_option(section, 'RING_FILE') else '/dev/shm/hblink-ambe.ring',
+                    'RING_RECORDS': config.getint(section, 'RING_RECORDS') if config.has_option(section, 'RING_RECORDS') else 4096,
                 })
 
             elif config.getboolean(section, 'ENABLED'):
@@ -104,9 +114,10 @@ def build_config(_config_file):
                         'ENABLED': config.getboolean(section, 'ENABLED'),
                         'LOOSE': config.getboolean(section, 'LOOSE'),
                         'EXPORT_AMBE': config.getboolean(section, 'EXPORT_AMBE'),
-                        'IP': gethostbyname(config.get(section, 'IP')),
+                        'IP': config.get(section, 'IP'),
                         'PORT': config.getint(section, 'PORT'),
-                        'MASTER_IP': gethostbyname(config.get(section, 'MASTER_IP')),
+                        'MASTER_HOST': config.get(section, 'MASTER_IP'),
+                        'MASTER_IP': config.get(section, 'MASTER_IP'),      # resolved from MASTER_HOST at each login
                         'MASTER_PORT': config.getint(section, 'MASTER_PORT'),
                         'PASSPHRASE': config.get(section, 'PASSPHRASE'),
                         'CALLSIGN': config.get(section, 'CALLSIGN').ljust(8)[:8],
@@ -125,7 +136,9 @@ def build_config(_config_file):
                         'SOFTWARE_ID': config.get(section, 'SOFTWARE_ID').ljust(40)[:40],
                         'PACKAGE_ID': config.get(section, 'PACKAGE_ID').ljust(40)[:40],
                         'GROUP_HANGTIME': config.getint(section, 'GROUP_HANGTIME'),
-                        'OPTIONS': config.get(section, 'OPTIONS')
+                        'OPTIONS': config.get(section, 'OPTIONS'),
+                        'TRACE': config.get(section, 'TRACE').split(',') if config.has_option(section, 'TRACE') else [],
+                        'CAPTURE': config.getboolean(section, 'CAPTURE') if config.has_option(section, 'CAPTURE') else False
                     }})
                     CONFIG['SYSTEMS'][section].update({'STATS': {
                         'CONNECTION': 'NO',             # NO, RTPL_SENT, AUTHENTICATED, CONFIG-SENT, YES 
@@ -143,10 +156,12 @@ def build_config(_config_file):
                         'ENABLED': config.getboolean(section, 'ENABLED'),
                         'REPEAT': config.getboolean(section, 'REPEAT'),
                         'EXPORT_AMBE': config.getboolean(section, 'EXPORT_AMBE'),
-                        'IP': gethostbyname(config.get(section, 'IP')),
+                        'IP': config.get(section, 'IP'),
                         'PORT': config.getint(section, 'PORT'),
                         'PASSPHRASE': config.get(section, 'PASSPHRASE'),
-                        'GROUP_HANGTIME': config.getint(section, 'GROUP_HANGTIME')
+                        'GROUP_HANGTIME': config.getint(section, 'GROUP_HANGTIME'),
+                        'TRACE': config.get(section, 'TRACE').split(',') if config.has_option(section, 'TRACE') else [],
+                        'CAPTURE': config.getboolean(section, 'CAPTURE') if config.has_option(section, 'CAPTURE') else False
                     }})
                     CONFIG['SYSTEMS'][section].update({'CLIENTS': {}})
     
@@ -40,10 +40,22 @@ ID_MAX = 16776415
 
 # Timers
 STREAM_TO = .360
+EXPIRY_TICK = 1             # Seconds between MASTER client expiry runs
+UNKNOWN_PDU_INTERVAL = 60   # Seconds between log lines for unrecognized HBP commands
+UNKNOWN_PDU_DUMP = 64       # Bytes of an unrecognized PDU to hex dump in that line
 
 # HomeBrew Protocol Frame Types
 HBPF_VOICE      = 0x0
 HBPF_VOICE_SYNC = 0x1
 HBPF_DATA_SYNC  = 0x2
 HBPF_SLT_VHEAD  = 0x1
-HBPF_SLT_VTERM  = 0x2
\ No newline at end of file
+HBPF_SLT_VTERM  = 0x2
+
+# HomeBrew Protocol client connection states, as tracked by a MASTER
+HBPC_RPTL_RECEIVED  = 0
+HBPC_CHALLENGE_SENT = 1
+HBPC_WAITING_CONFIG = 2
+HBPC_YES            = 3
+
+# Names the states are reported as -- indexed by the values above
+HBPC_STATES = ('RPTL-RECEIVED', 'CHALLENGE_SENT', 'WAITING_CONFIG', 'YES')
@@ -0,0 +1,152 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Batched fan-out of a DMRD frame to many clients of a MASTER. When a master
+repeats a frame, every copy is the same packet with a different radio ID in
+bytes 11-14. Instead of building a new string per client and making one
+sendto() per client, each copy is described to the kernel as three pieces --
+the header up to the radio ID, the client's own 4 byte radio ID, and the rest
+of the frame -- and all of them go out in a single sendmmsg() call.
+
+sendmmsg() is Linux only and not wrapped by the socket module, so it is
+called through ctypes. Where it isn't available (or for a client that isn't
+IPv4) the frame is written per client through the Twisted transport exactly
+as before.
+'''
+
+import ctypes
+import socket
+from struct import pack
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+# The kernel won't take more than this many messages in one call (UIO_MAXIOV)
+MAX_BATCH = 1024
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+try:
+    _sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _sendmmsg = None
+
+AVAILABLE = _sendmmsg is not None
+
+
+# Address of the first byte of an immutable string, no copy is made
+def _address(_string):
+    return ctypes.cast(ctypes.c_char_p(_string), ctypes.c_void_p).value
+
+
+# Everything sendmmsg needs to know about a client that doesn't change for
+# the life of its registration. Cached on the client record the first time.
+class _DEST(object):
+    __slots__ = ('sockaddr', 'sockaddr_ptr', 'radio_id_ptr')
+
+    def __init__(self, _client):
+        try:
+            _raw = pack('=H', socket.AF_INET) + pack('>H', _client.port) + socket.inet_pton(socket.AF_INET, _client.ip) + '\x00' * 8
+        except (socket.error, ValueError, TypeError):
+            self.sockaddr = None
+            return
+        self.sockaddr = ctypes.create_string_buffer(_raw, len(_raw))
+        self.sockaddr_ptr = ctypes.addressof(self.sockaddr)
+        self.radio_id_ptr = _address(_client.radio_id)
+
+
+class FANOUT(object):
+    def __init__(self, _transport):
+        self._transport = _transport
+        self._fileno = _transport.getHandle().fileno()
+        self._size = 0
+        self._grow(64)
+
+    # The message and iovec arrays are re-used from frame to frame and only
+    # ever grow. Each message points at its own three iovecs.
+    def _grow(self, _size):
+        self._msgs = (_mmsghdr * _size)()
+        self._iovs = (_iovec * (3 * _size))()
+        for i in range(_size):
+            _hdr = self._msgs[i].msg_hdr
+            _hdr.msg_iov = ctypes.cast(ctypes.byref(self._iovs, 3 * i * ctypes.sizeof(_iovec)), ctypes.POINTER(_iovec))
+            _hdr.msg_iovlen = 3
+            _hdr.msg_namelen = 16
+            self._iovs[3*i].iov_len = 11
+            self._iovs[3*i+1].iov_len = 4
+        self._size = _size
+
+    # Send _data to every client in _clients, each with its own radio ID
+    # patched in. Anything the kernel didn't take goes the old way.
+    def send(self, _data, _clients):
+        _batch = []
+        for _client in _clients:
+            if _client.fanout is None:
+                _client.fanout = _DEST(_client)
+            if _client.fanout.sockaddr is None:
+                self._transport.write(_data[:11] + _client.radio_id + _data[15:], (_client.ip, _client.port))
+            else:
+                _batch.append(_client)
+
+        _tail_len = len(_data) - 15
+        _head = _address(_data)
+        _tail = _head + 15
+        for _start in range(0, len(_batch), MAX_BATCH):
+            _chunk = _batch[_start:_start+MAX_BATCH]
+            _count = len(_chunk)
+            if _count > self._size:
+                self._grow(max(_count, 2 * self._size))
+            _msgs = self._msgs
+            _iovs = self._iovs
+            for i in range(_count):
+                _dest = _chunk[i].fanout
+                _msgs[i].msg_hdr.msg_name = _dest.sockaddr_ptr
+                _iovs[3*i].iov_base = _head
+                _iovs[3*i+1].iov_base = _dest.radio_id_ptr
+                _iovs[3*i+2].iov_base = _tail
+                _iovs[3*i+2].iov_len = _tail_len
+
+            _sent = _sendmmsg(self._fileno, _msgs, _count, 0)
+            if _sent < 0:
+                _sent = 0
+            for _client in _chunk[_sent:]:
+                self._transport.write(_data[:11] + _client.radio_id + _data[15:], (_client.ip, _client.port))
@@ -0,0 +1,85 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+The DMRD frame object handed to dmrd_received(). The HBP header of every
+DMRD packet is pulled apart with a single pre-compiled struct unpack rather
+than being sliced into a pile of separate strings in hblink.py.
+
+    Offset  Length  Field
+    0       4       'DMRD'
+    4       1       Sequence number
+    5       3       RF source (subscriber ID)
+    8       3       Destination ID (talkgroup or subscriber)
+    11      4       Radio ID (HBP peer)
+    15      1       Bits: Slot|Call type|Frame type (2)|Data type or voice seq (4)
+    16      4       Stream ID
+    20      33      DMR payload
+    53      1       BER (optional)
+    54      1       RSSI (optional)
+
+The ID fields are kept as the raw big-endian strings, since that is what the
+applications compare against their rules and rewrite into outgoing packets.
+'''
+
+from struct import Struct
+from time import time
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+# Everything between the command and the payload, in one go
+DMRD_HEADER = Struct('>4xc3s3s4sB4s')
+
+# Shortest DMRD packet there is a whole burst in. Anything shorter is dropped
+# before a DMRD is made of it.
+DMRD_LENGTH = 53
+
+
+class DMRD(object):
+    __slots__ = ('data', 'seq', 'rf_src', 'dst_id', 'radio_id', 'bits', 'stream_id',
+                 'slot', 'call_type', 'frame_type', 'dtype_vseq', 'rx_time')
+
+    # _data has to be at least DMRD_LENGTH bytes
+    def __init__(self, _data):
+        self.rx_time = time()       # When we took it off the socket, for latency metrics
+        self.data = _data
+        self.seq, self.rf_src, self.dst_id, self.radio_id, self.bits, self.stream_id = DMRD_HEADER.unpack_from(_data)
+        self.slot = 2 if (self.bits & 0x80) else 1
+        self.call_type = 'unit' if (self.bits & 0x40) else 'group'
+        self.frame_type = (self.bits & 0x30) >> 4
+        self.dtype_vseq = (self.bits & 0xF) # data, 1=voice header, 2=voice terminator; voice, 0=burst A ... 5=burst F
+
+    # The 33 byte DMR burst -- only sliced out when somebody asks for it
+    @property
+    def payload(self):
+        return self.data[20:53]
+
+    # The three 72 bit AMBE frames of a voice burst, 27 bytes. They are the 108
+    # bits either side of the 48 bit sync/EMB field in the middle of the burst,
+    # which starts and ends on a nibble boundary -- so it's two byte slices and
+    # one byte made of the high nibble of 13 and the low nibble of 19.
+    @property
+    def ambe(self):
+        _data = self.data
+        return _data[20:33] + chr((ord(_data[33]) & 0xF0) | (ord(_data[39]) & 0x0F)) + _data[40:53]
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Load generator: any number of simulated repeaters in one process, pointed at
+a master to find out how much it can take before it can't.
+
+Every repeater is an ordinary HBSYSTEM in CLIENT mode with its own UDP port,
+so it logs in (RPTL/RPTK/RPTC), pings and answers exactly like hblink.py does
+as a client. Once logged in, each one makes group voice calls on the talkgroups
+and timeslots given, round robin: a voice header, superframes of bursts A-F
+and a terminator, one frame every 60ms, with real full and embedded LCs so
+hb_confbridge.py and hb_router.py can decode them. Then it waits and calls
+again.
+
+The first 12 bytes of every voice burst carry the time it was sent and its
+frame number in the stream. Whatever the repeaters receive back -- repeated by
+a plain master, or bridged by an application -- gives the latency, and for
+each stream that ended, the frames that didn't arrive at the repeaters that
+heard it are counted as lost.
+
+Every REPORT seconds, and at the end, a line is logged with the repeaters
+logged in, calls in progress, frames sent and received per second, loss and
+latency. Overruns are 60ms ticks the generator itself was too late for -- when
+they show up the numbers describe this machine rather than the master.
+
+Only the [GLOBAL] (PING_TIME, MAX_MISSED) and [LOGGER] sections of the config
+file are used. Logging at INFO or below makes every repeater log its login.
+'''
+
+from __future__ import print_function
+
+import sys
+import os
+import argparse
+import random
+from collections import deque
+from heapq import heappush, heappop
+from socket import gethostbyname
+from struct import Struct
+from time import time
+
+from bitarray import bitarray
+from twisted.internet import reactor, task
+
+import hb_config
+import hb_log
+import hb_const
+from hblink import HBSYSTEM, systems
+from hb_metrics import HISTOGRAM
+from dmr_utils.utils import hex_str_3, hex_str_4
+from dmr_utils import bptc, const, golay, qr
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+FRAME_TIME = 0.06
+SUPERFRAME = 6
+
+# Send time and frame number, at the start of each voice burst
+STAMP = Struct('<dI')
+
+# The rest of every voice burst in a call is the same, so it is built once
+# per burst position (A-F) as the bits after the stamp
+STAMP_BITS = STAMP.size * 8
+AMBE_FILL = bitarray('0' * 264)
+
+# The link control sub-stream sequence in the EMB of bursts B-F
+EMB_LCSS = (None, 1, 3, 3, 2, 0)
+
+
+def slot_type(_cc, _dtype):
+    return bitarray(format(golay.encode_2087(chr(_cc << 4 | _dtype)), '020b'))
+
+def emb(_cc, _lcss):
+    _bytes = qr.encode([_cc << 4 | _lcss << 1, 0])
+    return bitarray(format(_bytes[0] << 8 | _bytes[1], '016b'))
+
+
+# One call from one repeater. Every frame it sends is a template and a stamp.
+class CALL(object):
+    __slots__ = ('repeater', 'slot', 'tgid', 'rf_src', 'stream_id', 'bits', 'header', 'bursts', 'terminator', 'frames', 'sent')
+
+    def __init__(self, _repeater, _slot, _tgid, _rf_src, _superframes, _cc):
+        self.repeater = _repeater
+        self.slot = _slot
+        self.tgid = _tgid
+        self.rf_src = _rf_src
+        self.stream_id = hex_str_4(random.getrandbits(32))
+        self.bits = 0x80 if _slot == 2 else 0x00
+        self.frames = 2 + _superframes * SUPERFRAME
+        self.sent = 0
+
+        _lc = const.LC_OPT + _tgid + _rf_src
+        _head_lc = bptc.encode_header_lc(_lc)
+        _term_lc = bptc.encode_terminator_lc(_lc)
+        _emb_lc = bptc.encode_emblc(_lc)
+        _head_type = slot_type(_cc, hb_const.HBPF_SLT_VHEAD)
+        _term_type = slot_type(_cc, hb_const.HBPF_SLT_VTERM)
+        self.header = (_head_lc[0:98] + _head_type[0:10] + const.BS_DATA_SYNC + _head_type[10:20] + _head_lc[98:196]).tobytes()
+        self.terminator = (_term_lc[0:98] + _term_type[0:10] + const.BS_DATA_SYNC + _term_type[10:20] + _term_lc[98:196]).tobytes()
+
+        # Everything after the stamp for bursts A-F
+        self.bursts = [(AMBE_FILL[STAMP_BITS:108] + const.BS_VOICE_SYNC + AMBE_FILL[156:264]).tobytes()]
+        for _vseq in range(1, SUPERFRAME):
+            _emb = emb(_cc, EMB_LCSS[_vseq])
+            _fragment = _emb_lc[_vseq] if _vseq < 5 else bitarray('0' * 32)
+            self.bursts.append((AMBE_FILL[STAMP_BITS:108] + _emb[0:8] + _fragment + _emb[8:16] + AMBE_FILL[156:264]).tobytes())
+
+    # The next DMRD packet of the call, or None when it's over
+    def next_frame(self, _now):
+        _frame = self.sent
+        if _frame >= self.frames:
+            return None
+        self.sent += 1
+        if _frame == 0:
+            _bits = self.bits | hb_const.HBPF_DATA_SYNC << 4 | hb_const.HBPF_SLT_VHEAD
+            _payload = self.header
+        elif _frame == self.frames - 1:
+            _bits = self.bits | hb_const.HBPF_DATA_SYNC << 4 | hb_const.HBPF_SLT_VTERM
+            _payload = self.terminator
+        else:
+            _vseq = (_frame - 1) % SUPERFRAME
+            _bits = self.bits | (hb_const.HBPF_VOICE_SYNC if _vseq == 0 else hb_const.HBPF_VOICE) << 4 | _vseq
+            _payload = STAMP.pack(_now, _frame) + self.bursts[_vseq]
+        return 'DMRD' + chr(_frame & 0xFF) + self.rf_src + self.tgid + self.repeater.radio_id + chr(_bits) + self.stream_id + _payload
+
+
+# A simulated repeater: a plain HBP client that counts what it hears
+class LOADSYSTEM(HBSYSTEM):
+    def __init__(self, _name, _config, _logger, _load):
+        HBSYSTEM.__init__(self, _name, _config, _logger, None)
+        self._load = _load
+        self.radio_id = self._config['RADIO_ID']
+        self.port = None
+        self.received = {}      # stream ID -> frames heard, until the stream is accounted for
+
+    def listen(self, _interface):
+        self.port = reactor.listenUDP(0, self, interface=_interface)
+
+    def connected(self):
+        return self._stats['CONNECTION'] == 'YES'
+
+    def dmrd_received(self, _frame):
+        _stream_id = _frame.stream_id
+        if _stream_id not in self._load.streams:
+            return
+        self.received[_stream_id] = self.received.get(_stream_id, 0) + 1
+        self._load.rx_frames += 1
+        if _frame.frame_type != hb_const.HBPF_DATA_SYNC:
+            self._load.latency.observe(_frame.rx_time - STAMP.unpack_from(_frame.data, 20)[0])
+
+
+class LOADGEN(object):
+    def __init__(self, _config, _logger, _args):
+        self._CONFIG = _config
+        self._logger = _logger
+        self._args = _args
+        self._superframes = max(1, int(round(_args.CALL / (FRAME_TIME * SUPERFRAME))))
+        self.repeaters = []
+        self.calls = []             # calls in progress
+        self._idle = []             # heap of (time to call again, tie breaker, repeater)
+        self._order = 0
+        self._made = 0              # calls started, for the round robins
+        self.streams = {}           # stream ID -> frames sent, for streams not accounted for yet
+        self._ended = deque()       # (time, stream ID) of finished calls, oldest first
+        self.latency = HISTOGRAM()
+        self.sent = 0
+        self.rx_frames = 0
+        self.expected = 0
+        self.lost = 0
+        self.overruns = 0
+        self.stopped = False
+        self._last = (time(), 0, 0)
+
+    # Repeaters are started a few at a time over RAMP seconds so a thousand
+    # logins don't land on the master in the same instant
+    def start(self):
+        _args = self._args
+        for _index in range(_args.REPEATERS):
+            _radio_id = _args.FIRST_ID + _index
+            _name = 'LOAD-{}'.format(_radio_id)
+            self._CONFIG['SYSTEMS'][_name] = {
+                'MODE': 'CLIENT',
+                'ENABLED': True,
+                'LOOSE': False,
+                'EXPORT_AMBE': False,
+                'IP': _args.IP,
+                'PORT': 0,
+                'MASTER_HOST': _args.MASTER_IP,
+                'MASTER_IP': _args.MASTER_IP,
+                'MASTER_PORT': _args.MASTER_PORT,
+                'PASSPHRASE': _args.PASSPHRASE,
+                'CALLSIGN': 'LOAD'.ljust(8)[:8],
+                'RADIO_ID': hex_str_4(_radio_id),
+                'RX_FREQ': '449000000',
+                'TX_FREQ': '444000000',
+                'TX_POWER': '25',
+                'COLORCODE': '01',
+                'LATITUDE': '38.0000 ',
+                'LONGITUDE': '-095.0000',
+                'HEIGHT': '075',
+                'LOCATION': 'Load generator'.ljust(20)[:20],
+                'DESCRIPTION': _name.ljust(19)[:19],
+                'SLOTS': '3',
+                'URL': ''.ljust(124),
+                'SOFTWARE_ID': 'hb_loadgen'.ljust(40),
+                'PACKAGE_ID': 'HBlink'.ljust(40),
+                'GROUP_HANGTIME': 5,
+                'OPTIONS': '',
+                'TRACE': [],
+                'CAPTURE': False,
+                'STATS': {
+                    'CONNECTION': 'NO',
+                    'PINGS_SENT': 0,
+                    'PINGS_ACKD': 0,
+                    'NUM_OUTSTANDING': 0,
+                    'PING_OUTSTANDING': False,
+                    'LAST_PING_TX_TIME': 0,
+                    'LAST_PING_ACK_TIME': 0,
+                },
+            }
+            _repeater = systems[_name] = LOADSYSTEM(_name, self._CONFIG, self._logger, self)
+            self.repeaters.append(_repeater)
+            reactor.callLater(_args.RAMP * _index / _args.REPEATERS, _repeater.listen, _args.IP)
+            self._wait(_repeater, _args.RAMP + random.uniform(0, _args.PAUSE))
+
+        self._tick = task.LoopingCall.withCount(self.tick)
+        self._tick.start(FRAME_TIME)
+        self._report = task.LoopingCall(self.report)
+        self._report.start(_args.REPORT, now=False)
+
+    def _wait(self, _repeater, _seconds):
+        self._order += 1
+        heappush(self._idle, (time() + _seconds, self._order, _repeater))
+
+    # Every 60ms: start the calls that are due, send a frame of every call in
+    # progress and account for the streams that ended a while ago
+    def tick(self, _count):
+        self.overruns += _count - 1
+        _now = time()
+        _args = self._args
+
+        while self._idle and self._idle[0][0] <= _now:
+            _repeater = heappop(self._idle)[2]
+            if not _repeater.connected():
+                self._wait(_repeater, FRAME_TIME * SUPERFRAME)
+                continue
+            _made = self._made
+            _call = CALL(_repeater, _args.SLOTS[_made % len(_args.SLOTS)], hex_str_3(_args.TGIDS[_made % len(_args.TGIDS)]), hex_str_3(_args.FIRST_SUB + _made % _args.SUBSCRIBERS), self._superframes, _args.COLORCODE)
+            self._made += 1
+            self.streams[_call.stream_id] = 0
+            self.calls.append(_call)
+
+        _calls = []
+        for _call in self.calls:
+            _frame = _call.next_frame(_now)
+            if _frame is None:
+                self.streams[_call.stream_id] = _call.sent
+                self._ended.append((_now, _call.stream_id))
+                self._wait(_call.repeater, _args.PAUSE)
+                continue
+            _call.repeater.send_master(_frame)
+            self.sent += 1
+            _calls.append(_call)
+        self.calls = _calls
+
+        # Stragglers have had a second to turn up
+        while self._ended and self._ended[0][0] <= _now - 1:
+            self.account(self._ended.popleft()[1])
+
+    # A stream heard by a repeater should have been heard in full
+    def account(self, _stream_id):
+        _sent = self.streams.pop(_stream_id)
+        for _repeater in self.repeaters:
+            _received = _repeater.received.pop(_stream_id, 0)
+            if _received:
+                self.expected += _sent
+                self.lost += max(0, _sent - _received)
+
+    def report(self):
+        _now = time()
+        _then, _sent, _rx_frames = self._last
+        _elapsed = _now - _then
+        _connected = sum(1 for _repeater in self.repeaters if _repeater.connected())
+        _pings_sent = sum(_repeater._stats['PINGS_SENT'] for _repeater in self.repeaters)
+        _pings_ackd = sum(_repeater._stats['PINGS_ACKD'] for _repeater in self.repeaters)
+        _latency = self.latency.summary()
+        self._logger.warning('LOADGEN: %s/%s logged in, %s calls, TX %.0f frames/s, RX %.0f frames/s, loss %.3f%% (%s of %s), latency p50 %.1fms p99 %.1fms max %.1fms, pings %s/%s answered, %s overruns',
+            _connected, len(self.repeaters), len(self.calls),
+            (self.sent - _sent) / _elapsed, (self.rx_frames - _rx_frames) / _elapsed,
+            100.0 * self.lost / self.expected if self.expected else 0.0, self.lost, self.expected,
+            _latency['P50'] * 1000, _latency['P99'] * 1000, _latency['MAX'] * 1000,
+            _pings_ackd, _pings_sent, self.overruns)
+        self._last = (_now, self.sent, self.rx_frames)
+
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        self._tick.stop()
+        self._report.stop()
+        while self._ended:
+            self.account(self._ended.popleft()[1])
+        self.report()
+        # Log out, and stop listening before the master answers
+        for _repeater in self.repeaters:
+            if _repeater.connected():
+                _repeater.dereg()
+            if _repeater.port:
+                _repeater.port.stopListening()
+        reactor.stop()
+
+
+#************************************************
+#      MAIN PROGRAM LOOP STARTS HERE
+#************************************************
+
+if __name__ == '__main__':
+
+    import signal
+    import resource
+
+    def id_list(_string):
+        return [int(_id) for _id in _string.split(',')]
+
+    # CLI argument parser - handles picking up the config file from the command line, and sending a "help" message
+    parser = argparse.ArgumentParser()
+    parser.add_argument('MASTER_IP', help='Master to load')
+    parser.add_argument('MASTER_PORT', type=int, help='Its port')
+    parser.add_argument('PASSPHRASE', help='Its passphrase')
+    parser.add_argument('-c', '--config', action='store', dest='CONFIG_FILE', help='/full/path/to/config.file (usually hblink.cfg)')
+    parser.add_argument('-l', '--logging', action='store', dest='LOG_LEVEL', default='WARNING', help='Override config file logging level (default WARNING)')
+    parser.add_argument('-n', '--repeaters', action='store', dest='REPEATERS', type=int, default=10, help='Number of repeaters (default 10)')
+    parser.add_argument('--first-id', action='store', dest='FIRST_ID', type=int, default=312000001, help='Radio ID of the first repeater, the rest follow (default 312000001)')
+    parser.add_argument('--first-sub', action='store', dest='FIRST_SUB', type=int, default=3120001, help='First subscriber ID calls are made from (default 3120001)')
+    parser.add_argument('--subscribers', action='store', dest='SUBSCRIBERS', type=int, default=1000, help='Number of subscriber IDs to use (default 1000)')
+    parser.add_argument('-t', '--tgids', action='store', dest='TGIDS', type=id_list, default=[1], help='Comma separated talkgroups to call, round robin (default 1)')
+    parser.add_argument('-s', '--slots', action='store', dest='SLOTS', type=id_list, default=[1, 2], help='Comma separated timeslots to call on, round robin (default 1,2)')
+    parser.add_argument('--colorcode', action='store', dest='COLORCODE', type=int, default=1, help='Color code in the slot types and EMB (default 1)')
+    parser.add_argument('--call', action='store', dest='CALL', type=float, default=10.0, help='Seconds per call (default 10)')
+    parser.add_argument('--pause', action='store', dest='PAUSE', type=float, default=20.0, help='Seconds between calls from each repeater (default 20)')
+    parser.add_argument('--ramp', action='store', dest='RAMP', type=float, default=10.0, help='Seconds over which the repeaters are started (default 10)')
+    parser.add_argument('-d', '--duration', action='store', dest='DURATION', type=float, default=60.0, help='Seconds to run for, 0 for ever (default 60)')
+    parser.add_argument('-r', '--report', action='store', dest='REPORT', type=float, default=10.0, help='Seconds between reports (default 10)')
+    parser.add_argument('--ip', action='store', dest='IP', default='', help='Local address to send from')
+    parser.add_argument('--seed', action='store', dest='SEED', type=int, help='Random seed, for repeatable runs')
+    cli_args = parser.parse_args()
+
+    # Ensure we have a path for the config file, if one wasn't specified, then use the default (top of file)
+    if not cli_args.CONFIG_FILE:
+        cli_args.CONFIG_FILE = os.path.dirname(os.path.abspath(__file__))+'/hblink.cfg'
+
+    # Call the external routine to build the configuration dictionary, keeping
+    # only what isn't ours to set
+    CONFIG = hb_config.build_config(cli_args.CONFIG_FILE)
+    CONFIG['SYSTEMS'] = {}
+    CONFIG['REPORTS']['REPORT'] = False
+
+    # Start the system logger
+    CONFIG['LOGGER']['LOG_LEVEL'] = cli_args.LOG_LEVEL
+    logger = hb_log.config_logging(CONFIG['LOGGER'])
+
+    if cli_args.SEED is not None:
+        random.seed(cli_args.SEED)
+    cli_args.MASTER_IP = gethostbyname(cli_args.MASTER_IP)
+
+    # One socket per repeater -- make sure we are allowed that many
+    _soft, _hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if _soft < cli_args.REPEATERS + 64:
+        _soft = min(_hard, cli_args.REPEATERS + 64) if _hard != resource.RLIM_INFINITY else cli_args.REPEATERS + 64
+        resource.setrlimit(resource.RLIMIT_NOFILE, (_soft, _hard))
+        if _soft < cli_args.REPEATERS + 64:
+            sys.exit('Only {} open files allowed, not enough for {} repeaters (see ulimit -n)'.format(_soft, cli_args.REPEATERS))
+
+    load = LOADGEN(CONFIG, logger, cli_args)
+
+    # Set up the signal handler
+    def sig_handler(_signal, _frame):
+        logger.info('SHUTDOWN: LOADGEN IS TERMINATING WITH SIGNAL %s', str(_signal))
+        load.stop()
+
+    # Set signal handers so that we can gracefully exit if need be
+    for sig in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(sig, sig_handler)
+
+    logger.warning('LOADGEN: %s repeaters, radio IDs %s-%s, to %s:%s, %ss calls every %ss on TGIDs %s, TS %s',
+        cli_args.REPEATERS, cli_args.FIRST_ID, cli_args.FIRST_ID + cli_args.REPEATERS - 1, cli_args.MASTER_IP, cli_args.MASTER_PORT,
+        cli_args.CALL, cli_args.PAUSE, ','.join(str(_tgid) for _tgid in cli_args.TGIDS), ','.join(str(_slot) for _slot in cli_args.SLOTS))
+    reactor.callWhenRunning(load.start)
+    if cli_args.DURATION:
+        reactor.callLater(cli_args.DURATION, load.stop)
+    reactor.run()
@@ -22,9 +22,16 @@
 This is the logging configuration for hblink.py. It changes very infrequently,
 so keeping in a separate module keeps hblink.py more concise. this file is
 likely to never change.
+
+With LOG_QUEUE set, the handlers are moved behind a QUEUEHANDLER: the thread
+that logs only puts the record in a queue, and a thread of its own writes it
+out, so a slow disk or syslog never holds up the reactor.
 '''
 
 import logging
+import threading
+from collections import deque
+from itertools import count
 from logging.config import dictConfig
 
 # Does anybody read this stuff? There's a PEP somewhere that says I should do this.
@@ -36,6 +43,96 @@ __maintainer__ = 'Cort Buffington, N0MJS'
 __email__      = 'n0mjs@me.com'
 
 
+# Hands records to other handlers from a writer thread. At most _size records
+# wait; past that, with _overflow 'DROP_DEBUG' the oldest DEBUG record goes
+# first, otherwise (and when there's no DEBUG record waiting) the oldest one.
+# dropped counts them all, and the writer says how many went missing once it
+# has caught up.
+class QUEUEHANDLER(logging.Handler):
+    def __init__(self, _handlers, _size, _overflow = 'DROP_OLDEST'):
+        logging.Handler.__init__(self)
+        self._handlers = _handlers
+        self._size = _size
+        self._drop_debug = _overflow == 'DROP_DEBUG'
+        # (sequence, record), DEBUG and everything else apart so DEBUG can be
+        # dropped first; the writer puts them back in order by sequence
+        self._debug = deque()
+        self._other = deque()
+        self._sequence = count()
+        self._ready = threading.Condition(threading.Lock())
+        self._stopping = False
+        self.dropped = 0
+        self._reported = 0
+        self._writer = threading.Thread(target=self._write, name='hb_log writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    # Everything a record needs is worked out here, in the thread that logged
+    # it, so that only plain strings cross over to the writer
+    def prepare(self, _record):
+        _record.msg = _record.getMessage()
+        _record.args = None
+        if _record.exc_info:
+            _record.exc_text = logging.Formatter().formatException(_record.exc_info)
+            _record.exc_info = None
+        return _record
+
+    def emit(self, _record):
+        try:
+            _record = self.prepare(_record)
+        except Exception:
+            self.handleError(_record)
+            return
+        with self._ready:
+            if len(self._debug) + len(self._other) >= self._size:
+                self.dropped += 1
+                if self._drop_debug and _record.levelno <= logging.DEBUG:
+                    return
+                if self._debug and (self._drop_debug or not self._other or self._debug[0][0] < self._other[0][0]):
+                    self._debug.popleft()
+                else:
+                    self._other.popleft()
+            if _record.levelno <= logging.DEBUG:
+                self._debug.append((next(self._sequence), _record))
+            else:
+                self._other.append((next(self._sequence), _record))
+            self._ready.notify()
+
+    def queued(self):
+        return len(self._debug) + len(self._other)
+
+    def _write(self):
+        while True:
+            with self._ready:
+                while not (self._debug or self._other or self._stopping):
+                    self._ready.wait()
+                if not (self._debug or self._other):
+                    return
+                _records = sorted(list(self._debug) + list(self._other))
+                self._debug.clear()
+                self._other.clear()
+                _dropped = self.dropped - self._reported
+                self._reported = self.dropped
+            for _sequence, _record in _records:
+                self._handle(_record)
+            if _dropped:
+                self._handle(logging.LogRecord(_record.name, logging.WARNING, __file__, 0, 'Logging fell behind, %s log records dropped', (_dropped,), None))
+
+    def _handle(self, _record):
+        for _handler in self._handlers:
+            if _record.levelno >= _handler.level:
+                _handler.handle(_record)
+
+    # Write out what's waiting before going away
+    def close(self):
+        with self._ready:
+            self._stopping = True
+            self._ready.notify()
+        if self._writer.is_alive() and self._writer is not threading.current_thread():
+            self._writer.join(5)
+        logging.Handler.close(self)
+
+
 def config_logging(_logger):
     dictConfig({
         'version': 1,
@@ -92,4 +189,10 @@ def config_logging(_logger):
         }
     })
 
-    return logging.getLogger(_logger['LOG_NAME'])
\ No newline at end of file
+    logger = logging.getLogger(_logger['LOG_NAME'])
+    if _logger.get('LOG_QUEUE', 0) > 0:
+        _handlers = logger.handlers[:]
+        for _handler in _handlers:
+            logger.removeHandler(_handler)
+        logger.addHandler(QUEUEHANDLER(_handlers, _logger['LOG_QUEUE'], _logger.get('LOG_OVERFLOW', 'DROP_OLDEST')))
+    return logger
\ No newline at end of file
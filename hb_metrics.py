@@ -0,0 +1,293 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Packet counters for each system. They are plain integer attributes on slotted
+objects so the packet path can bump them without any dictionary lookups:
+
+    _metrics = self._metrics.slot[_slot]
+    _metrics.rx_frames += 1
+
+Counters that belong to a timeslot live in a SLOTMETRICS per slot, the ones
+that come before we know or trust the slot (unauthenticated sources, unknown
+commands) live on the system's METRICS. Everything is sent to reporting
+clients as a dictionary by reportFactory.send_metrics().
+
+Drops by contention are counted once per target a frame was held back from,
+so a frame bridged to three systems and blocked on one counts as two frames
+forwarded and one dropped.
+
+Each system also keeps a HISTOGRAM of how long frames it received spent inside
+HBlink before being forwarded or repeated -- from hb_frame.DMRD.rx_time to the
+send. The same times are kept again per target system, so the latency from
+one system to each of the others can be told apart; p50, p99 and max for each
+pair are sent on request (LATENCY_REQ) and shown on the metrics page. A master
+repeating to its own clients counts as a pair with itself. LATENCY_REQ can
+start its own figures over, but the metrics page only ever counts up.
+
+With METRICS_PORT set in [REPORTS], all of it is served as Prometheus text on
+http://<METRICS_IP>:<METRICS_PORT>/metrics, along with how far behind the
+reporting clients are and what was dropped from their queues.
+'''
+
+from bisect import bisect_left
+
+from twisted.web.resource import Resource
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+# Histogram bucket upper bounds in seconds: 50us doubling up to about 1.6s
+LATENCY_BOUNDS = tuple(0.00005 * 2**i for i in range(16))
+
+
+# Fixed memory, log bucketed. Observing is a bisect and three additions.
+class HISTOGRAM(object):
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'max')
+
+    def __init__(self, _bounds = LATENCY_BOUNDS):
+        self.bounds = _bounds
+        self.counts = [0] * (len(_bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, _value):
+        self.counts[bisect_left(self.bounds, _value)] += 1
+        self.sum += _value
+        self.count += 1
+        if _value > self.max:
+            self.max = _value
+
+    # Estimated from the buckets: the upper bound of the bucket the q'th
+    # observation fell in, but never more than the largest value seen
+    def quantile(self, _q):
+        if not self.count:
+            return 0.0
+        _rank = _q * self.count
+        _seen = 0
+        for _bound, _count in zip(self.bounds, self.counts):
+            _seen += _count
+            if _seen >= _rank:
+                return min(_bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'P50': self.quantile(0.5), 'P99': self.quantile(0.99), 'MAX': self.max, 'COUNT': self.count}
+
+    def export(self):
+        return {'BOUNDS': self.bounds, 'COUNTS': list(self.counts), 'SUM': self.sum, 'COUNT': self.count, 'MAX': self.max}
+
+
+class SLOTMETRICS(object):
+    __slots__ = ('rx_frames', 'rx_bytes',               # DMRD frames accepted from the system
+                 'fwd_frames', 'fwd_bytes',             # frames sent on to other systems by an application
+                 'rpt_frames', 'rpt_bytes',             # copies a master repeated to its own clients
+                 'drop_acl',                            # rejected by a subscriber or talkgroup ACL
+                 'drop_contention',                     # held back from a target that is busy or in hangtime
+                 'drop_collision')                      # a second stream on a slot that is already in use
+
+    def __init__(self):
+        for _counter in self.__slots__:
+            setattr(self, _counter, 0)
+
+    def export(self):
+        return dict((_counter.upper(), getattr(self, _counter)) for _counter in self.__slots__)
+
+
+class METRICS(object):
+    __slots__ = ('slot', 'drop_unauth', 'drop_unknown', 'drop_short', 'latency', 'targets', 'window', '_pdu_stats')
+
+    # _pdu_stats is the system's per command counter dictionary (PDU_STATS),
+    # reported along with everything here
+    def __init__(self, _pdu_stats):
+        self.slot = (None, SLOTMETRICS(), SLOTMETRICS())    # indexed by slot number
+        self.drop_unauth = 0        # DMRD from a client that isn't logged in, or not from our master's radio ID
+        self.drop_unknown = 0       # packets with a command we don't recognize
+        self.drop_short = 0         # DMRD packets too short to hold a burst
+        self.latency = HISTOGRAM()  # receipt to forward/repeat, seconds
+        self.targets = {}           # the same, per target system name
+        self.window = {}            # the same again, since LATENCY_REQ last reset it
+        self._pdu_stats = _pdu_stats
+
+    # A frame received at _rx_time has just been sent to _target
+    def forwarded(self, _target, _rx_time, _now):
+        _latency = _now - _rx_time
+        self.latency.observe(_latency)
+        _histogram = self.targets.get(_target)
+        if _histogram is None:
+            _histogram = self.targets[_target] = HISTOGRAM()
+        _histogram.observe(_latency)
+        _histogram = self.window.get(_target)
+        if _histogram is None:
+            _histogram = self.window[_target] = HISTOGRAM()
+        _histogram.observe(_latency)
+
+    def target_latency(self):
+        return dict((_target, _histogram.summary()) for _target, _histogram in self.window.iteritems())
+
+    # Only what LATENCY_REQ sees, the counters on the metrics page carry on
+    def reset_latency(self):
+        self.window = {}
+
+    def export(self):
+        return {
+            'TS1': self.slot[1].export(),
+            'TS2': self.slot[2].export(),
+            'DROP_UNAUTH': self.drop_unauth,
+            'DROP_UNKNOWN': self.drop_unknown,
+            'DROP_SHORT': self.drop_short,
+            'LATENCY': self.latency.export(),
+            'PDU': self._pdu_stats,
+        }
+
+
+#************************************************
+#     PROMETHEUS TEXT EXPOSITION
+#************************************************
+
+_SLOT_COUNTERS = (
+    ('rx_frames', 'hblink_rx_frames_total', 'DMRD frames accepted from the system'),
+    ('rx_bytes', 'hblink_rx_bytes_total', 'DMRD bytes accepted from the system'),
+    ('fwd_frames', 'hblink_forwarded_frames_total', 'Frames forwarded to other systems'),
+    ('fwd_bytes', 'hblink_forwarded_bytes_total', 'Bytes forwarded to other systems'),
+    ('rpt_frames', 'hblink_repeated_frames_total', 'Frame copies a master repeated to its clients'),
+    ('rpt_bytes', 'hblink_repeated_bytes_total', 'Bytes a master repeated to its clients'),
+)
+
+_SLOT_DROPS = (('drop_acl', 'acl'), ('drop_contention', 'contention'), ('drop_collision', 'collision'))
+
+
+def _label(_value):
+    return str(_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The whole text page for a dictionary of running HBSYSTEMs, and the
+# reporting server if there is one
+def exposition(_systems, _report = None):
+    _lines = []
+    _names = sorted(_systems)
+
+    for _counter, _metric, _help in _SLOT_COUNTERS:
+        _lines.append('# HELP {} {}'.format(_metric, _help))
+        _lines.append('# TYPE {} counter'.format(_metric))
+        for _system in _names:
+            for _slot in (1, 2):
+                _lines.append('{}{{system="{}",slot="{}"}} {}'.format(_metric, _label(_system), _slot, getattr(_systems[_system]._metrics.slot[_slot], _counter)))
+
+    _lines.append('# HELP hblink_dropped_frames_total Frames not forwarded, by reason')
+    _lines.append('# TYPE hblink_dropped_frames_total counter')
+    for _system in _names:
+        for _slot in (1, 2):
+            for _counter, _reason in _SLOT_DROPS:
+                _lines.append('hblink_dropped_frames_total{{system="{}",slot="{}",reason="{}"}} {}'.format(_label(_system), _slot, _reason, getattr(_systems[_system]._metrics.slot[_slot], _counter)))
+
+    _lines.append('# HELP hblink_rejected_packets_total Packets rejected before a slot is known, by reason')
+    _lines.append('# TYPE hblink_rejected_packets_total counter')
+    for _system in _names:
+        _metrics = _systems[_system]._metrics
+        _lines.append('hblink_rejected_packets_total{{system="{}",reason="unauthenticated"}} {}'.format(_label(_system), _metrics.drop_unauth))
+        _lines.append('hblink_rejected_packets_total{{system="{}",reason="unknown_command"}} {}'.format(_label(_system), _metrics.drop_unknown))
+        _lines.append('hblink_rejected_packets_total{{system="{}",reason="short"}} {}'.format(_label(_system), _metrics.drop_short))
+
+    _lines.append('# HELP hblink_pdu_total HBP packets by command and result')
+    _lines.append('# TYPE hblink_pdu_total counter')
+    for _system in _names:
+        _pdu_stats = _systems[_system]._metrics._pdu_stats
+        for _command in sorted(_pdu_stats):
+            for _result in ('RECEIVED', 'ACCEPTED', 'REJECTED'):
+                _lines.append('hblink_pdu_total{{system="{}",command="{}",result="{}"}} {}'.format(_label(_system), _command, _result.lower(), _pdu_stats[_command][_result]))
+
+    _lines.append('# HELP hblink_clients Clients logged in to a master')
+    _lines.append('# TYPE hblink_clients gauge')
+    for _system in _names:
+        _config = _systems[_system]._config
+        if _config['MODE'] == 'MASTER':
+            _lines.append('hblink_clients{{system="{}"}} {}'.format(_label(_system), len(_config['CLIENTS'])))
+
+    _lines.append('# HELP hblink_connected 1 if a client system is logged in to its master')
+    _lines.append('# TYPE hblink_connected gauge')
+    for _system in _names:
+        _config = _systems[_system]._config
+        if _config['MODE'] == 'CLIENT':
+            _lines.append('hblink_connected{{system="{}"}} {}'.format(_label(_system), int(_config['STATS']['CONNECTION'] == 'YES')))
+
+    _lines.append('# HELP hblink_forward_latency_seconds Time from receiving a frame to forwarding or repeating it')
+    _lines.append('# TYPE hblink_forward_latency_seconds histogram')
+    for _system in _names:
+        _histogram = _systems[_system]._metrics.latency
+        _total = 0
+        for _bound, _count in zip(_histogram.bounds, _histogram.counts):
+            _total += _count
+            _lines.append('hblink_forward_latency_seconds_bucket{{system="{}",le="{:g}"}} {}'.format(_label(_system), _bound, _total))
+        _lines.append('hblink_forward_latency_seconds_bucket{{system="{}",le="+Inf"}} {}'.format(_label(_system), _histogram.count))
+        _lines.append('hblink_forward_latency_seconds_sum{{system="{}"}} {!r}'.format(_label(_system), _histogram.sum))
+        _lines.append('hblink_forward_latency_seconds_count{{system="{}"}} {}'.format(_label(_system), _histogram.count))
+
+    _lines.append('# HELP hblink_pair_latency_seconds Time from receiving a frame to sending it, per source and target system')
+    _lines.append('# TYPE hblink_pair_latency_seconds summary')
+    for _system in _names:
+        _targets = _systems[_system]._metrics.targets
+        for _target in sorted(_targets):
+            _histogram = _targets[_target]
+            for _q in ('0.5', '0.99'):
+                _lines.append('hblink_pair_latency_seconds{{source="{}",target="{}",quantile="{}"}} {!r}'.format(_label(_system), _label(_target), _q, _histogram.quantile(float(_q))))
+            _lines.append('hblink_pair_latency_seconds_sum{{source="{}",target="{}"}} {!r}'.format(_label(_system), _label(_target), _histogram.sum))
+            _lines.append('hblink_pair_latency_seconds_count{{source="{}",target="{}"}} {}'.format(_label(_system), _label(_target), _histogram.count))
+
+    _lines.append('# HELP hblink_pair_latency_max_seconds Longest time a frame spent inside HBlink, per source and target system')
+    _lines.append('# TYPE hblink_pair_latency_max_seconds gauge')
+    for _system in _names:
+        _targets = _systems[_system]._metrics.targets
+        for _target in sorted(_targets):
+            _lines.append('hblink_pair_latency_max_seconds{{source="{}",target="{}"}} {!r}'.format(_label(_system), _label(_target), _targets[_target].max))
+
+    if _report:
+        _lines.append('# HELP hblink_report_clients Reporting clients connected')
+        _lines.append('# TYPE hblink_report_clients gauge')
+        _lines.append('hblink_report_clients {}'.format(len(_report.clients)))
+        _lines.append('# HELP hblink_report_queued_bytes Bytes waiting for reporting clients that are behind')
+        _lines.append('# TYPE hblink_report_queued_bytes gauge')
+        _lines.append('hblink_report_queued_bytes {}'.format(sum(_client.queued() for _client in _report.clients)))
+        _lines.append('# HELP hblink_report_dropped_total Messages dropped from reporting client queues, by reason')
+        _lines.append('# TYPE hblink_report_dropped_total counter')
+        for _reason in sorted(_report.dropped):
+            _lines.append('hblink_report_dropped_total{{reason="{}"}} {}'.format(_reason.lower(), _report.dropped[_reason]))
+        _lines.append('# HELP hblink_report_disconnects_total Reporting clients disconnected for falling too far behind')
+        _lines.append('# TYPE hblink_report_disconnects_total counter')
+        _lines.append('hblink_report_disconnects_total {}'.format(_report.disconnected))
+
+    return '\n'.join(_lines) + '\n'
+
+
+class METRICSPAGE(Resource):
+    isLeaf = True
+
+    def __init__(self, _systems, _report = None):
+        Resource.__init__(self)
+        self._systems = _systems
+        self._report = _report
+
+    def render_GET(self, _request):
+        _request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return exposition(self._systems, self._report)
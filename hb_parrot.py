@@ -25,6 +25,7 @@ from __future__ import print_function
 
 # Python modules we need
 import sys
+import logging
 from bitarray import bitarray
 from time import time, sleep
 from importlib import import_module
@@ -36,7 +37,8 @@ from twisted.internet import reactor, task
 
 # Things we import from the main hblink module
 from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports
-from dmr_utils.utils import hex_str_3, int_id, get_alias
+from hb_alias import ALIAS, ID
+from dmr_utils.utils import hex_str_3, int_id
 from dmr_utils import decode, bptc, const
 import hb_config
 import hb_log
@@ -109,25 +111,37 @@ class parrot(HBSYSTEM):
         }
         self.CALL_DATA = []
 
-    def dmrd_received(self, _radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data):
+    def dmrd_received(self, _frame):
         pkt_time = time()
-        dmrpkt = _data[20:53]
-        _bits = int_id(_data[15])
+        _radio_id   = _frame.radio_id
+        _rf_src     = _frame.rf_src
+        _dst_id     = _frame.dst_id
+        _seq        = _frame.seq
+        _slot       = _frame.slot
+        _call_type  = _frame.call_type
+        _frame_type = _frame.frame_type
+        _dtype_vseq = _frame.dtype_vseq
+        _stream_id  = _frame.stream_id
+        _data       = _frame.data
+        dmrpkt = _frame.payload
+        _bits = _frame.bits
         
         if _call_type == 'group':
             
             # Is this is a new call stream?
             if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                 self.STATUS['RX_START'] = pkt_time
-                self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
-                                  self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
+                                      self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot)
         
             
             # Final actions - Is this a voice terminator?
             if (_frame_type == hb_const.HBPF_DATA_SYNC) and (_dtype_vseq == hb_const.HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != hb_const.HBPF_SLT_VTERM):
                 call_duration = pkt_time - self.STATUS['RX_START']
-                self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
-                                  self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot, call_duration)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
+                                      self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot, call_duration)
                 self.CALL_DATA.append(_data)
                 sleep(2)
                 logger.info('(%s) Playing back transmission from subscriber: %s', self._system, int_id(_rf_src))
@@ -160,7 +174,7 @@ if __name__ == '__main__':
     import sys
     import os
     import signal
-    from dmr_utils.utils import try_download, mk_id_dict
+    from hb_alias import ALIASES
     
     # Change the current directory to the location of the application
     os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -196,27 +210,13 @@ if __name__ == '__main__':
         signal.signal(sig, sig_handler)
     
     # ID ALIAS CREATION
-    # Download
-    if CONFIG['ALIASES']['TRY_DOWNLOAD'] == True:
-        # Try updating peer aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'], CONFIG['ALIASES']['PEER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        # Try updating subscriber aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'], CONFIG['ALIASES']['SUBSCRIBER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        
-    # Make Dictionaries
-    peer_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'])
-    if peer_ids:
-        logger.info('ID ALIAS MAPPER: peer_ids dictionary is available')
-        
-    subscriber_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'])
-    if subscriber_ids:
-        logger.info('ID ALIAS MAPPER: subscriber_ids dictionary is available')
-    
-    talkgroup_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['TGID_FILE'])
-    if talkgroup_ids:
-        logger.info('ID ALIAS MAPPER: talkgroup_ids dictionary is available')
+    # Start on the aliases already indexed; downloading and indexing new ones
+    # happens in a thread, and they're swapped in when they're ready
+    def set_aliases(_tables):
+        global peer_ids, subscriber_ids, talkgroup_ids
+        peer_ids, subscriber_ids, talkgroup_ids = _tables['PEER'], _tables['SUBSCRIBER'], _tables['TGID']
+
+    ALIASES(CONFIG['ALIASES'], logger, set_aliases).start()
         
     # INITIALIZE THE REPORTING LOOP
     report_server = config_reports(CONFIG, logger, reportFactory)    
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Feed a capture file (see hb_capture.py and CAPTURE in hblink-SAMPLE.cfg) back
+through hb_confbridge.py or hb_router.py, with no network. Each system gets an
+in-memory transport that counts what would have been sent, and optionally
+captures it to another file so two versions of the code can be compared.
+
+Replay is deterministic: the application's clock is the capture's clock, so
+stream timeouts, hangtime and the rule timers see the times they saw when the
+traffic was recorded, however fast it is replayed. Packets go out at the
+recorded pace (or --speed times it), or with --fast as quickly as they can be
+processed -- that is the mode for measuring changes to dmrd_received.
+
+Use the same config and rules files the capture was made with. Repeaters
+already logged in when the capture started are logged in as soon as they send
+DMRD, since their login isn't in the file.
+'''
+
+from __future__ import print_function
+
+import sys
+import os
+import argparse
+from importlib import import_module
+from time import time
+from socket import gethostbyname, error
+
+from twisted.internet import reactor
+
+import hb_config
+import hb_log
+import hb_capture
+import hb_const
+from hb_metrics import HISTOGRAM
+from hblink import systems
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+# Applications that can be replayed, and their rules files
+APPS = {
+    'hb_confbridge': 'hb_confbridge_rules',
+    'hb_router': 'hb_routing_rules',
+}
+
+# Modules that take the time with "from time import time" and so see the
+# replay clock instead
+CLOCKED = ('hblink', 'hb_frame', 'hb_clients')
+
+RULE_TIMER = 60
+
+
+# The capture's clock, moved forward by each packet replayed
+class CLOCK(object):
+    def __init__(self, _now):
+        self.now = _now
+
+    def __call__(self):
+        return self.now
+
+
+# Stands in for a UDP port. Counts what the system sends and, with an output
+# capture, records it with the destination address in place of the source.
+class MEMORYTRANSPORT(object):
+    def __init__(self, _system, _clock, _output):
+        self._system = _system
+        self._clock = _clock
+        self._output = _output
+        self.packets = 0
+        self.bytes = 0
+
+    def write(self, _data, (_host, _port)):
+        self.packets += 1
+        self.bytes += len(_data)
+        if self._output:
+            self._output.write(self._system, _host, _port, _data, self._clock.now)
+
+
+class REPLAY(object):
+    def __init__(self, _app, _config, _records, _clock):
+        self._app = _app
+        self._CONFIG = _config
+        self._records = _records
+        self._clock = _clock
+        self._next_rules = _clock.now + RULE_TIMER
+        self.replayed = 0
+        self.skipped = 0            # packets for systems that aren't configured or enabled
+        self.registered = 0
+        self.dmrd = HISTOGRAM()     # wall clock seconds spent handling each DMRD packet
+
+    # One captured packet into the system it was received by
+    def feed(self, (_time, _system, _host, _port, _data)):
+        # The rule timer runs every minute of capture time
+        while _time >= self._next_rules:
+            self._clock.now = self._next_rules
+            self._app.rule_timer_loop()
+            self._next_rules += RULE_TIMER
+        self._clock.now = _time
+
+        _protocol = systems.get(_system)
+        if _protocol is None:
+            self.skipped += 1
+            return
+        _config = self._CONFIG['SYSTEMS'][_system]
+        if _config['MODE'] == 'CLIENT':
+            _host, _port = _config['MASTER_IP'], _config['MASTER_PORT']
+
+        if _data[:4] == 'DMRD':
+            if _config['MODE'] == 'MASTER' and not _protocol._clients.validate(_data[11:15], _host, _port, hb_const.HBPC_YES):
+                _protocol._clients.connected(_protocol._clients.add(_data[11:15], _host, _port))
+                self.registered += 1
+            _start = time()
+            _protocol.datagramReceived(_data, (_host, _port))
+            self.dmrd.observe(time() - _start)
+        else:
+            _protocol.datagramReceived(_data, (_host, _port))
+        self.replayed += 1
+
+    def fast(self):
+        for _record in self._records:
+            self.feed(_record)
+
+    # Each packet goes in once its offset from the first, divided by _speed,
+    # has passed on the wall clock. Stops the reactor at the end.
+    def paced(self, _speed):
+        self._speed = _speed
+        self._first = self._clock.now
+        self._start = time()
+        self._pace(None)
+
+    def _pace(self, _record):
+        if _record:
+            self.feed(_record)
+        for _record in self._records:
+            _wait = self._start + (_record[0] - self._first) / self._speed - time()
+            if _wait > 0:
+                reactor.callLater(_wait, self._pace, _record)
+                return
+            self.feed(_record)
+        reactor.stop()
+
+
+#************************************************
+#      MAIN PROGRAM LOOP STARTS HERE
+#************************************************
+
+if __name__ == '__main__':
+
+    from itertools import chain
+
+    # CLI argument parser - handles picking up the config file from the command line, and sending a "help" message
+    parser = argparse.ArgumentParser()
+    parser.add_argument('CAPTURE_FILE', help='/full/path/to/the/capture/file')
+    parser.add_argument('-a', '--app', action='store', dest='APP', choices=sorted(APPS), default='hb_confbridge', help='Application to replay into (default hb_confbridge)')
+    parser.add_argument('-c', '--config', action='store', dest='CONFIG_FILE', help='/full/path/to/config.file (usually hblink.cfg)')
+    parser.add_argument('-l', '--logging', action='store', dest='LOG_LEVEL', help='Override config file logging level.')
+    parser.add_argument('-f', '--fast', action='store_true', dest='FAST', help='Replay as fast as possible instead of at the recorded pace')
+    parser.add_argument('-s', '--speed', action='store', dest='SPEED', type=float, default=1.0, help='Multiple of the recorded pace to replay at (default 1)')
+    parser.add_argument('-o', '--output', action='store', dest='OUTPUT', help='Capture everything the systems send to this file')
+    cli_args = parser.parse_args()
+
+    # Files named on the command line are relative to where we were started
+    cli_args.CAPTURE_FILE = os.path.abspath(cli_args.CAPTURE_FILE)
+    if cli_args.OUTPUT:
+        cli_args.OUTPUT = os.path.abspath(cli_args.OUTPUT)
+    if cli_args.CONFIG_FILE:
+        cli_args.CONFIG_FILE = os.path.abspath(cli_args.CONFIG_FILE)
+
+    # Change the current directory to the location of the application, for the rules files
+    os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
+
+    # Ensure we have a path for the config file, if one wasn't specified, then use the default (top of file)
+    if not cli_args.CONFIG_FILE:
+        cli_args.CONFIG_FILE = os.path.dirname(os.path.abspath(__file__))+'/hblink.cfg'
+
+    # Call the external routine to build the configuration dictionary
+    CONFIG = hb_config.build_config(cli_args.CONFIG_FILE)
+
+    # Nothing leaves the process: no reports, no AMBE export, and no capturing the replay
+    CONFIG['REPORTS']['REPORT'] = False
+    for system in CONFIG['SYSTEMS']:
+        CONFIG['SYSTEMS'][system]['EXPORT_AMBE'] = False
+        CONFIG['SYSTEMS'][system]['CAPTURE'] = False
+
+    # Clients never log in here, so look their masters up now: packets from the
+    # master are replayed as coming from its address
+    for system in CONFIG['SYSTEMS']:
+        if CONFIG['SYSTEMS'][system]['MODE'] == 'CLIENT':
+            try:
+                CONFIG['SYSTEMS'][system]['MASTER_IP'] = gethostbyname(CONFIG['SYSTEMS'][system]['MASTER_HOST'])
+            except error as err:
+                sys.exit('Could not resolve the master of {}, {}: {}'.format(system, CONFIG['SYSTEMS'][system]['MASTER_HOST'], err))
+
+    # Start the system logger
+    if cli_args.LOG_LEVEL:
+        CONFIG['LOGGER']['LOG_LEVEL'] = cli_args.LOG_LEVEL
+    logger = hb_log.config_logging(CONFIG['LOGGER'])
+
+    records = hb_capture.read_capture(cli_args.CAPTURE_FILE)
+    try:
+        first = next(records)
+    except StopIteration:
+        sys.exit('Capture file {} is empty'.format(cli_args.CAPTURE_FILE))
+    records = chain([first], records)
+
+    # Everything that asks the time gets the capture's time, from before the rules are built
+    clock = CLOCK(first[0])
+    app = import_module(cli_args.APP)
+    for module in (app,) + tuple(import_module(_module) for _module in CLOCKED):
+        module.time = clock
+
+    # Set up the application the way its own main program does, without aliases
+    app.CONFIG = CONFIG
+    app.logger = logger
+    app.peer_ids = app.subscriber_ids = app.talkgroup_ids = {}
+    app.report_server = None
+    if cli_args.APP == 'hb_confbridge':
+        app.BRIDGES = app.make_bridges(APPS[cli_args.APP])
+    else:
+        app.RULES = app.make_rules(APPS[cli_args.APP])
+    app.ACL = app.build_acl('sub_acl')
+
+    output = hb_capture.get_writer(cli_args.OUTPUT, False) if cli_args.OUTPUT else None
+    for system in CONFIG['SYSTEMS']:
+        if CONFIG['SYSTEMS'][system]['ENABLED']:
+            systems[system] = app.routerSYSTEM(system, CONFIG, logger, None)
+            systems[system].transport = MEMORYTRANSPORT(system, clock, output)
+
+    replay = REPLAY(app, CONFIG, records, clock)
+    start = time()
+    if cli_args.FAST:
+        replay.fast()
+    else:
+        reactor.callWhenRunning(replay.paced, cli_args.SPEED)
+        reactor.run()
+    elapsed = time() - start
+
+    print('Replayed {} packets ({} for unknown systems skipped) in {:.3f}s, {:.0f} packets/s'.format(replay.replayed, replay.skipped, elapsed, replay.replayed / elapsed if elapsed else 0))
+    print('Capture time {:.3f}s, {} repeaters logged in from their DMRD'.format(clock.now - first[0], replay.registered))
+    print('DMRD handling: p50 {P50:.6f}s p99 {P99:.6f}s max {MAX:.6f}s over {COUNT} packets'.format(**replay.dmrd.summary()))
+    for system in sorted(systems):
+        _metrics = systems[system]._metrics
+        print('{}: rx {} fwd {} rpt {} frames, drops acl {} contention {} collision {} unauth {}, sent {} packets {} bytes'.format(
+            system,
+            _metrics.slot[1].rx_frames + _metrics.slot[2].rx_frames,
+            _metrics.slot[1].fwd_frames + _metrics.slot[2].fwd_frames,
+            _metrics.slot[1].rpt_frames + _metrics.slot[2].rpt_frames,
+            _metrics.slot[1].drop_acl + _metrics.slot[2].drop_acl,
+            _metrics.slot[1].drop_contention + _metrics.slot[2].drop_contention,
+            _metrics.slot[1].drop_collision + _metrics.slot[2].drop_collision,
+            _metrics.drop_unauth,
+            systems[system].transport.packets,
+            systems[system].transport.bytes))
@@ -0,0 +1,78 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Name resolution for the addresses in the config file (MASTER_IP, EXPORT_IP),
+on the reactor's resolver so nothing waits on DNS. Answers are kept for
+DNS_TTL seconds ([GLOBAL]): CLIENT systems resolve their master every time
+they log in, so a master whose address changes is found again within that
+long, and many systems pointed at the same master share one lookup.
+
+    resolve('master.example.net', 60).addCallback(...)
+
+fires with the address. Addresses that are already literal fire right away.
+When a lookup fails and an old answer is on hand, the old answer is used.
+'''
+
+from time import time
+
+from twisted.internet import reactor, defer
+from twisted.internet.abstract import isIPAddress, isIPv6Address
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+_cache = {}         # name -> (address, when it expires)
+_pending = {}       # name -> Deferreds waiting on a lookup already running
+
+
+def resolve(_name, _ttl):
+    if not _name or isIPAddress(_name) or isIPv6Address(_name):
+        return defer.succeed(_name)
+
+    _address, _expires = _cache.get(_name, (None, 0))
+    if _expires > time():
+        return defer.succeed(_address)
+
+    _waiting = defer.Deferred()
+    if _name in _pending:
+        _pending[_name].append(_waiting)
+    else:
+        _pending[_name] = [_waiting]
+        reactor.resolve(_name).addCallbacks(_resolved, _failed, callbackArgs=(_name, _ttl), errbackArgs=(_name,))
+    return _waiting
+
+
+def _resolved(_address, _name, _ttl):
+    _cache[_name] = (_address, time() + _ttl)
+    for _waiting in _pending.pop(_name):
+        _waiting.callback(_address)
+
+
+def _failed(_failure, _name):
+    _address, _expires = _cache.get(_name, (None, 0))
+    for _waiting in _pending.pop(_name):
+        if _address:
+            _waiting.callback(_address)
+        else:
+            _waiting.errback(_failure)
@@ -33,6 +33,7 @@ from __future__ import print_function
 
 # Python modules we need
 import sys
+import logging
 from bitarray import bitarray
 from time import time
 from importlib import import_module
@@ -43,8 +44,9 @@ from twisted.protocols.basic import NetstringReceiver
 from twisted.internet import reactor, task
 
 # Things we import from the main hblink module
-from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports
-from dmr_utils.utils import hex_str_3, int_id, get_alias
+from hblink import HBSYSTEM, systems, hblink_handler, reportFactory, REPORT_OPCODES, config_reports, rebuild_config, reload_systems
+from hb_alias import ALIAS, ID
+from dmr_utils.utils import hex_str_3, int_id
 from dmr_utils import decode, bptc, const
 import hb_config
 import hb_log
@@ -66,7 +68,8 @@ __status__     = 'pre-alpha'
 # Note: A stanza *must* exist for any MASTER or CLIENT configured in the main
 # configuration file and listed as "active". It can be empty, 
 # but it has to exist.
-def make_rules(_hb_routing_rules):
+def make_rules(_hb_routing_rules, _config = None):
+    _config = _config or CONFIG
     try:
         rule_file = import_module(_hb_routing_rules)
         logger.info('Routing rules file found and rules imported')
@@ -87,9 +90,9 @@ def make_rules(_hb_routing_rules):
                 _rule['OFF'][i] = hex_str_3(_rule['OFF'][i])
             _rule['TIMEOUT']= _rule['TIMEOUT']*60
             _rule['TIMER']      = time() + _rule['TIMEOUT']
-        if _system not in CONFIG['SYSTEMS']:
+        if _system not in _config['SYSTEMS']:
             sys.exit('ERROR: Routing rules found for system not configured main configuration')
-    for _system in CONFIG['SYSTEMS']:
+    for _system in _config['SYSTEMS']:
         if _system not in rule_file.RULES:
             sys.exit('ERROR: Routing rules not found for all systems configured')
     return rule_file.RULES
@@ -99,7 +102,8 @@ def make_rules(_hb_routing_rules):
 # ACL may be a single list of subscriber IDs
 # Global action is to allow or deny them. Multiple lists with different actions and ranges
 # are not yet implemented.
-def build_acl(_sub_acl):
+# Builds the ACL and the function that checks it, without putting either in place
+def make_acl(_sub_acl):
     try:
         logger.info('ACL file found, importing entries. This will take about 1.5 seconds per 1 million IDs')
         acl_file = import_module(_sub_acl)
@@ -126,7 +130,6 @@ def build_acl(_sub_acl):
 
     # Depending on which type of ACL is used (PERMIT, DENY... or there isn't one)
     # define a differnet function to be used to check the ACL
-    global allow_sub
     if ACL_ACTION == 'PERMIT':
         def allow_sub(_sub):
             if _sub in ACL:
@@ -143,9 +146,57 @@ def build_acl(_sub_acl):
         def allow_sub(_sub):
             return True
     
+    return ACL, allow_sub
+
+
+# Put the ACL from make_acl() in place
+def build_acl(_sub_acl):
+    global allow_sub
+    ACL, allow_sub = make_acl(_sub_acl)
     return ACL
 
 
+# Rules that are still there after a reload keep their state: whether they
+# are ACTIVE, and when their timer runs out
+def carry_rules(_old, _new):
+    for _system in _new:
+        _was = dict(((_rule['NAME'], _rule['SRC_GROUP'], _rule['SRC_TS'], _rule['DST_NET'], _rule['DST_GROUP'], _rule['DST_TS'], _rule['TO_TYPE']), _rule) for _rule in _old[_system]['GROUP_VOICE']) if _system in _old else {}
+        for _rule in _new[_system]['GROUP_VOICE']:
+            _key = (_rule['NAME'], _rule['SRC_GROUP'], _rule['SRC_TS'], _rule['DST_NET'], _rule['DST_GROUP'], _rule['DST_TS'], _rule['TO_TYPE'])
+            if _key in _was:
+                _rule['ACTIVE'] = _was[_key]['ACTIVE']
+                _rule['TIMER'] = _was[_key]['TIMER']
+    return _new
+
+
+# Re-read the config file, the routing rules and the ACL (SIGHUP or RELOAD)
+# and put them in place without a restart. Nothing changes if any of them
+# won't load.
+def reload_config(_config_file, _log_level):
+    logger.info('RELOAD: reading %s', _config_file)
+    _new_config = rebuild_config(_config_file, logger, _log_level)
+    if not _new_config:
+        return
+    try:
+        for _module in ('hb_routing_rules', 'sub_acl'):
+            if _module in sys.modules:
+                reload(sys.modules[_module])
+        _rules = make_rules('hb_routing_rules', _new_config)
+        _acl, _allow_sub = make_acl('sub_acl')
+    except (SystemExit, Exception) as err:
+        logger.error('RELOAD: routing rules or ACL not usable, nothing changed: %s', err)
+        return
+
+    def swap():
+        global RULES, ACL, allow_sub
+        RULES = carry_rules(RULES, _rules)
+        ACL, allow_sub = _acl, _allow_sub
+        logger.info('RELOAD: routing rules and ACL replaced')
+
+    if reload_systems(CONFIG, _new_config, logger, report_server, routerSYSTEM, swap) and CONFIG['REPORTS']['REPORT']:
+        report_server.send_config()
+
+
 # Run this every minute for rule timer updates
 def rule_timer_loop():
     logger.info('(ALL HBSYSTEMS) Rule timer loop started')
@@ -227,28 +278,42 @@ class routerSYSTEM(HBSYSTEM):
                 }
             }
 
-    def dmrd_received(self, _radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data):
+    def dmrd_received(self, _frame):
         pkt_time = time()
-        dmrpkt = _data[20:53]
-        _bits = int_id(_data[15])
+        _radio_id   = _frame.radio_id
+        _rf_src     = _frame.rf_src
+        _dst_id     = _frame.dst_id
+        _seq        = _frame.seq
+        _slot       = _frame.slot
+        _call_type  = _frame.call_type
+        _frame_type = _frame.frame_type
+        _dtype_vseq = _frame.dtype_vseq
+        _stream_id  = _frame.stream_id
+        _data       = _frame.data
+        dmrpkt = _frame.payload
+        _bits = _frame.bits
+        _metrics = self._metrics.slot[_slot]
 
         if _call_type == 'group':
             
             # Check for ACL match, and return if the subscriber is not allowed
             if allow_sub(_rf_src) == False:
                 self._logger.warning('(%s) Group Voice Packet ***REJECTED BY ACL*** From: %s, HBP Peer %s, Destination TGID %s', self._system, int_id(_rf_src), int_id(_radio_id), int_id(_dst_id))
+                _metrics.drop_acl += 1
                 return
             
             # Is this a new call stream?   
             if (_stream_id != self.STATUS[_slot]['RX_STREAM_ID']):
                 if (self.STATUS[_slot]['RX_TYPE'] != hb_const.HBPF_SLT_VTERM) and (pkt_time < (self.STATUS[_slot]['RX_TIME'] + hb_const.STREAM_TO)) and (_rf_src != self.STATUS[_slot]['RX_RFS']):
                     self._logger.warning('(%s) Packet received with STREAM ID: %s <FROM> SUB: %s REPEATER: %s <TO> TGID %s, SLOT %s collided with existing call', self._system, int_id(_stream_id), int_id(_rf_src), int_id(_radio_id), int_id(_dst_id), _slot)
+                    _metrics.drop_collision += 1
                     return
                 
                 # This is a new call stream
                 self.STATUS['RX_START'] = pkt_time
-                self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
-                        self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL START* STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s', \
+                            self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot)
                 
                 # If we can, use the LC from the voice header as to keep all options intact
                 if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD:
@@ -279,18 +344,22 @@ class routerSYSTEM(HBSYSTEM):
                     if ((rule['DST_GROUP'] != _target_status[rule['DST_TS']]['RX_TGID']) and ((pkt_time - _target_status[rule['DST_TS']]['RX_TIME']) < RULES[_target]['GROUP_HANGTIME'])):
                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD:
                             self._logger.info('(%s) Call not routed to TGID%s, target active or in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_target_status[rule['DST_TS']]['RX_TGID']))
+                        _metrics.drop_contention += 1
                         continue    
                     if ((rule['DST_GROUP'] != _target_status[rule['DST_TS']]['TX_TGID']) and ((pkt_time - _target_status[rule['DST_TS']]['TX_TIME']) < RULES[_target]['GROUP_HANGTIME'])):
                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD:
                             self._logger.info('(%s) Call not routed to TGID%s, target in group hangtime: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_target_status[rule['DST_TS']]['TX_TGID']))
+                        _metrics.drop_contention += 1
                         continue
                     if (rule['DST_GROUP'] == _target_status[rule['DST_TS']]['RX_TGID']) and ((pkt_time - _target_status[rule['DST_TS']]['RX_TIME']) < hb_const.STREAM_TO):
                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD:
                             self._logger.info('(%s) Call not routed to TGID%s, matching call already active on target: HBSystem: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_target_status[rule['DST_TS']]['RX_TGID']))
+                        _metrics.drop_contention += 1
                         continue
                     if (rule['DST_GROUP'] == _target_status[rule['DST_TS']]['TX_TGID']) and (_rf_src != _target_status[rule['DST_TS']]['TX_RFS']) and ((pkt_time - _target_status[rule['DST_TS']]['TX_TIME']) < hb_const.STREAM_TO):
                         if _frame_type == hb_const.HBPF_DATA_SYNC and _dtype_vseq == hb_const.HBPF_SLT_VHEAD:
                             self._logger.info('(%s) Call not routed for subscriber %s, call route in progress on target: HBSystem: %s, TS: %s, TGID: %s, SUB: %s', self._system, int_id(_rf_src), _target, rule['DST_TS'], int_id(_target_status[rule['DST_TS']]['TX_TGID']), _target_status[rule['DST_TS']]['TX_RFS'])
+                        _metrics.drop_contention += 1
                         continue
 
                     # Set values for the contention handler to test next time there is a frame to forward
@@ -338,6 +407,9 @@ class routerSYSTEM(HBSYSTEM):
                     
                     # Transmit the packet to the destination system
                     systems[_target].send_system(_tmp_data)
+                    _metrics.fwd_frames += 1
+                    _metrics.fwd_bytes += len(_tmp_data)
+                    self._metrics.forwarded(_target, _frame.rx_time, time())
                     self._logger.debug('(%s) Packet routed by rule: %s to %s system: %s', self._system, rule['NAME'], self._CONFIG['SYSTEMS'][_target]['MODE'], _target)
             
             
@@ -345,8 +417,9 @@ class routerSYSTEM(HBSYSTEM):
             # Final actions - Is this a voice terminator?
             if (_frame_type == hb_const.HBPF_DATA_SYNC) and (_dtype_vseq == hb_const.HBPF_SLT_VTERM) and (self.STATUS[_slot]['RX_TYPE'] != hb_const.HBPF_SLT_VTERM):
                 call_duration = pkt_time - self.STATUS['RX_START']
-                self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
-                        self._system, int_id(_stream_id), get_alias(_rf_src, subscriber_ids), int_id(_rf_src), get_alias(_radio_id, peer_ids), int_id(_radio_id), get_alias(_dst_id, talkgroup_ids), int_id(_dst_id), _slot, call_duration)
+                if self._logger.isEnabledFor(logging.INFO):
+                    self._logger.info('(%s) *CALL END*   STREAM ID: %s SUB: %s (%s) REPEATER: %s (%s) TGID %s (%s), TS %s, Duration: %s', \
+                            self._system, ID(_stream_id), ALIAS(_rf_src, subscriber_ids), ID(_rf_src), ALIAS(_radio_id, peer_ids), ID(_radio_id), ALIAS(_dst_id, talkgroup_ids), ID(_dst_id), _slot, call_duration)
                 
                 #
                 # Begin in-band signalling for call end. This has nothign to do with routing traffic directly.
@@ -416,7 +489,7 @@ if __name__ == '__main__':
     import sys
     import os
     import signal
-    from dmr_utils.utils import try_download, mk_id_dict
+    from hb_alias import ALIASES
     
     # Change the current directory to the location of the application
     os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
@@ -452,27 +525,13 @@ if __name__ == '__main__':
         signal.signal(sig, sig_handler)
     
     # ID ALIAS CREATION
-    # Download
-    if CONFIG['ALIASES']['TRY_DOWNLOAD'] == True:
-        # Try updating peer aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'], CONFIG['ALIASES']['PEER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        # Try updating subscriber aliases file
-        result = try_download(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'], CONFIG['ALIASES']['SUBSCRIBER_URL'], CONFIG['ALIASES']['STALE_TIME'])
-        logger.info(result)
-        
-    # Make Dictionaries
-    peer_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['PEER_FILE'])
-    if peer_ids:
-        logger.info('ID ALIAS MAPPER: peer_ids dictionary is available')
-        
-    subscriber_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['SUBSCRIBER_FILE'])
-    if subscriber_ids:
-        logger.info('ID ALIAS MAPPER: subscriber_ids dictionary is available')
-    
-    talkgroup_ids = mk_id_dict(CONFIG['ALIASES']['PATH'], CONFIG['ALIASES']['TGID_FILE'])
-    if talkgroup_ids:
-        logger.info('ID ALIAS MAPPER: talkgroup_ids dictionary is available')
+    # Start on the aliases already indexed; downloading and indexing new ones
+    # happens in a thread, and they're swapped in when they're ready
+    def set_aliases(_tables):
+        global peer_ids, subscriber_ids, talkgroup_ids
+        peer_ids, subscriber_ids, talkgroup_ids = _tables['PEER'], _tables['SUBSCRIBER'], _tables['TGID']
+
+    ALIASES(CONFIG['ALIASES'], logger, set_aliases).start()
     
     # Build the routing rules file
     RULES = make_rules('hb_routing_rules')
@@ -482,6 +541,13 @@ if __name__ == '__main__':
     
     # INITIALIZE THE REPORTING LOOP
     report_server = config_reports(CONFIG, logger, reportFactory)    
+
+    # Reload the config file, routing rules and ACL on SIGHUP or RELOAD
+    def reload_handler(_signal, _frame):
+        reactor.callFromThread(reload_config, cli_args.CONFIG_FILE, cli_args.LOG_LEVEL)
+
+    signal.signal(signal.SIGHUP, reload_handler)
+    report_server.reload = lambda: reload_config(cli_args.CONFIG_FILE, cli_args.LOG_LEVEL)
     
     # HBlink instance creation
     logger.info('HBlink \'hb_router.py\' (c) 2016 N0MJS & the K0USY Group - SYSTEM STARTING...')
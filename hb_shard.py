@@ -0,0 +1,227 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Sharded MASTER systems. With SHARDS greater than 1 in [GLOBAL], hblink.py
+starts that many worker processes, and every worker binds each MASTER port
+with SO_REUSEPORT. The kernel hashes each repeater's address to one worker,
+so a repeater always logs in to, pings and sends voice to the same worker.
+
+What the workers have to share is who is connected, so that a frame arriving
+at one worker can be repeated to clients logged in to the others. Each MASTER
+system gets a small table in a memory-mapped file. Every worker writes only to
+its own partition of the table and reads everyone else's:
+
+    Header     'HBST', version (u16), shards (u16), capacity (u32)
+    Counters   one u32 generation per shard, bumped on every change
+    Records    shards * capacity records of:
+                   seq (u32), state (u8), radio ID (4), IPv4 (4), port (u16), pad
+
+A record is written seqlock style: seq goes odd, the fields are written, then
+seq goes even. A reader that sees an odd or changed seq skips the record and
+picks it up on the next generation change. Readers cache the peer list until
+some worker's generation moves, so the common case costs one small unpack
+per shard per frame.
+
+CLIENT systems only run in worker 0. Nothing collects the other workers'
+counters and clients, so sharding needs REPORT False and METRICS_PORT 0 in
+[REPORTS], and hblink.py won't start sharded otherwise.
+'''
+
+from __future__ import print_function
+
+import errno
+import mmap
+import os
+import signal
+import socket
+import subprocess
+import sys
+from struct import Struct
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+# Not in the socket module of every Python we run on -- this is the Linux value
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+# Clients each worker can publish, per MASTER system
+SHARD_CAPACITY = 4096
+
+TABLE_VERSION = 1
+
+_HEADER = Struct('=4sHHI')
+_GEN    = Struct('=I')
+_RECORD = Struct('=IB4s4sHx')
+
+_FREE   = 0
+_ACTIVE = 1
+
+
+# Bind a UDP socket that other workers can bind as well
+def reuseport_socket(_ip, _port):
+    _sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    _sock.bind((_ip, _port))
+    _sock.setblocking(False)
+    return _sock
+
+
+def table_file(_config, _system):
+    return '{}hblink-{}.shard'.format(_config['GLOBAL']['PATH'], _system)
+
+
+# A client logged in to another worker. It looks enough like an HBCLIENT
+# for HBSYSTEM.repeat_clients() and hb_fanout to send to it.
+class _PEER(object):
+    __slots__ = ('radio_id', 'ip', 'port', 'fanout')
+
+    def __init__(self, _radio_id, _ip, _port):
+        self.radio_id = _radio_id
+        self.ip = _ip
+        self.port = _port
+        self.fanout = None
+
+
+class SHARDTABLE(object):
+    def __init__(self, _file, _shard, _shards, _capacity = SHARD_CAPACITY):
+        self._shard = _shard
+        self._shards = _shards
+        self._capacity = _capacity
+        self._gen_base = _HEADER.size
+        self._rec_base = self._gen_base + _GEN.size * _shards
+        _size = self._rec_base + _RECORD.size * _shards * _capacity
+
+        with open(_file, 'r+b') as _handle:
+            self._map = mmap.mmap(_handle.fileno(), _size)
+        _magic, _version, _table_shards, _table_capacity = _HEADER.unpack_from(self._map, 0)
+        if _magic != 'HBST' or _version != TABLE_VERSION or _table_shards != _shards or _table_capacity != _capacity:
+            raise ValueError('shard table {} does not match this configuration'.format(_file))
+
+        self._slots = {}            # radio ID -> record index, our own partition only
+        self._free = range((_shard + 1) * _capacity - 1, _shard * _capacity - 1, -1)
+        self._generation = 0
+        self._peers = []
+        self._seen = None
+
+    # Called once by the parent process, before any workers start
+    @staticmethod
+    def create(_file, _shards, _capacity = SHARD_CAPACITY):
+        _size = _HEADER.size + _GEN.size * _shards + _RECORD.size * _shards * _capacity
+        with open(_file, 'wb') as _handle:
+            _handle.write(_HEADER.pack('HBST', TABLE_VERSION, _shards, _capacity))
+            _handle.truncate(_size)
+
+    def _write(self, _index, _state, _radio_id, _ip, _port):
+        _offset = self._rec_base + _index * _RECORD.size
+        _seq = _RECORD.unpack_from(self._map, _offset)[0]
+        _RECORD.pack_into(self._map, _offset, (_seq + 1) & 0xFFFFFFFF, _state, _radio_id, _ip, _port)
+        _RECORD.pack_into(self._map, _offset, (_seq + 2) & 0xFFFFFFFF, _state, _radio_id, _ip, _port)
+        self._generation = (self._generation + 1) & 0xFFFFFFFF
+        _GEN.pack_into(self._map, self._gen_base + self._shard * _GEN.size, self._generation)
+
+    # Tell the other workers about a client that has completed login here
+    def publish(self, _client):
+        try:
+            _ip = socket.inet_pton(socket.AF_INET, _client.ip)
+        except (socket.error, ValueError):
+            return False
+        _index = self._slots.get(_client.radio_id)
+        if _index is None:
+            if not self._free:
+                return False
+            _index = self._free.pop()
+            self._slots[_client.radio_id] = _index
+        self._write(_index, _ACTIVE, _client.radio_id, _ip, _client.port)
+        return True
+
+    def withdraw(self, _radio_id):
+        _index = self._slots.pop(_radio_id, None)
+        if _index is not None:
+            self._write(_index, _FREE, '\x00\x00\x00\x00', '\x00\x00\x00\x00', 0)
+            self._free.append(_index)
+
+    # Clients logged in to every other worker
+    def peers(self):
+        _seen = tuple(_GEN.unpack_from(self._map, self._gen_base + _GEN.size * i)[0] for i in range(self._shards) if i != self._shard)
+        if _seen == self._seen:
+            return self._peers
+
+        _peers = []
+        _consistent = True
+        for _shard in range(self._shards):
+            if _shard == self._shard:
+                continue
+            _offset = self._rec_base + _shard * self._capacity * _RECORD.size
+            for i in range(self._capacity):
+                _seq, _state, _radio_id, _ip, _port = _RECORD.unpack_from(self._map, _offset)
+                if _seq & 1 or _RECORD.unpack_from(self._map, _offset)[0] != _seq:
+                    _consistent = False
+                elif _state == _ACTIVE:
+                    _peers.append(_PEER(_radio_id, socket.inet_ntop(socket.AF_INET, _ip), _port))
+                _offset += _RECORD.size
+
+        self._peers = _peers
+        # A record caught mid-write means we'll read the whole lot again next time
+        self._seen = _seen if _consistent else None
+        return _peers
+
+
+# The parent process: make the tables, start one worker per shard with the
+# same command line plus --shard, pass signals on and wait for them.
+def run_shards(_config, _logger):
+    _shards = _config['GLOBAL']['SHARDS']
+    for _system in _config['SYSTEMS']:
+        if _config['SYSTEMS'][_system]['MODE'] == 'MASTER':
+            SHARDTABLE.create(table_file(_config, _system), _shards)
+
+    _workers = []
+    for _shard in range(_shards):
+        _args = [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:] + ['--shard', str(_shard)]
+        _workers.append(subprocess.Popen(_args))
+        _logger.info('SHARDS: Worker %s of %s started, PID %s', _shard, _shards, _workers[-1].pid)
+
+    _stopping = []
+    def _forward(_signal, _frame):
+        _stopping.append(_signal)
+        _logger.info('SHARDS: Passing signal %s to all workers', _signal)
+        for _worker in _workers:
+            if _worker.poll() is None:
+                _worker.send_signal(_signal)
+    for sig in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(sig, _forward)
+
+    # If any one worker goes away, take the rest down too -- a partial set of
+    # shards would silently strand the repeaters hashed to the missing one.
+    while True:
+        try:
+            _pid, _status = os.wait()
+            break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+    if not _stopping:
+        _logger.error('SHARDS: Worker PID %s exited with status %s, stopping all workers', _pid, _status)
+        _forward(signal.SIGTERM, None)
+    for _worker in _workers:
+        _worker.wait()
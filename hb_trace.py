@@ -0,0 +1,76 @@
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Packet trace points. Each system has a TRACE object with one boolean per
+category, and every trace point in the packet path is written as:
+
+    if self._trace.rx:
+        self._trace.log('rx', '%s:%s -- %s', _host, _port, ahex(_data))
+
+When the category is off that is one attribute test -- nothing is formatted,
+converted or hex dumped. Categories can be set per system in the config file
+(TRACE) and changed while running through the reporting socket (TRACE_SET).
+
+Trace lines go to a child of the main logger ("<LOG_NAME>.trace") that always
+passes DEBUG, so a trace turned on for one system shows up even when the rest
+of the program is logging at INFO.
+'''
+
+import logging
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__    = ''
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+#   rx      every packet received by the system
+#   tx      every packet sent by the system
+#   repeat  DMRD frames a master repeats to its clients
+#   auth    the RPTL/RPTK/RPTC login exchange
+#   ping    RPTPING/MSTPONG keepalives
+CATEGORIES = ('rx', 'tx', 'repeat', 'auth', 'ping')
+
+
+class TRACE(object):
+    __slots__ = CATEGORIES + ('_system', '_logger')
+
+    def __init__(self, _system, _logger):
+        self._system = _system
+        self._logger = logging.getLogger(_logger.name + '.trace')
+        self._logger.setLevel(logging.DEBUG)
+        for _category in CATEGORIES:
+            setattr(self, _category, False)
+
+    # Turn on exactly the categories given, everything else off. Returns
+    # any names that aren't categories, which are ignored.
+    def set(self, _categories):
+        _categories = set(_category.strip().lower() for _category in _categories if _category.strip())
+        for _category in CATEGORIES:
+            setattr(self, _category, _category in _categories)
+        return sorted(_categories.difference(CATEGORIES))
+
+    def enabled(self):
+        return [_category for _category in CATEGORIES if getattr(self, _category)]
+
+    # Only ever called from behind an "if self._trace.<category>:"
+    def log(self, _category, _msg, *_args):
+        self._logger.debug('(%s) TRACE %s: ' + _msg, self._system, _category.upper(), *_args)
@@ -32,20 +32,34 @@ from __future__ import print_function
 # Specifig functions from modules we need
 from binascii import b2a_hex as ahex
 from binascii import a2b_hex as bhex
-from random import randint
 from hashlib import sha256
 from time import time
-from bitstring import BitArray
+from struct import Struct
+from copy import deepcopy
+from collections import deque
 import socket
 
 # Twisted is pretty important, so I keep it separate
 from twisted.internet.protocol import DatagramProtocol, Factory, Protocol
 from twisted.protocols.basic import NetstringReceiver
 from twisted.internet import reactor, task
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.error import CannotListenError
+from twisted.web.server import Site
+from zope.interface import implementer
 
 # Other files we pull from -- this is mostly for readability and segmentation
 import hb_log
 import hb_config
+import hb_const
+import hb_fanout
+import hb_ambe_ring
+import hb_capture
+import hb_resolve
+from hb_metrics import METRICS, METRICSPAGE
+from hb_frame import DMRD, DMRD_LENGTH
+from hb_clients import HBCLIENTS
+from hb_trace import TRACE
 from dmr_utils.utils import int_id, hex_str_4
 
 # Imports for the reporting server
@@ -71,7 +85,8 @@ def config_reports(_config, _logger, _factory):
     if True: #_config['REPORTS']['REPORT']:
         def reporting_loop(_logger, _server):
             _logger.debug('Periodic reporting loop started')
-            _server.send_config()
+            _server.send_updates()
+            _server.send_metrics()
             
         _logger.info('HBlink TCP reporting server configured')
         
@@ -81,9 +96,17 @@ def config_reports(_config, _logger, _factory):
         
         reporting = task.LoopingCall(reporting_loop, _logger, report_server)
         reporting.start(_config['REPORTS']['REPORT_INTERVAL'])
+
+    config_metrics(_config, _logger, report_server)
     
     return report_server
 
+# Optional HTTP page of packet metrics for Prometheus and the like
+def config_metrics(_config, _logger, _report = None):
+    if _config['REPORTS']['METRICS_PORT']:
+        reactor.listenTCP(_config['REPORTS']['METRICS_PORT'], Site(METRICSPAGE(systems, _report)), interface=_config['REPORTS']['METRICS_IP'])
+        _logger.info('HBlink metrics page configured: http://%s:%s/metrics', _config['REPORTS']['METRICS_IP'], _config['REPORTS']['METRICS_PORT'])
+
 
 # Shut ourselves down gracefully by disconnecting from the masters and clients.
 def hblink_handler(_signal, _frame, _logger):
@@ -92,41 +115,182 @@ def hblink_handler(_signal, _frame, _logger):
         systems[system].dereg()
 
 
+# The config file built again for a reload, or None (and logged) if it won't build
+def rebuild_config(_config_file, _logger, _log_level = None):
+    try:
+        _new_config = hb_config.build_config(_config_file)
+    except (SystemExit, Exception) as err:
+        _logger.error('RELOAD: %s is not usable, nothing changed: %s', _config_file, err)
+        return None
+    if _log_level:
+        _new_config['LOGGER']['LOG_LEVEL'] = _log_level
+    return _new_config
+
+# Config sections only read at startup
+RELOAD_RESTART = ('REPORTS', 'LOGGER')
+# [GLOBAL] settings only read at startup
+RELOAD_RESTART_GLOBAL = ('PATH', 'SHARDS')
+# Config sections the running systems take changes in from reconfigure()
+RELOAD_RECONFIGURE = ('GLOBAL', 'AMBE')
+# System settings that are the running system's, not the config file's
+RELOAD_RUNTIME = ('CLIENTS', 'STATS', 'PDU_STATS', 'MASTER_IP', 'TRACE')
+
+def system_changed(_old, _new):
+    return any(_old.get(_key) != _new[_key] for _key in _new if _key not in RELOAD_RUNTIME) or any(_key not in _new for _key in _old if _key not in RELOAD_RUNTIME)
+
+# Bring the running systems in line with a freshly built config (SIGHUP or the
+# RELOAD reporting opcode), changing CONFIG in place. Systems whose section is
+# the same keep running untouched, with their clients logged in and their
+# calls going; only TRACE is set again from the file, and changes to [GLOBAL]
+# and [AMBE] are put to use by reconfigure(). New systems start, changed ones
+# are started over (on the same socket if the address didn't change) and
+# removed ones stop. Both of those de-register first, so their repeaters or
+# master know to log in again. _swap, when given, is called once the new
+# systems run and before the old ones stop, for the application to put its
+# new rules in place. Everything new is built, and every new port listened
+# on, before anything running is touched: if any of it fails, CONFIG is put
+# back and False is returned, having changed nothing.
+def reload_systems(_config, _new_config, _logger, _report, _system_class, _swap = None):
+    _old, _new = _config['SYSTEMS'], _new_config['SYSTEMS']
+    _added = [_system for _system in _new if _system not in _old]
+    _changed = [_system for _system in _new if _system in systems and system_changed(_old[_system], _new[_system])]
+    _removed = [_system for _system in _old if _system not in _new and _system in systems]
+    _moved = [_system for _system in _changed if (_old[_system]['IP'], _old[_system]['PORT']) != (_new[_system]['IP'], _new[_system]['PORT'])]
+
+    _sections = []
+    _reconfigure = []
+    for _section in _new_config:
+        if _section in RELOAD_RESTART:
+            if _config[_section] != _new_config[_section]:
+                _logger.warning('RELOAD: [%s] changed, it is only read at startup', _section)
+        elif _section != 'SYSTEMS':
+            if _section == 'GLOBAL':
+                for _key in RELOAD_RESTART_GLOBAL:
+                    if _new_config[_section][_key] != _config[_section][_key]:
+                        _logger.warning('RELOAD: [GLOBAL] %s changed, it is only read at startup', _key)
+                        _new_config[_section][_key] = _config[_section][_key]
+            if _section in RELOAD_RECONFIGURE and _config[_section] != _new_config[_section]:
+                _reconfigure.append(_section)
+            _sections.append(_section)
+
+    # Build everything new first, with the new sections in place for it to
+    # read. Any failure puts CONFIG back and stops the reload here.
+    _saved = dict((_section, dict(_config[_section])) for _section in _sections + ['SYSTEMS'])
+    _started = {}
+    _prepared = {}
+    _system = None
+    try:
+        for _section in _sections:
+            _config[_section].update(_new_config[_section])
+        for _system in _added + _changed:
+            _config['SYSTEMS'][_system] = _new[_system]
+            _started[_system] = _system_class(_system, _config, _logger, _report)
+            if _system in _added or _system in _moved:
+                reactor.listenUDP(_new[_system]['PORT'], _started[_system], interface=_new[_system]['IP'])
+        if _reconfigure:
+            for _system in systems:
+                if _system not in _changed and _system not in _removed:
+                    _prepared[_system] = systems[_system].reconfigure(_reconfigure)
+    except Exception as err:
+        _logger.error('RELOAD: (%s) cannot be started, nothing changed: %s', _system, err)
+        for _system in _started:
+            if _started[_system].transport:
+                _started[_system].transport.stopListening()
+            if _started[_system]._config['EXPORT_AMBE']:
+                _started[_system]._ambe.close()
+        for _system in _prepared:
+            if _prepared[_system]['AMBE']:
+                _prepared[_system]['AMBE'].close()
+        for _section in _saved:
+            _config[_section].clear()
+            _config[_section].update(_saved[_section])
+        return False
+
+    # Only now is anything running changed
+    for _system in _changed:
+        _running = systems[_system]
+        _running.dereg()
+        if _system in _moved:
+            _running.transport.stopListening()
+        else:
+            _port = _running.transport
+            _running.doStop()
+            _port.protocol = _started[_system]
+            _started[_system].makeConnection(_port)
+        systems[_system] = _started[_system]
+        _logger.info('RELOAD: (%s) changed, restarted', _system)
+    for _system in _added:
+        systems[_system] = _started[_system]
+        _logger.info('RELOAD: (%s) added', _system)
+
+    for _system in _new:
+        if _system in systems and _system not in _changed and _system not in _added:
+            systems[_system]._trace.set(_new[_system]['TRACE'])
+            _old[_system]['TRACE'] = systems[_system]._trace.enabled()
+
+    for _system in _prepared:
+        systems[_system].apply_reconfigure(_reconfigure, _prepared[_system])
+    if _reconfigure:
+        _logger.info('RELOAD: [%s] changed, put to use', '], ['.join(_reconfigure))
+
+    if _swap:
+        _swap()
+
+    for _system in _removed:
+        _running = systems.pop(_system)
+        _running.dereg()
+        _running.transport.stopListening()
+        del _config['SYSTEMS'][_system]
+        _logger.info('RELOAD: (%s) removed', _system)
+    return True
+
+
 #************************************************
 #     AMBE CLASS: Used to parse out AMBE and send to gateway
 #************************************************
 
+# Header of a bundled AMBE export datagram, see [AMBE] in hblink-SAMPLE.cfg
+AMBE_BUNDLE = Struct('>4sBc3s3s4sB')
+
 class AMBE:
     def __init__(self, _config, _logger):
         self._CONFIG = _config
+        self._logger = _logger
          
         self._sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        self._exp_ip = self._CONFIG['AMBE']['EXPORT_IP']
+        self._exp_ip = None         # Nothing is sent until EXPORT_IP is resolved
+        hb_resolve.resolve(self._CONFIG['AMBE']['EXPORT_IP'], self._CONFIG['GLOBAL']['DNS_TTL']).addCallbacks(self._export_resolved, self._export_failed)
         self._exp_port = self._CONFIG['AMBE']['EXPORT_PORT']
-
-    def parseAMBE(self, _client, _data):
-        _seq = int_id(_data[4:5])
-        _srcID = int_id(_data[5:8])
-        _dstID = int_id(_data[8:11])
-        _rptID = int_id(_data[11:15])
-        _bits = int_id(_data[15:16])       # SCDV NNNN (Slot|Call type|Data|Voice|Seq or Data type)
-        _slot = 2 if _bits & 0x80 else 1
-        _callType = 1 if (_bits & 0x40) else 0
-        _frameType = (_bits & 0x30) >> 4
-        _voiceSeq = (_bits & 0x0f)
-        _streamID = int_id(_data[16:20])
-        logger.debug('(%s) seq: %d srcID: %d dstID: %d rptID: %d bits: %0X slot:%d callType: %d frameType:  %d voiceSeq: %d streamID: %0X',
-        _client, _seq, _srcID, _dstID, _rptID, _bits, _slot, _callType, _frameType, _voiceSeq, _streamID )
-
-        #logger.debug('Frame 1:(%s)', self.ByteToHex(_data))
-        _dmr_frame = BitArray('0x'+ahex(_data[20:]))
-        _ambe = _dmr_frame[0:108] + _dmr_frame[156:264]
-        #_sock.sendto(_ambe.tobytes(), ("127.0.0.1", 31000))
-
-        ambeBytes = _ambe.tobytes()
-        self._sock.sendto(ambeBytes[0:9], (self._exp_ip, self._exp_port))
-        self._sock.sendto(ambeBytes[9:18], (self._exp_ip, self._exp_port))
-        self._sock.sendto(ambeBytes[18:27], (self._exp_ip, self._exp_port))
+        self._bundle = self._CONFIG['AMBE']['EXPORT_BUNDLE']
+        self._ring = None
+        if self._CONFIG['AMBE']['EXPORT_BACKEND'] == 'RING':
+            self._ring = hb_ambe_ring.get_writer(self._CONFIG['AMBE']['RING_FILE'], self._CONFIG['AMBE']['RING_RECORDS'])
+
+    def close(self):
+        self._sock.close()
+
+    def _export_resolved(self, _address):
+        self._exp_ip = _address
+
+    def _export_failed(self, _failure):
+        self._logger.error('Could not resolve AMBE EXPORT_IP %s: %s', self._CONFIG['AMBE']['EXPORT_IP'], _failure.getErrorMessage())
+
+    # _frame is an hb_frame.DMRD object. Only voice bursts carry AMBE.
+    def parseAMBE(self, _client, _frame):
+        if _frame.frame_type not in (hb_const.HBPF_VOICE, hb_const.HBPF_VOICE_SYNC):
+            return
+        if not self._ring and not self._exp_ip:
+            return
+
+        _ambe = _frame.ambe
+        if self._ring:
+            self._ring.write(_client, _frame, _ambe)
+        elif self._bundle:
+            self._sock.sendto(AMBE_BUNDLE.pack('AMBE', _frame.slot, _frame.seq, _frame.rf_src, _frame.dst_id, _frame.stream_id, len(_client)) + _client + _ambe, (self._exp_ip, self._exp_port))
+        else:
+            self._sock.sendto(_ambe[0:9], (self._exp_ip, self._exp_port))
+            self._sock.sendto(_ambe[9:18], (self._exp_ip, self._exp_port))
+            self._sock.sendto(_ambe[18:27], (self._exp_ip, self._exp_port))
 
 
 #************************************************
@@ -141,14 +305,19 @@ class HBSYSTEM(DatagramProtocol):
         self._logger = _logger
         self._report = _report
         self._config = self._CONFIG['SYSTEMS'][self._system]
+        self._trace = TRACE(self._system, self._logger)
+        _unknown = self._trace.set(self._config['TRACE'])
+        if _unknown:
+            self._logger.warning('(%s) Ignoring unknown trace categories: %s', self._system, ', '.join(_unknown))
         
         # Define shortcuts and generic function names based on the type of system we are
         if self._config['MODE'] == 'MASTER':
-            self._clients = self._CONFIG['SYSTEMS'][self._system]['CLIENTS']
+            self._clients = self._config['CLIENTS'] = HBCLIENTS(self._CONFIG['GLOBAL']['PING_TIME']*self._CONFIG['GLOBAL']['MAX_MISSED'])
             self.send_system = self.send_clients
             self.maintenance_loop = self.master_maintenance_loop
             self.datagramReceived = self.master_datagramReceived
             self.dereg = self.master_dereg
+            self._commands = self.master_commands()
         
         elif self._config['MODE'] == 'CLIENT':
             self._stats = self._config['STATS']
@@ -156,365 +325,608 @@ class HBSYSTEM(DatagramProtocol):
             self.maintenance_loop = self.client_maintenance_loop
             self.datagramReceived = self.client_datagramReceived
             self.dereg = self.client_dereg
+            self._commands = self.client_commands()
+
+        # Per command packet counters, reported with the rest of the system config
+        self._pdu_stats = self._config['PDU_STATS'] = {}
+        for _command in self._commands.keys() + ['UNKNOWN']:
+            self._pdu_stats[_command] = {'RECEIVED': 0, 'ACCEPTED': 0, 'REJECTED': 0}
+        self._unknown_pdu_next = 0
+        self._unknown_pdu_logged = 0
+        self._metrics = METRICS(self._pdu_stats)
         
+        # Set up in startProtocol, once we have a transport
+        self._fanout = None
+
         # Configure for AMBE audio export if enabled
         if self._config['EXPORT_AMBE']:
-            self._ambe = AMBE()
+            self._ambe = AMBE(self._CONFIG, self._logger)
+
+        # Capture every received datagram for hb_replay.py if enabled
+        self._capture = None
+        if self._config['CAPTURE']:
+            self._capture = self.open_capture()
+
+    def stopProtocol(self):
+        if self._system_maintenance.running:
+            self._system_maintenance.stop()
+
+    # The writer for CAPTURE_FILE, or None if it can't be used -- the system
+    # runs without capturing rather than not at all
+    def open_capture(self):
+        try:
+            _capture = hb_capture.get_writer(self._CONFIG['GLOBAL']['CAPTURE_FILE'])
+        except (IOError, OSError, ValueError) as err:
+            self._logger.error('(%s) Not capturing received packets, CAPTURE_FILE %s is not usable: %s', self._system, self._CONFIG['GLOBAL']['CAPTURE_FILE'], err)
+            return None
+        self._logger.info('(%s) Capturing received packets to %s', self._system, self._CONFIG['GLOBAL']['CAPTURE_FILE'])
+        return _capture
+
+    # Changed [GLOBAL] and [AMBE] settings (the _sections given) after a
+    # reload, in two steps so the reload can still back out: reconfigure()
+    # makes whatever could fail, and apply_reconfigure() puts it and the
+    # other settings to use without dropping clients or calls
+    def reconfigure(self, _sections):
+        _new = {'AMBE': None, 'CAPTURE': self._capture}
+        if 'AMBE' in _sections and self._config['EXPORT_AMBE']:
+            _new['AMBE'] = AMBE(self._CONFIG, self._logger)
+        if 'GLOBAL' in _sections and self._config['CAPTURE']:
+            _new['CAPTURE'] = self.open_capture()
+        return _new
+
+    def apply_reconfigure(self, _sections, _new):
+        if 'GLOBAL' in _sections:
+            if self._config['MODE'] == 'MASTER':
+                self._clients.set_timeout(self._CONFIG['GLOBAL']['PING_TIME']*self._CONFIG['GLOBAL']['MAX_MISSED'])
+            elif self._system_maintenance.running and self._system_maintenance.interval != self._CONFIG['GLOBAL']['PING_TIME']:
+                self._system_maintenance.stop()
+                self._system_maintenance_loop = self._system_maintenance.start(self._CONFIG['GLOBAL']['PING_TIME'])
+        self._capture = _new['CAPTURE']
+        # The old exporter is only closed once the new one is in place
+        if _new['AMBE']:
+            _ambe, self._ambe = self._ambe, _new['AMBE']
+            _ambe.close()
 
     def startProtocol(self):
-        # Set up periodic loop for tracking pings from clients. Run every 'PING_TIME' seconds
+        # Masters repeating to their clients do it in batches where the platform allows
+        if self._config['MODE'] == 'MASTER' and hb_fanout.AVAILABLE:
+            self._fanout = hb_fanout.FANOUT(self.transport)
+            self._logger.info('(%s) Repeating to clients with batched sendmmsg()', self._system)
+
+        # Set up periodic loop for tracking pings from clients. Run every 'PING_TIME' seconds, or
+        # for a master every EXPIRY_TICK so timed out clients are found a few at a time
         self._system_maintenance = task.LoopingCall(self.maintenance_loop)
-        self._system_maintenance_loop = self._system_maintenance.start(self._CONFIG['GLOBAL']['PING_TIME'])
+        if self._config['MODE'] == 'MASTER':
+            self._system_maintenance_loop = self._system_maintenance.start(hb_const.EXPIRY_TICK)
+        else:
+            self._system_maintenance_loop = self._system_maintenance.start(self._CONFIG['GLOBAL']['PING_TIME'])
     
     # Aliased in __init__ to maintenance_loop if system is a master
     def master_maintenance_loop(self):
-        self._logger.debug('(%s) Master maintenance loop started', self._system)
-        for client in self._clients:
-            _this_client = self._clients[client]
-            # Check to see if any of the clients have been quiet (no ping) longer than allowed
-            if _this_client['LAST_PING']+self._CONFIG['GLOBAL']['PING_TIME']*self._CONFIG['GLOBAL']['MAX_MISSED'] < time():
-                self._logger.info('(%s) Client %s (%s) has timed out', self._system, _this_client['CALLSIGN'], _this_client['RADIO_ID'])
-                # Remove any timed out clients from the configuration
-                del self._CONFIG['SYSTEMS'][self._system]['CLIENTS'][client]
+        # The registry removes any clients that have been quiet (no ping) longer than allowed
+        for _this_client in self._clients.expire(time()):
+            self._logger.info('(%s) Client %s (%s) has timed out', self._system, _this_client.callsign, int_id(_this_client.radio_id))
     
     # Aliased in __init__ to maintenance_loop if system is a client           
     def client_maintenance_loop(self):
         self._logger.debug('(%s) Client maintenance loop started', self._system)
         if self._stats['PING_OUTSTANDING']:
             self._stats['NUM_OUTSTANDING'] += 1
-        # If we're not connected, zero out the stats and send a login request RPTL
+        # If we're not connected, zero out the stats, look up the master and send a login request RPTL
         if self._stats['CONNECTION'] != 'YES' or self._stats['NUM_OUTSTANDING'] >= self._CONFIG['GLOBAL']['MAX_MISSED']:
             self._stats['PINGS_SENT'] = 0
             self._stats['PINGS_ACKD'] = 0
             self._stats['NUM_OUTSTANDING'] = 0
             self._stats['PING_OUTSTANDING'] = False
-            self._stats['CONNECTION'] = 'RPTL_SENT'
-            self.send_master('RPTL'+self._config['RADIO_ID'])
-            self._logger.info('(%s) Sending login request to master %s:%s', self._system, self._config['MASTER_IP'], self._config['MASTER_PORT'])
+            self._stats['CONNECTION'] = 'NO'
+            hb_resolve.resolve(self._config['MASTER_HOST'], self._CONFIG['GLOBAL']['DNS_TTL']).addCallbacks(self.client_login, self.client_resolve_failed)
         # If we are connected, sent a ping to the master and increment the counter
         if self._stats['CONNECTION'] == 'YES':
             self.send_master('RPTPING'+self._config['RADIO_ID'])
-            self._logger.debug('(%s) RPTPING Sent to Master. Total Sent: %s, Total Missed: %s, Currently Outstanding: %s', self._system, self._stats['PINGS_SENT'], self._stats['PINGS_SENT'] - self._stats['PINGS_ACKD'], self._stats['NUM_OUTSTANDING'])
+            if self._trace.ping:
+                self._trace.log('ping', 'RPTPING Sent to Master. Total Sent: %s, Total Missed: %s, Currently Outstanding: %s', self._stats['PINGS_SENT'], self._stats['PINGS_SENT'] - self._stats['PINGS_ACKD'], self._stats['NUM_OUTSTANDING'])
             self._stats['PINGS_SENT'] += 1
             self._stats['PING_OUTSTANDING'] = True
 
+    def client_login(self, _address):
+        if self._stats['CONNECTION'] != 'NO':
+            return                  # An earlier lookup got there first
+        if _address != self._config['MASTER_IP']:
+            self._logger.info('(%s) Master %s is at %s', self._system, self._config['MASTER_HOST'], _address)
+            self._config['MASTER_IP'] = _address
+        self._stats['CONNECTION'] = 'RPTL_SENT'
+        self.send_master('RPTL'+self._config['RADIO_ID'])
+        self._logger.info('(%s) Sending login request to master %s:%s', self._system, self._config['MASTER_IP'], self._config['MASTER_PORT'])
+
+    def client_resolve_failed(self, _failure):
+        self._logger.error('(%s) Could not resolve master %s, will try again: %s', self._system, self._config['MASTER_HOST'], _failure.getErrorMessage())
+
     def send_clients(self, _packet):
-        for _client in self._clients:
-            self.send_client(_client, _packet)
-            #self._logger.debug('(%s) Packet sent to client %s', self._system, self._clients[_client]['RADIO_ID'])
+        for _client in self._clients.values() + self._clients.peers():
+            self.transport.write(_packet, (_client.ip, _client.port))
+            if self._trace.tx:
+                self._trace.log('tx', 'Packet sent to client %s', int_id(_client.radio_id))
 
     def send_client(self, _client, _packet):
-        _ip = self._clients[_client]['IP']
-        _port = self._clients[_client]['PORT']
-        self.transport.write(_packet, (_ip, _port))
-        # KEEP THE FOLLOWING COMMENTED OUT UNLESS YOU'RE DEBUGGING DEEPLY!!!!
-        #self._logger.debug('(%s) TX Packet to %s on port %s: %s', self._clients[_client]['RADIO_ID'], self._clients[_client]['IP'], self._clients[_client]['PORT'], ahex(_packet))
+        _this_client = self._clients[_client]
+        self.transport.write(_packet, (_this_client.ip, _this_client.port))
+        if self._trace.tx:
+            self._trace.log('tx', 'TX Packet to %s on %s:%s -- %s', int_id(_client), _this_client.ip, _this_client.port, ahex(_packet))
+
+    # Repeat a DMRD frame to every client except the one it came from, with
+    # each client's own radio ID written into the copy it gets
+    def repeat_clients(self, _data, _radio_id):
+        _targets = [_client for _client in self._clients.values() if _client.radio_id != _radio_id] + self._clients.peers()
+        if self._fanout:
+            self._fanout.send(_data, _targets)
+        else:
+            for _client in _targets:
+                self.transport.write(_data[:11] + _client.radio_id + _data[15:], (_client.ip, _client.port))
+        if self._trace.repeat:
+            self._trace.log('repeat', 'Packet from %s repeated to %s clients', int_id(_radio_id), len(_targets))
+        return len(_targets)
 
     def send_master(self, _packet):
         if _packet[:4] == 'DMRD':
             _packet = _packet[:11] + self._config['RADIO_ID'] + _packet[15:]
         self.transport.write(_packet, (self._config['MASTER_IP'], self._config['MASTER_PORT']))
-        # KEEP THE FOLLOWING COMMENTED OUT UNLESS YOU'RE DEBUGGING DEEPLY!!!!
-        # self._logger.debug('(%s) TX Packet to %s:%s -- %s', self._system, self._config['MASTER_IP'], self._config['MASTER_PORT'], ahex(_packet))
+        if self._trace.tx:
+            self._trace.log('tx', 'TX Packet to %s:%s -- %s', self._config['MASTER_IP'], self._config['MASTER_PORT'], ahex(_packet))
 
-    def dmrd_received(self, _radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data):
+    # _frame is an hb_frame.DMRD object, the HBP header is already unpacked
+    def dmrd_received(self, _frame):
         pass
     
     def master_dereg(self):
-        for _client in self._clients:
-            self.send_client(_client, 'MSTCL'+_client)
-            self._logger.info('(%s) De-Registration sent to Client: %s (%s)', self._system, self._clients[_client]['CALLSIGN'], self._clients[_client]['RADIO_ID'])
+        for _client in self._clients.values():
+            self.transport.write('MSTCL'+_client.radio_id, (_client.ip, _client.port))
+            self._logger.info('(%s) De-Registration sent to Client: %s (%s)', self._system, _client.callsign, int_id(_client.radio_id))
             
     def client_dereg(self):
+        if self._stats['CONNECTION'] == 'NO':
+            return                  # Never got as far as the master
         self.send_master('RPTCL'+self._config['RADIO_ID'])
         self._logger.info('(%s) De-Registeration sent to Master: %s:%s', self._system, self._config['MASTER_IP'], self._config['MASTER_PORT'])
     
-    # Aliased in __init__ to datagramReceived if system is a master
-    def master_datagramReceived(self, _data, (_host, _port)):
-        # Keep This Line Commented Unless HEAVILY Debugging!
-        # self._logger.debug('(%s) RX packet from %s:%s -- %s', self._system, _host, _port, ahex(_data))
-
-        # Extract the command, which is various length, all but one 4 significant characters -- RPTCL
+    # Commands we answer as a master or a client, keyed by the first 4 bytes of
+    # the packet. Each handler returns True if the packet was accepted.
+    def master_commands(self):
+        return {
+            'DMRD': self.master_dmrd,       # DMRData -- encapsulated DMR data frame
+            'RPTL': self.master_rptl,       # RPTLogin -- a repeater wants to login
+            'RPTK': self.master_rptk,       # Repeater has answered our login challenge
+            'RPTC': self.master_rptc,       # Repeater is sending it's configuraiton OR disconnecting (RPTCL)
+            'RPTP': self.master_rptp,       # RPTPing -- client is pinging us
+        }
+
+    def client_commands(self):
+        return {
+            'DMRD': self.client_dmrd,       # DMRData -- encapsulated DMR data frame
+            'MSTN': self.client_mstnak,     # Actually MSTNAK -- a NACK from the master
+            'RPTA': self.client_rptack,     # Actually RPTACK -- an ACK from the master
+            'MSTP': self.client_mstpong,    # Actually MSTPONG -- a reply to RPTPING (send by client)
+            'MSTC': self.client_mstcl,      # Actually MSTCL -- notify us the master is closing down
+        }
+
+    # Look up the handler for a packet and keep count of how it went
+    def dispatch(self, _data, _host, _port):
         _command = _data[:4]
+        _handler = self._commands.get(_command)
+        if _handler is None:
+            self.unknown_pdu(_data, _host, _port)
+            return
+        _stats = self._pdu_stats[_command]
+        _stats['RECEIVED'] += 1
+        if _handler(_data, _host, _port):
+            _stats['ACCEPTED'] += 1
+        else:
+            _stats['REJECTED'] += 1
+
+    # Anybody can send us garbage, so it is counted every time but only logged
+    # once every UNKNOWN_PDU_INTERVAL seconds, and never more than the start of it
+    def unknown_pdu(self, _data, _host, _port):
+        _stats = self._pdu_stats['UNKNOWN']
+        _stats['RECEIVED'] += 1
+        _stats['REJECTED'] += 1
+        self._metrics.drop_unknown += 1
+        _now = time()
+        if _now >= self._unknown_pdu_next:
+            self._logger.error('(%s) Unrecognized command from %s:%s (%s since last logged). Raw HBP PDU: %s', self._system, _host, _port, _stats['RECEIVED'] - self._unknown_pdu_logged, ahex(_data[:hb_const.UNKNOWN_PDU_DUMP]))
+            self._unknown_pdu_next = _now + hb_const.UNKNOWN_PDU_INTERVAL
+            self._unknown_pdu_logged = _stats['RECEIVED']
 
-        if _command == 'DMRD':    # DMRData -- encapsulated DMR data frame
-            _radio_id = _data[11:15]
-            if _radio_id in self._clients \
-                        and self._clients[_radio_id]['CONNECTION'] == 'YES' \
-                        and self._clients[_radio_id]['IP'] == _host \
-                        and self._clients[_radio_id]['PORT'] == _port:
-                _seq = _data[4]
-                _rf_src = _data[5:8]
-                _dst_id = _data[8:11]
-                _bits = int_id(_data[15])
-                _slot = 2 if (_bits & 0x80) else 1
-                _call_type = 'unit' if (_bits & 0x40) else 'group'
-                _frame_type = (_bits & 0x30) >> 4
-                _dtype_vseq = (_bits & 0xF) # data, 1=voice header, 2=voice terminator; voice, 0=burst A ... 5=burst F
-                _stream_id = _data[16:20]
-                #self._logger.debug('(%s) DMRD - Seqence: %s, RF Source: %s, Destination ID: %s', self._system, int_id(_seq), int_id(_rf_src), int_id(_dst_id))
-
-                # If AMBE audio exporting is configured...
-                if self._config['EXPORT_AMBE']:
-                    self._ambe.parseAMBE(self._system, _data)
-
-                # The basic purpose of a master is to repeat to the clients
-                if self._config['REPEAT'] == True:
-                    for _client in self._clients:
-                        if _client != _radio_id:
-                            #self.send_client(_client, _data)
-                            self.send_client(_client, _data[:11] + _client + _data[15:])
-                            #self.send_client(_client, _data[:11] + self._config['RADIO_ID'] + _data[15:])
-                            #self._logger.debug('(%s) Packet on TS%s from %s (%s) for destination ID %s repeated to client: %s (%s) [Stream ID: %s]', self._system, _slot, self._clients[_radio_id]['CALLSIGN'], int_id(_radio_id), int_id(_dst_id), self._clients[_client]['CALLSIGN'], int_id(_client), int_id(_stream_id))
-
-                # Userland actions -- typically this is the function you subclass for an application
-                self.dmrd_received(_radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data)
-
-        elif _command == 'RPTL':    # RPTLogin -- a repeater wants to login
-            _radio_id = _data[4:8]
-            if _radio_id:           # Future check here for valid Radio ID
-                self._clients.update({_radio_id: {      # Build the configuration data strcuture for the client
-                    'CONNECTION': 'RPTL-RECEIVED',
-                    'PINGS_RECEIVED': 0,
-                    'LAST_PING': time(),
-                    'IP': _host,
-                    'PORT': _port,
-                    'SALT': randint(0,0xFFFFFFFF),
-                    'RADIO_ID': str(int(ahex(_radio_id), 16)),
-                    'CALLSIGN': '',
-                    'RX_FREQ': '',
-                    'TX_FREQ': '',
-                    'TX_POWER': '',
-                    'COLORCODE': '',
-                    'LATITUDE': '',
-                    'LONGITUDE': '',
-                    'HEIGHT': '',
-                    'LOCATION': '',
-                    'DESCRIPTION': '',
-                    'SLOTS': '',
-                    'URL': '',
-                    'SOFTWARE_ID': '',
-                    'PACKAGE_ID': '',
-                }})
-                self._logger.info('(%s) Repeater Logging in with Radio ID: %s, %s:%s', self._system, int_id(_radio_id), _host, _port)
-                _salt_str = hex_str_4(self._clients[_radio_id]['SALT'])
-                self.send_client(_radio_id, 'RPTACK'+_salt_str)
-                self._clients[_radio_id]['CONNECTION'] = 'CHALLENGE_SENT'
-                self._logger.info('(%s) Sent Challenge Response to %s for login: %s', self._system, int_id(_radio_id), self._clients[_radio_id]['SALT'])
+    # Aliased in __init__ to datagramReceived if system is a master
+    def master_datagramReceived(self, _data, (_host, _port)):
+        if self._capture:
+            self._capture.write(self._system, _host, _port, _data)
+        if self._trace.rx:
+            self._trace.log('rx', 'RX packet from %s:%s -- %s', _host, _port, ahex(_data))
+        self.dispatch(_data, _host, _port)
+
+    # A DMRD packet too short to make a frame of, counted and dropped
+    def short_dmrd(self, _data, _host, _port):
+        self._metrics.drop_short += 1
+        if self._trace.rx:
+            self._trace.log('rx', 'DMRD from %s:%s dropped, only %s bytes', _host, _port, len(_data))
+        return False
+
+    def master_dmrd(self, _data, _host, _port):
+        if len(_data) < DMRD_LENGTH:
+            return self.short_dmrd(_data, _host, _port)
+        _radio_id = _data[11:15]
+        if not self._clients.validate(_radio_id, _host, _port, hb_const.HBPC_YES):
+            self._metrics.drop_unauth += 1
+            return False
+        _frame = DMRD(_data)
+        _metrics = self._metrics.slot[_frame.slot]
+        _metrics.rx_frames += 1
+        _metrics.rx_bytes += len(_data)
+
+        # If AMBE audio exporting is configured...
+        if self._config['EXPORT_AMBE']:
+            self._ambe.parseAMBE(self._system, _frame)
+
+        # The basic purpose of a master is to repeat to the clients
+        if self._config['REPEAT'] == True:
+            _count = self.repeat_clients(_data, _radio_id)
+            _metrics.rpt_frames += _count
+            _metrics.rpt_bytes += _count * len(_data)
+            if _count:
+                self._metrics.forwarded(self._system, _frame.rx_time, time())
+
+        # Userland actions -- typically this is the function you subclass for an application
+        self.dmrd_received(_frame)
+        return True
+
+    def master_rptl(self, _data, _host, _port):
+        _radio_id = _data[4:8]
+        if _radio_id:           # Future check here for valid Radio ID
+            _this_client = self._clients.add(_radio_id, _host, _port)   # Build the registry entry for the client
+            self._logger.info('(%s) Repeater Logging in with Radio ID: %s, %s:%s', self._system, int_id(_radio_id), _host, _port)
+            _salt_str = hex_str_4(_this_client.salt)
+            self.transport.write('RPTACK'+_salt_str, (_host, _port))
+            _this_client.connection = hb_const.HBPC_CHALLENGE_SENT
+            self._clients.changed(_this_client)
+            self._logger.info('(%s) Sent Challenge Response to %s for login: %s', self._system, int_id(_radio_id), _this_client.salt)
+            if self._trace.auth:
+                self._trace.log('auth', 'RPTL from %s at %s:%s, salt %s', int_id(_radio_id), _host, _port, _salt_str)
+            return True
+        else:
+            self.transport.write('MSTNAK'+_radio_id, (_host, _port))
+            self._logger.warning('(%s) Invalid Login from Radio ID: %s', self._system, int_id(_radio_id))
+            return False
+
+    def master_rptk(self, _data, _host, _port):
+        _radio_id = _data[4:8]
+        _this_client = self._clients.validate(_radio_id, _host, _port, hb_const.HBPC_CHALLENGE_SENT)
+        if _this_client:
+            self._clients.touch(_this_client)
+            _sent_hash = _data[8:]
+            _salt_str = hex_str_4(_this_client.salt)
+            _calc_hash = bhex(sha256(_salt_str+self._config['PASSPHRASE']).hexdigest())
+            if self._trace.auth:
+                self._trace.log('auth', 'RPTK from %s, sent hash %s, expected %s', int_id(_radio_id), ahex(_sent_hash), ahex(_calc_hash))
+            if _sent_hash == _calc_hash:
+                _this_client.connection = hb_const.HBPC_WAITING_CONFIG
+                self._clients.changed(_this_client)
+                self.transport.write('RPTACK'+_radio_id, (_host, _port))
+                self._logger.info('(%s) Client %s has completed the login exchange successfully', self._system, int_id(_radio_id))
+                return True
             else:
+                self._logger.info('(%s) Client %s has FAILED the login exchange successfully', self._system, int_id(_radio_id))
                 self.transport.write('MSTNAK'+_radio_id, (_host, _port))
-                self._logger.warning('(%s) Invalid Login from Radio ID: %s', self._system, int_id(_radio_id))
-
-        elif _command == 'RPTK':    # Repeater has answered our login challenge
-            _radio_id = _data[4:8]
-            if _radio_id in self._clients \
-                        and self._clients[_radio_id]['CONNECTION'] == 'CHALLENGE_SENT' \
-                        and self._clients[_radio_id]['IP'] == _host \
-                        and self._clients[_radio_id]['PORT'] == _port:
-                _this_client = self._clients[_radio_id]
-                _this_client['LAST_PING'] = time()
-                _sent_hash = _data[8:]
-                _salt_str = hex_str_4(_this_client['SALT'])
-                _calc_hash = bhex(sha256(_salt_str+self._config['PASSPHRASE']).hexdigest())
-                if _sent_hash == _calc_hash:
-                    _this_client['CONNECTION'] = 'WAITING_CONFIG'
-                    self.send_client(_radio_id, 'RPTACK'+_radio_id)
-                    self._logger.info('(%s) Client %s has completed the login exchange successfully', self._system, _this_client['RADIO_ID'])
-                else:
-                    self._logger.info('(%s) Client %s has FAILED the login exchange successfully', self._system, _this_client['RADIO_ID'])
-                    self.transport.write('MSTNAK'+_radio_id, (_host, _port))
-                    del self._clients[_radio_id]
-            else:
+                self._clients.remove(_radio_id)
+        else:
+            self.transport.write('MSTNAK'+_radio_id, (_host, _port))
+            self._logger.warning('(%s) Login challenge from Radio ID that has not logged in: %s', self._system, int_id(_radio_id))
+        return False
+
+    def master_rptc(self, _data, _host, _port):
+        if _data[:5] == 'RPTCL':    # Disconnect command
+            _radio_id = _data[5:9]
+            _this_client = self._clients.validate(_radio_id, _host, _port, hb_const.HBPC_YES)
+            if _this_client:
+                self._logger.info('(%s) Client is closing down: %s (%s)', self._system, _this_client.callsign, int_id(_radio_id))
                 self.transport.write('MSTNAK'+_radio_id, (_host, _port))
-                self._logger.warning('(%s) Login challenge from Radio ID that has not logged in: %s', self._system, int_id(_radio_id))
-
-        elif _command == 'RPTC':    # Repeater is sending it's configuraiton OR disconnecting
-            if _data[:5] == 'RPTCL':    # Disconnect command
-                _radio_id = _data[5:9]
-                if _radio_id in self._clients \
-                            and self._clients[_radio_id]['CONNECTION'] == 'YES' \
-                            and self._clients[_radio_id]['IP'] == _host \
-                            and self._clients[_radio_id]['PORT'] == _port:
-                    self._logger.info('(%s) Client is closing down: %s (%s)', self._system, self._clients[_radio_id]['CALLSIGN'], int_id(_radio_id))
-                    self.transport.write('MSTNAK'+_radio_id, (_host, _port))
-                    del self._clients[_radio_id]
-
-            else:
-                _radio_id = _data[4:8]      # Configure Command
-                if _radio_id in self._clients \
-                            and self._clients[_radio_id]['CONNECTION'] == 'WAITING_CONFIG' \
-                            and self._clients[_radio_id]['IP'] == _host \
-                            and self._clients[_radio_id]['PORT'] == _port:
-                    _this_client = self._clients[_radio_id]
-                    _this_client['CONNECTION'] = 'YES'
-                    _this_client['LAST_PING'] = time()
-                    _this_client['CALLSIGN'] = _data[8:16]
-                    _this_client['RX_FREQ'] = _data[16:25]
-                    _this_client['TX_FREQ'] =  _data[25:34]
-                    _this_client['TX_POWER'] = _data[34:36]
-                    _this_client['COLORCODE'] = _data[36:38]
-                    _this_client['LATITUDE'] = _data[38:46]
-                    _this_client['LONGITUDE'] = _data[46:55]
-                    _this_client['HEIGHT'] = _data[55:58]
-                    _this_client['LOCATION'] = _data[58:78]
-                    _this_client['DESCRIPTION'] = _data[78:97]
-                    _this_client['SLOTS'] = _data[97:98]
-                    _this_client['URL'] = _data[98:222]
-                    _this_client['SOFTWARE_ID'] = _data[222:262]
-                    _this_client['PACKAGE_ID'] = _data[262:302]
-
-                    self.send_client(_radio_id, 'RPTACK'+_radio_id)
-                    self._logger.info('(%s) Client %s (%s) has sent repeater configuration', self._system, _this_client['CALLSIGN'], _this_client['RADIO_ID'])
-                else:
-                    self.transport.write('MSTNAK'+_radio_id, (_host, _port))
-                    self._logger.warning('(%s) Client info from Radio ID that has not logged in: %s', self._system, int_id(_radio_id))
-
-        elif _command == 'RPTP':    # RPTPing -- client is pinging us
-                _radio_id = _data[7:11]
-                if _radio_id in self._clients \
-                            and self._clients[_radio_id]['CONNECTION'] == "YES" \
-                            and self._clients[_radio_id]['IP'] == _host \
-                            and self._clients[_radio_id]['PORT'] == _port:
-                    self._clients[_radio_id]['PINGS_RECEIVED'] += 1
-                    self._clients[_radio_id]['LAST_PING'] = time()
-                    self.send_client(_radio_id, 'MSTPONG'+_radio_id)
-                    self._logger.debug('(%s) Received and answered RPTPING from client %s (%s)', self._system, self._clients[_radio_id]['CALLSIGN'], int_id(_radio_id))
-                else:
-                    self.transport.write('MSTNAK'+_radio_id, (_host, _port))
-                    self._logger.warning('(%s) Client info from Radio ID that has not logged in: %s', self._system, int_id(_radio_id))
-
+                self._clients.remove(_radio_id)
+                return True
+            return False
+
+        _radio_id = _data[4:8]      # Configure Command
+        _this_client = self._clients.validate(_radio_id, _host, _port, hb_const.HBPC_WAITING_CONFIG)
+        if _this_client:
+            self._clients.connected(_this_client)
+            self._clients.touch(_this_client)
+            _this_client.configure(_data)
+
+            self.transport.write('RPTACK'+_radio_id, (_host, _port))
+            self._logger.info('(%s) Client %s (%s) has sent repeater configuration', self._system, _this_client.callsign, int_id(_radio_id))
+            if self._trace.auth:
+                self._trace.log('auth', 'RPTC from %s -- %s', int_id(_radio_id), ahex(_data))
+            return True
+        else:
+            self.transport.write('MSTNAK'+_radio_id, (_host, _port))
+            self._logger.warning('(%s) Client info from Radio ID that has not logged in: %s', self._system, int_id(_radio_id))
+            return False
+
+    def master_rptp(self, _data, _host, _port):
+        _radio_id = _data[7:11]
+        _this_client = self._clients.validate(_radio_id, _host, _port, hb_const.HBPC_YES)
+        if _this_client:
+            _this_client.pings_received += 1
+            self._clients.touch(_this_client)
+            self.transport.write('MSTPONG'+_radio_id, (_host, _port))
+            if self._trace.ping:
+                self._trace.log('ping', 'Received and answered RPTPING from client %s (%s)', _this_client.callsign, int_id(_radio_id))
+            return True
         else:
-            self._logger.error('(%s) Unrecognized command. Raw HBP PDU: %s', self._system, ahex(_data))
+            self.transport.write('MSTNAK'+_radio_id, (_host, _port))
+            self._logger.warning('(%s) Client info from Radio ID that has not logged in: %s', self._system, int_id(_radio_id))
+            return False
 
     # Aliased in __init__ to datagramReceived if system is a client
     def client_datagramReceived(self, _data, (_host, _port)):
-        # Keep This Line Commented Unless HEAVILY Debugging!
-        # self._logger.debug('(%s) RX packet from %s:%s -- %s', self._system, _host, _port, ahex(_data))
+        if self._capture:
+            self._capture.write(self._system, _host, _port, _data)
+        if self._trace.rx:
+            self._trace.log('rx', 'RX packet from %s:%s -- %s', _host, _port, ahex(_data))
 
         # Validate that we receveived this packet from the master - security check!
         if self._config['MASTER_IP'] == _host and self._config['MASTER_PORT'] == _port:
-            # Extract the command, which is various length, but only 4 significant characters
-            _command = _data[:4]
-            if   _command == 'DMRD':    # DMRData -- encapsulated DMR data frame
-                _radio_id = _data[11:15]
-                if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                    _seq = _data[4:5]
-                    _rf_src = _data[5:8]
-                    _dst_id = _data[8:11]
-                    _bits = int_id(_data[15])
-                    _slot = 2 if (_bits & 0x80) else 1
-                    _call_type = 'unit' if (_bits & 0x40) else 'group'
-                    _frame_type = (_bits & 0x30) >> 4
-                    _dtype_vseq = (_bits & 0xF) # data, 1=voice header, 2=voice terminator; voice, 0=burst A ... 5=burst F
-                    _stream_id = _data[16:20]
-                    self._logger.debug('(%s) DMRD - Sequence: %s, RF Source: %s, Destination ID: %s', self._system, int_id(_seq), int_id(_rf_src), int_id(_dst_id))
-
-                    # If AMBE audio exporting is configured...
-                    if self._config['EXPORT_AMBE']:
-                        self._ambe.parseAMBE(self._system, _data)
-
-                    # Userland actions -- typically this is the function you subclass for an application
-                    self.dmrd_received(_radio_id, _rf_src, _dst_id, _seq, _slot, _call_type, _frame_type, _dtype_vseq, _stream_id, _data)
-
-            elif _command == 'MSTN':    # Actually MSTNAK -- a NACK from the master
-                _radio_id = _data[6:10]
-                if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                    self._logger.warning('(%s) MSTNAK Received. Resetting connection to the Master.', self._system)
-                    self._stats['CONNECTION'] = 'NO' # Disconnect ourselves and re-register
-
-            elif _command == 'RPTA':    # Actually RPTACK -- an ACK from the master
-                # Depending on the state, an RPTACK means different things, in each clause, we check and/or set the state
-                if self._stats['CONNECTION'] == 'RPTL_SENT': # If we've sent a login request...
-                    _login_int32 = _data[6:10]
-                    self._logger.info('(%s) Repeater Login ACK Received with 32bit ID: %s', self._system, int_id(_login_int32))
-                    _pass_hash = sha256(_login_int32+self._config['PASSPHRASE']).hexdigest()
-                    _pass_hash = bhex(_pass_hash)
-                    self.send_master('RPTK'+self._config['RADIO_ID']+_pass_hash)
-                    self._stats['CONNECTION'] = 'AUTHENTICATED'
-
-                elif self._stats['CONNECTION'] == 'AUTHENTICATED': # If we've sent the login challenge...
-                    _radio_id = _data[6:10]
-                    if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                        self._logger.info('(%s) Repeater Authentication Accepted', self._system)
-                        _config_packet =  self._config['RADIO_ID']+\
-                                          self._config['CALLSIGN']+\
-                                          self._config['RX_FREQ']+\
-                                          self._config['TX_FREQ']+\
-                                          self._config['TX_POWER']+\
-                                          self._config['COLORCODE']+\
-                                          self._config['LATITUDE']+\
-                                          self._config['LONGITUDE']+\
-                                          self._config['HEIGHT']+\
-                                          self._config['LOCATION']+\
-                                          self._config['DESCRIPTION']+\
-                                          self._config['SLOTS']+\
-                                          self._config['URL']+\
-                                          self._config['SOFTWARE_ID']+\
-                                          self._config['PACKAGE_ID']
-
-                        self.send_master('RPTC'+_config_packet)
-                        self._stats['CONNECTION'] = 'CONFIG-SENT'
-                        self._logger.info('(%s) Repeater Configuration Sent', self._system)
-                    else:
-                        self._stats['CONNECTION'] = 'NO'
-                        self._logger.error('(%s) Master ACK Contained wrong ID - Connection Reset', self._system)
-
-                elif self._stats['CONNECTION'] == 'CONFIG-SENT': # If we've sent out configuration to the master
-                    _radio_id = _data[6:10]
-                    if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                        self._logger.info('(%s) Repeater Configuration Accepted', self._system)
-                        if self._config['OPTIONS']:
-                            self.send_master('RPTO'+self._config['RADIO_ID']+self._config['OPTIONS'])
-                            self._stats['CONNECTION'] = 'OPTIONS-SENT'
-                            self._logger.info('(%s) Sent options: (%s)', self._system, self._config['OPTIONS'])
-                        else:
-                            self._stats['CONNECTION'] = 'YES'
-                            self._logger.info('(%s) Connection to Master Completed', self._system)
-                    else:
-                        self._stats['CONNECTION'] = 'NO'
-                        self._logger.error('(%s) Master ACK Contained wrong ID - Connection Reset', self._system)
-
-                elif self._stats['CONNECTION'] == 'OPTIONS-SENT': # If we've sent out options to the master
-                    _radio_id = _data[6:10]
-                    if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                        self._logger.info('(%s) Repeater Options Accepted', self._system)
-                        self._stats['CONNECTION'] = 'YES'
-                        self._logger.info('(%s) Connection to Master Completed with options', self._system)
-                    else:
-                        self._stats['CONNECTION'] = 'NO'
-                        self._logger.error('(%s) Master ACK Contained wrong ID - Connection Reset', self._system)
-
-            elif _command == 'MSTP':    # Actually MSTPONG -- a reply to RPTPING (send by client)
-                _radio_id = _data[7:11]
-                if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                    self._stats['PING_OUTSTANDING'] = False
-                    self._stats['NUM_OUTSTANDING'] = 0
-                    self._stats['PINGS_ACKD'] += 1
-                    self._logger.debug('(%s) MSTPONG Received. Pongs Since Connected: %s', self._system, self._stats['PINGS_ACKD'])
-
-            elif _command == 'MSTC':    # Actually MSTCL -- notify us the master is closing down
-                _radio_id = _data[5:9]
-                if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
-                    self._stats['CONNECTION'] = 'NO'
-                    self._logger.info('(%s) MSTCL Recieved', self._system)
-
+            self.dispatch(_data, _host, _port)
+
+    def client_dmrd(self, _data, _host, _port):
+        if len(_data) < DMRD_LENGTH:
+            return self.short_dmrd(_data, _host, _port)
+        _radio_id = _data[11:15]
+        if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+            _frame = DMRD(_data)
+            _metrics = self._metrics.slot[_frame.slot]
+            _metrics.rx_frames += 1
+            _metrics.rx_bytes += len(_data)
+            if self._trace.rx:
+                self._trace.log('rx', 'DMRD - Sequence: %s, RF Source: %s, Destination ID: %s', int_id(_frame.seq), int_id(_frame.rf_src), int_id(_frame.dst_id))
+
+            # If AMBE audio exporting is configured...
+            if self._config['EXPORT_AMBE']:
+                self._ambe.parseAMBE(self._system, _frame)
+
+            # Userland actions -- typically this is the function you subclass for an application
+            self.dmrd_received(_frame)
+            return True
+        self._metrics.drop_unauth += 1
+        return False
+
+    def client_mstnak(self, _data, _host, _port):
+        _radio_id = _data[6:10]
+        if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+            self._logger.warning('(%s) MSTNAK Received. Resetting connection to the Master.', self._system)
+            self._stats['CONNECTION'] = 'NO' # Disconnect ourselves and re-register
+            return True
+        return False
+
+    def client_rptack(self, _data, _host, _port):
+        # Depending on the state, an RPTACK means different things, in each clause, we check and/or set the state
+        if self._stats['CONNECTION'] == 'RPTL_SENT': # If we've sent a login request...
+            _login_int32 = _data[6:10]
+            self._logger.info('(%s) Repeater Login ACK Received with 32bit ID: %s', self._system, int_id(_login_int32))
+            _pass_hash = sha256(_login_int32+self._config['PASSPHRASE']).hexdigest()
+            _pass_hash = bhex(_pass_hash)
+            if self._trace.auth:
+                self._trace.log('auth', 'Salt %s, answering with hash %s', ahex(_login_int32), ahex(_pass_hash))
+            self.send_master('RPTK'+self._config['RADIO_ID']+_pass_hash)
+            self._stats['CONNECTION'] = 'AUTHENTICATED'
+            return True
+
+        elif self._stats['CONNECTION'] == 'AUTHENTICATED': # If we've sent the login challenge...
+            _radio_id = _data[6:10]
+            if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+                self._logger.info('(%s) Repeater Authentication Accepted', self._system)
+                _config_packet =  self._config['RADIO_ID']+\
+                                  self._config['CALLSIGN']+\
+                                  self._config['RX_FREQ']+\
+                                  self._config['TX_FREQ']+\
+                                  self._config['TX_POWER']+\
+                                  self._config['COLORCODE']+\
+                                  self._config['LATITUDE']+\
+                                  self._config['LONGITUDE']+\
+                                  self._config['HEIGHT']+\
+                                  self._config['LOCATION']+\
+                                  self._config['DESCRIPTION']+\
+                                  self._config['SLOTS']+\
+                                  self._config['URL']+\
+                                  self._config['SOFTWARE_ID']+\
+                                  self._config['PACKAGE_ID']
+
+                self.send_master('RPTC'+_config_packet)
+                self._stats['CONNECTION'] = 'CONFIG-SENT'
+                self._logger.info('(%s) Repeater Configuration Sent', self._system)
+                return True
+            else:
+                self._stats['CONNECTION'] = 'NO'
+                self._logger.error('(%s) Master ACK Contained wrong ID - Connection Reset', self._system)
+
+        elif self._stats['CONNECTION'] == 'CONFIG-SENT': # If we've sent out configuration to the master
+            _radio_id = _data[6:10]
+            if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+                self._logger.info('(%s) Repeater Configuration Accepted', self._system)
+                if self._config['OPTIONS']:
+                    self.send_master('RPTO'+self._config['RADIO_ID']+self._config['OPTIONS'])
+                    self._stats['CONNECTION'] = 'OPTIONS-SENT'
+                    self._logger.info('(%s) Sent options: (%s)', self._system, self._config['OPTIONS'])
+                    return True
+                else:
+                    self._stats['CONNECTION'] = 'YES'
+                    self._logger.info('(%s) Connection to Master Completed', self._system)
+                    return True
             else:
-                self._logger.error('(%s) Received an invalid command in packet: %s', self._system, ahex(_data))
+                self._stats['CONNECTION'] = 'NO'
+                self._logger.error('(%s) Master ACK Contained wrong ID - Connection Reset', self._system)
+
+        elif self._stats['CONNECTION'] == 'OPTIONS-SENT': # If we've sent out options to the master
+            _radio_id = _data[6:10]
+            if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+                self._logger.info('(%s) Repeater Options Accepted', self._system)
+                self._stats['CONNECTION'] = 'YES'
+                self._logger.info('(%s) Connection to Master Completed with options', self._system)
+                return True
+            else:
+                self._stats['CONNECTION'] = 'NO'
+                self._logger.error('(%s) Master ACK Contained wrong ID - Connection Reset', self._system)
+        return False
+
+    def client_mstpong(self, _data, _host, _port):
+        _radio_id = _data[7:11]
+        if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+            self._stats['PING_OUTSTANDING'] = False
+            self._stats['NUM_OUTSTANDING'] = 0
+            self._stats['PINGS_ACKD'] += 1
+            if self._trace.ping:
+                self._trace.log('ping', 'MSTPONG Received. Pongs Since Connected: %s', self._stats['PINGS_ACKD'])
+            return True
+        return False
+
+    def client_mstcl(self, _data, _host, _port):
+        _radio_id = _data[5:9]
+        if self._config['LOOSE'] or _radio_id == self._config['RADIO_ID']: # Validate the Radio_ID unless using loose validation
+            self._stats['CONNECTION'] = 'NO'
+            self._logger.info('(%s) MSTCL Recieved', self._system)
+            return True
+        return False
 
 #
 # Socket-based reporting section
 #
+
+# How a reporting client's queue treats messages while the client is behind:
+# a newer snapshot replaces one of the same kind still waiting (and the updates
+# it makes pointless), events then updates are dropped oldest first to stay
+# under REPORT_QUEUE_BYTES. A dropped update shows up as a version gap, and the
+# client asks for a snapshot.
+REPORT_SNAPSHOTS = {
+    REPORT_OPCODES['CONFIG_SND']: REPORT_OPCODES['CONFIG_UPD'],
+    REPORT_OPCODES['BRIDGE_SND']: REPORT_OPCODES['BRIDGE_UPD'],
+    REPORT_OPCODES['METRICS_SND']: None,
+    REPORT_OPCODES['LATENCY_SND']: None,
+}
+REPORT_SHED = (
+    ('EVENT', (REPORT_OPCODES['LINK_EVENT'], REPORT_OPCODES['BRDG_EVENT'])),
+    ('UPDATE', (REPORT_OPCODES['CONFIG_UPD'], REPORT_OPCODES['BRIDGE_UPD'])),
+)
+
+# Events go out in batches, of whatever happened in REPORT_EVENT_INTERVAL
+# seconds or the first REPORT_EVENT_BATCH, whichever comes first
+REPORT_EVENT_INTERVAL = 0.1
+REPORT_EVENT_BATCH = 64
+
+# What a reporting client subscribed to (SUBSCRIBE): for each of TOPICS a
+# frozenset of names, or None for all of them. It starts with everything.
+TOPICS = ('SYSTEMS', 'BRIDGES', 'EVENTS')
+ALL_TOPICS = (None, None, None)
+
+# The entries of a dictionary that are named, or all of it
+def subset(_dict, _names):
+    if _names is None:
+        return _dict
+    return dict((_key, _value) for _key, _value in _dict.iteritems() if _key in _names)
+
+# The same for each dictionary in an update, e.g. CONFIG_UPD's SYSTEMS, CLIENTS...
+# and each list of names, e.g. its SYSTEMS_REMOVED
+def subset_update(_update, _names):
+    if _names is None:
+        return _update
+    _subset = {}
+    for _key, _value in _update.iteritems():
+        if isinstance(_value, dict):
+            _subset[_key] = subset(_value, _names)
+        elif isinstance(_value, list):
+            _subset[_key] = [_name for _name in _value if _name in _names]
+        else:
+            _subset[_key] = _value
+    return _subset
+
+# Reporting clients get their messages through send(). While the transport's
+# buffer is full, Twisted pauses us (we are its producer) and messages wait in
+# our own queue instead, where they can be coalesced and dropped.
+@implementer(IPushProducer)
 class report(NetstringReceiver):
     def __init__(self, factory):
         self._factory = factory
+        self._queue = deque()       # messages waiting for the transport to drain
+        self._queued = 0            # bytes in _queue
+        self._paused = False
+        self._over_since = None     # when _queue went over REPORT_QUEUE_BYTES and stayed there
+        self.topics = ALL_TOPICS
+        self.event_seq = 0          # sequence number of the last event sent to this client
 
     def connectionMade(self):
         self._factory.clients.append(self)
+        self.transport.registerProducer(self, True)
         self._factory._logger.info('HBlink reporting client connected: %s', self.transport.getPeer())
 
     def connectionLost(self, reason):
         self._factory._logger.info('HBlink reporting client disconnected: %s', self.transport.getPeer())
         self._factory.clients.remove(self)
+        self._queue.clear()
+        self._queued = 0
+
+    def send(self, _message):
+        if not self._paused:
+            self.sendString(_message)
+            return
+        _superseded = REPORT_SNAPSHOTS.get(_message[:1], False)
+        if _superseded is not False:
+            self._discard((_message[:1], _superseded), 'SUPERSEDED')
+        self._queue.append(_message)
+        self._queued += len(_message)
+        self._shed()
+
+    # Remove every queued message with one of these opcodes
+    def _discard(self, _opcodes, _reason, _limit = 0):
+        _kept = deque()
+        for _message in self._queue:
+            if _message[:1] in _opcodes and self._queued > _limit:
+                self._queued -= len(_message)
+                self._factory.dropped[_reason] += 1
+            else:
+                _kept.append(_message)
+        self._queue = _kept
+
+    def _shed(self):
+        _limit = self._factory._config['REPORTS']['REPORT_QUEUE_BYTES']
+        for _reason, _opcodes in REPORT_SHED:
+            if self._queued <= _limit:
+                break
+            self._discard(_opcodes, _reason, _limit)
+        if self._queued <= _limit:
+            self._over_since = None
+        elif self._over_since is None:
+            self._over_since = time()
+        elif time() - self._over_since > self._factory._config['REPORTS']['REPORT_INTERVAL']:
+            self._factory._logger.warning('HBlink reporting client %s is not keeping up, %s bytes queued: disconnecting', self.transport.getPeer(), self._queued)
+            self._factory.disconnected += 1
+            self._queue.clear()
+            self._queued = 0
+            self.transport.abortConnection()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    # The transport drained: send what waited until it fills up again
+    def resumeProducing(self):
+        self._paused = False
+        while self._queue and not self._paused:
+            _message = self._queue.popleft()
+            self._queued -= len(_message)
+            self.sendString(_message)
+        self._shed()
+
+    def stopProducing(self):
+        self._queue.clear()
+        self._queued = 0
+
+    def queued(self):
+        return self._queued
 
     def stringReceived(self, data):
         self.process_message(data)
@@ -523,14 +935,68 @@ class report(NetstringReceiver):
         opcode = _message[:1]
         if opcode == REPORT_OPCODES['CONFIG_REQ']:
             self._factory._logger.info('HBlink reporting client sent \'CONFIG_REQ\': %s', self.transport.getPeer())
-            self.send_config()
+            self._factory.send_config([self])
+        elif opcode == REPORT_OPCODES['BRIDGE_REQ'] and hasattr(self._factory, 'send_bridge'):
+            self._factory._logger.info('HBlink reporting client sent \'BRIDGE_REQ\': %s', self.transport.getPeer())
+            self._factory.send_bridge([self])
+        elif opcode == REPORT_OPCODES['TRACE_SET']:
+            self.trace_set(_message[1:])
+        elif opcode == REPORT_OPCODES['METRICS_REQ']:
+            self._factory._logger.info('HBlink reporting client sent \'METRICS_REQ\': %s', self.transport.getPeer())
+            self._factory.send_metrics()
+        elif opcode == REPORT_OPCODES['LATENCY_REQ']:
+            self._factory._logger.info('HBlink reporting client sent \'LATENCY_REQ\': %s', self.transport.getPeer())
+            self._factory.send_latency(_message[1:] == 'RESET')
+        elif opcode == REPORT_OPCODES['SUBSCRIBE']:
+            self.subscribe(_message[1:])
+        elif opcode == REPORT_OPCODES['RELOAD'] and self._factory.reload:
+            self._factory._logger.info('HBlink reporting client sent \'RELOAD\': %s', self.transport.getPeer())
+            self._factory.reload()
         else:
             self._factory._logger.error('got unknown opcode')
+
+    # '<system>:<category>,<category>...' -- switch packet tracing for one system
+    def trace_set(self, _payload):
+        _system, _sep, _categories = _payload.rpartition(':')
+        if _system not in systems:
+            self._factory._logger.error('HBlink reporting client sent \'TRACE_SET\' for unknown system: %s', _system)
+            return
+        _unknown = systems[_system]._trace.set(_categories.split(','))
+        if _unknown:
+            self._factory._logger.warning('(%s) Ignoring unknown trace categories: %s', _system, ', '.join(_unknown))
+        self._factory._config['SYSTEMS'][_system]['TRACE'] = systems[_system]._trace.enabled()
+        self._factory._logger.info('(%s) Packet tracing set by %s: %s', _system, self.transport.getPeer(), ', '.join(self._factory._config['SYSTEMS'][_system]['TRACE']) or 'off')
+
+    # '<topic>:<name>,<name>...;<topic>:...' -- from now on, only send this
+    # client what is about the names given for each topic. A topic left out
+    # is not filtered, an empty list of names turns it off. Empty resets
+    # the client to everything.
+    def subscribe(self, _payload):
+        _topics = dict.fromkeys(TOPICS)
+        for _subscription in filter(None, _payload.split(';')):
+            _topic, _sep, _names = _subscription.partition(':')
+            if _topic not in _topics:
+                self._factory._logger.error('HBlink reporting client sent \'SUBSCRIBE\' for unknown topic: %s', _topic)
+                return
+            _topics[_topic] = frozenset(filter(None, _names.split(',')))
+        if _topics['EVENTS']:
+            _unknown = [_event for _event in _topics['EVENTS'] if _event not in ('LINK_EVENT', 'BRDG_EVENT')]
+            if _unknown:
+                self._factory._logger.warning('HBlink reporting client %s subscribed to unknown event types: %s', self.transport.getPeer(), ', '.join(_unknown))
+        self.topics = tuple(_topics[_topic] for _topic in TOPICS)
+        self._factory._logger.info('HBlink reporting client %s subscribed to: %s', self.transport.getPeer(), '; '.join('{}: {}'.format(_topic, ', '.join(sorted(_topics[_topic])) if _topics[_topic] is not None else 'all') for _topic in TOPICS))
         
 class reportFactory(Factory):
     def __init__(self, config, logger):
         self._config = config
         self._logger = logger
+        self._versions = {}         # update opcode -> version of the last update sent
+        self._config_sent = {}      # system -> what CONFIG_UPD last reported, with the client registry it reported on
+        self.dropped = {'SUPERSEDED': 0, 'EVENT': 0, 'UPDATE': 0}   # messages dropped from clients' queues
+        self.disconnected = 0       # clients cut off for staying over REPORT_QUEUE_BYTES
+        self._events = {}           # event opcode -> events waiting for the next batch
+        self._flush = None          # IDelayedCall sending that batch
+        self.reload = None          # the application's reload, if it has one, for RELOAD
         
     def buildProtocol(self, addr):
         if (addr.host) in self._config['REPORTS']['REPORT_CLIENTS'] or '*' in self._config['REPORTS']['REPORT_CLIENTS']:
@@ -542,11 +1008,142 @@ class reportFactory(Factory):
             
     def send_clients(self, _message):
         for client in self.clients:
-            client.sendString(_message)
+            client.send(_message)
+
+    # Send each client (all of them, or those given) what _filter(_data, topics)
+    # picks out for its subscription -- pickled once for each different one.
+    # Nothing is sent to clients for whom _filter returns None.
+    def send_filtered(self, _opcode, _data, _filter, _clients = None):
+        _messages = {}
+        for _client in self.clients if _clients is None else _clients:
+            if _client.topics not in _messages:
+                _subset = _filter(_data, _client.topics)
+                _messages[_client.topics] = REPORT_OPCODES[_opcode]+pickle.dumps(_subset, protocol=pickle.HIGHEST_PROTOCOL) if _subset is not None else None
+            if _messages[_client.topics]:
+                _client.send(_messages[_client.topics])
             
-    def send_config(self):
-        serialized = pickle.dumps(self._config['SYSTEMS'], protocol=pickle.HIGHEST_PROTOCOL)
-        self.send_clients(REPORT_OPCODES['CONFIG_SND']+serialized)
+    # An event is a tuple of plain values. It goes out timestamped in the next
+    # batch for its opcode, to clients subscribed to the opcode's name and to
+    # _system, if it is about one.
+    def send_event(self, _opcode, _event, _system = None):
+        if not self.clients:
+            return
+        _events = self._events.setdefault(_opcode, [])
+        _events.append((_system, (time(),) + _event))
+        if len(_events) >= REPORT_EVENT_BATCH:
+            self.flush_events()
+        elif not self._flush:
+            self._flush = reactor.callLater(REPORT_EVENT_INTERVAL, self.flush_events)
+
+    # Events are numbered per client, after filtering, from 1 when it connects,
+    # so every event it could have had has a number and a gap in them is only
+    # ever loss. Clients with the same subscription and count share the pickling.
+    def flush_events(self):
+        if self._flush and self._flush.active():
+            self._flush.cancel()
+        self._flush = None
+        _batches = {}
+        for _client in self.clients:
+            _key = (_client.topics, _client.event_seq)
+            if _key not in _batches:
+                _batches[_key] = self._event_batches(_client.topics, _client.event_seq)
+            _client.event_seq, _messages = _batches[_key]
+            for _message in _messages:
+                _client.send(_message)
+        self._events = {}
+
+    # The batch for each opcode that has events for _topics, numbered on from
+    # _seq, and the last number used
+    def _event_batches(self, _topics, _seq):
+        _systems, _bridges, _types = _topics
+        _messages = []
+        for _opcode, _events in self._events.iteritems():
+            if _types is not None and _opcode not in _types:
+                continue
+            _batch = []
+            for _system, _event in _events:
+                if _system is None or _systems is None or _system in _systems:
+                    _seq += 1
+                    _batch.append((_seq,) + _event)
+            if _batch:
+                _messages.append(REPORT_OPCODES[_opcode]+pickle.dumps(_batch, protocol=pickle.HIGHEST_PROTOCOL))
+        return _seq, _messages
+
+    # Full snapshot, to the reporting clients given (the one that asked) or to all of them.
+    # Whatever changed is sent as an update first, so the snapshot is exactly
+    # the state at its VERSION and the next update's BASE.
+    def send_config(self, _clients = None):
+        self.send_config_update()
+        _snapshot = {'VERSION': self._versions.get('CONFIG_UPD', 0), 'SYSTEMS': self._config['SYSTEMS']}
+        self.send_filtered('CONFIG_SND', _snapshot, lambda _snapshot, _topics: {'VERSION': _snapshot['VERSION'], 'SYSTEMS': subset(_snapshot['SYSTEMS'], _topics[0])}, _clients)
+
+    # Everything sent every REPORT_INTERVAL. Applications add their own.
+    def send_updates(self):
+        self.send_config_update()
+
+    # An update is a dictionary, sent with the version it brings the state to
+    # and the version it applies to. A reporting client that has missed one
+    # (BASE isn't the last VERSION it saw) should ask for a snapshot again.
+    # Clients that subscribed to only some of it still get every version.
+    def send_update(self, _opcode, _update, _filter):
+        _base = self._versions.get(_opcode, 0)
+        self._versions[_opcode] = _update['VERSION'] = _base + 1
+        _update['BASE'] = _base
+        self.send_filtered(_opcode, _update, _filter)
+
+    # What changed in CONFIG['SYSTEMS'] since the last update: systems that
+    # are gone (a reload removed them), system level entries whose value is
+    # different, and from each master's registry the clients that changed,
+    # were removed, or only pinged. A master that has a new registry (a reload
+    # started it over) has all of it sent as its CLIENTS entry instead. Nothing
+    # at all is sent when nothing changed.
+    def send_config_update(self):
+        _update = {'SYSTEMS_REMOVED': [], 'SYSTEMS': {}, 'CLIENTS': {}, 'REMOVED': {}, 'PINGS': {}}
+        _changes = False
+        for _system in self._config_sent.keys():
+            if _system not in self._config['SYSTEMS']:
+                del self._config_sent[_system]
+                _update['SYSTEMS_REMOVED'].append(_system)
+                _changes = True
+        for _system, _system_config in self._config['SYSTEMS'].iteritems():
+            _sent = self._config_sent.setdefault(_system, {})
+            _changed = dict((_key, _value) for _key, _value in _system_config.iteritems() if _key != 'CLIENTS' and _sent.get(_key, _sent) != _value)
+            _sent.update(deepcopy(_changed))
+            _registry = _system_config.get('CLIENTS')
+            if _registry is not _sent.get('CLIENTS'):
+                _sent['CLIENTS'] = _registry
+                if hasattr(_registry, 'changes'):
+                    _registry.changes()
+                    _changed['CLIENTS'] = _registry.export()
+                else:
+                    _changed['CLIENTS'] = deepcopy(_registry)
+            if _changed:
+                _update['SYSTEMS'][_system] = _changed
+                _changes = True
+            if _system_config['MODE'] == 'MASTER' and hasattr(_registry, 'changes'):
+                _clients, _removed, _pinged = _registry.changes()
+                if _clients:
+                    _update['CLIENTS'][_system] = _clients
+                if _removed:
+                    _update['REMOVED'][_system] = _removed
+                if _pinged:
+                    _update['PINGS'][_system] = _pinged
+                _changes = _changes or _clients or _removed or _pinged
+        if _changes:
+            self.send_update('CONFIG_UPD', _update, lambda _update, _topics: subset_update(_update, _topics[0]))
+
+    def send_metrics(self):
+        if self.clients:
+            _metrics = dict((_system, systems[_system]._metrics.export()) for _system in systems)
+            self.send_filtered('METRICS_SND', _metrics, lambda _metrics, _topics: subset(_metrics, _topics[0]))
+
+    def send_latency(self, _reset = False):
+        _latency = dict((_system, systems[_system]._metrics.target_latency()) for _system in systems)
+        self.send_filtered('LATENCY_SND', _latency, lambda _latency, _topics: subset(_latency, _topics[0]))
+        if _reset:
+            for _system in systems:
+                systems[_system]._metrics.reset_latency()
+            self._logger.info('Latency histograms reset')
         
 
 #************************************************
@@ -568,6 +1165,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', action='store', dest='CONFIG_FILE', help='/full/path/to/config.file (usually hblink.cfg)')
     parser.add_argument('-l', '--logging', action='store', dest='LOG_LEVEL', help='Override config file logging level.')
+    parser.add_argument('--shard', action='store', dest='SHARD', type=int, help=argparse.SUPPRESS)
     cli_args = parser.parse_args()
 
     # Ensure we have a path for the config file, if one wasn't specified, then use the execution directory
@@ -583,6 +1181,18 @@ if __name__ == '__main__':
     logger = hb_log.config_logging(CONFIG['LOGGER'])
     logger.debug('Logging system started, anything from here on gets logged')
 
+    # With more than one shard configured, this process only starts and
+    # watches the workers -- each of them runs this script with --shard
+    _shards = CONFIG['GLOBAL']['SHARDS']
+    if _shards > 1 and (CONFIG['REPORTS']['REPORT'] or CONFIG['REPORTS']['METRICS_PORT']):
+        logger.critical('SHARDS is %s, but reporting and the metrics page would only see the systems in the first worker. Set REPORT to False and METRICS_PORT to 0 to run sharded', _shards)
+        sys.exit(1)
+    if _shards > 1 and cli_args.SHARD is None:
+        import hb_shard
+        hb_shard.run_shards(CONFIG, logger)
+        sys.exit(0)
+    _shard = cli_args.SHARD or 0
+
     # Set up the signal handler
     def sig_handler(_signal, _frame):
         logger.info('SHUTDOWN: HBLINK IS TERMINATING WITH SIGNAL %s', str(_signal))
@@ -594,15 +1204,43 @@ if __name__ == '__main__':
     for sig in [signal.SIGTERM, signal.SIGINT]:
         signal.signal(sig, sig_handler)
         
-    # INITIALIZE THE REPORTING LOOP
-    report_server = config_reports(CONFIG, logger, reportFactory)    
+    # INITIALIZE THE REPORTING LOOP (not when sharded, see above)
+    report_server = None
+    if _shards == 1:
+        report_server = config_reports(CONFIG, logger, reportFactory)
+
+    # Reload the config file on SIGHUP or RELOAD, without disturbing systems that
+    # didn't change. Sharded masters share their ports between processes, so
+    # they are only ever set up at startup.
+    def reload_config():
+        logger.info('RELOAD: reading %s', cli_args.CONFIG_FILE)
+        _new_config = rebuild_config(cli_args.CONFIG_FILE, logger, cli_args.LOG_LEVEL)
+        if _new_config and reload_systems(CONFIG, _new_config, logger, report_server, HBSYSTEM) and report_server:
+            report_server.send_config()
+
+    def reload_handler(_signal, _frame):
+        reactor.callFromThread(reload_config)
+
+    if _shards == 1:
+        signal.signal(signal.SIGHUP, reload_handler)
+        report_server.reload = reload_config
 
     # HBlink instance creation
     logger.info('HBlink \'HBlink.py\' (c) 2016 N0MJS & the K0USY Group - SYSTEM STARTING...')
     for system in CONFIG['SYSTEMS']:
         if CONFIG['SYSTEMS'][system]['ENABLED']:
-            systems[system] = HBSYSTEM(system, CONFIG, logger, report_server)
-            reactor.listenUDP(CONFIG['SYSTEMS'][system]['PORT'], systems[system], interface=CONFIG['SYSTEMS'][system]['IP'])
+            if _shards > 1 and CONFIG['SYSTEMS'][system]['MODE'] == 'MASTER':
+                import hb_shard
+                systems[system] = HBSYSTEM(system, CONFIG, logger, report_server)
+                systems[system]._clients.shard = hb_shard.SHARDTABLE(hb_shard.table_file(CONFIG, system), _shard, _shards)
+                _sock = hb_shard.reuseport_socket(CONFIG['SYSTEMS'][system]['IP'], CONFIG['SYSTEMS'][system]['PORT'])
+                reactor.adoptDatagramPort(_sock.fileno(), socket.AF_INET, systems[system])
+                _sock.close()
+            elif _shard == 0:
+                systems[system] = HBSYSTEM(system, CONFIG, logger, report_server)
+                reactor.listenUDP(CONFIG['SYSTEMS'][system]['PORT'], systems[system], interface=CONFIG['SYSTEMS'][system]['IP'])
+            else:
+                continue
             logger.debug('%s instance created: %s, %s', CONFIG['SYSTEMS'][system]['MODE'], system, systems[system])
 
     reactor.run()
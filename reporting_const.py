@@ -20,11 +20,26 @@
 
 REPORT_OPCODES = {
     'CONFIG_REQ': '\x00',
-    'CONFIG_SND': '\x01',
+    'CONFIG_SND': '\x01',      # pickled {'VERSION', 'SYSTEMS': CONFIG['SYSTEMS']} -- the next CONFIG_UPD has BASE VERSION
     'BRIDGE_REQ': '\x02',
-    'BRIDGE_SND': '\x03',
-    'CONFIG_UPD': '\x04',
-    'BRIDGE_UPD': '\x05',
-    'LINK_EVENT': '\x06',
-    'BRDG_EVENT': '\x07',
+    'BRIDGE_SND': '\x03',      # pickled {'VERSION', 'BRIDGES': BRIDGES} -- the next BRIDGE_UPD has BASE VERSION
+    'CONFIG_UPD': '\x04',      # pickled {'VERSION', 'BASE', 'SYSTEMS_REMOVED': [system], 'SYSTEMS': {system:
+                               #   {changed key: value}}, 'REMOVED': {system: [radio_id]}, 'CLIENTS': {system:
+                               #   {radio_id: client}}, 'PINGS': {system: {radio_id: (pings received, last ping)}}}
+                               #   -- apply in that order. A system's CLIENTS in SYSTEMS replaces all of them
+    'BRIDGE_UPD': '\x05',      # pickled {'VERSION', 'BASE', 'BRIDGES': {bridge: [rule, ...]}, 'REMOVED': [bridge]}
+                               #   for the bridges that changed or went away
+    'LINK_EVENT': '\x06',      # pickled [(sequence, time, event...), ...] -- up to 100ms of events. Sequence
+                               #   numbers count the events sent to this client from 1 when it connects, so a
+                               #   gap means some were lost; SUBSCRIBE doesn't start them over
+    'BRDG_EVENT': '\x07',      # as LINK_EVENT, events are ('GROUP VOICE', 'START' or 'END', system, stream ID,
+                               #   repeater, subscriber, slot, TGID[, duration]) with the IDs as integers
+    'TRACE_SET':  '\x08',      # '<system>:<category>,<category>...' -- empty list turns tracing off
+    'METRICS_REQ': '\x09',
+    'METRICS_SND': '\x0A',     # pickled {system: hb_metrics.METRICS.export()}
+    'LATENCY_REQ': '\x0B',     # optionally followed by 'RESET' to start LATENCY_SND over once sent
+    'LATENCY_SND': '\x0C',     # pickled {source: {target: {'P50', 'P99', 'MAX', 'COUNT'}}}
+    'SUBSCRIBE':  '\x0D',      # 'SYSTEMS:<system>,...;BRIDGES:<bridge>,...;EVENTS:BRDG_EVENT,...' -- only send
+                               #   what is about these. Topics left out aren't filtered, empty resets to everything
+    'RELOAD':     '\x0E',      # re-read the config file and rules, as SIGHUP does
     }
\ No newline at end of file
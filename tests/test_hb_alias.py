@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Tests for hb_alias.py: alias CSV files through build_index and back out of
+ALIASDB, and download() replacing an alias file only when it gets a whole
+new one. Run from the top of the tree with:
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dmr_utils.utils import get_alias
+import hb_alias
+from hb_alias import ALIASDB, MAX_WIDTH, build_index, download, index_file, mk_alias_db
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+
+class AliasTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + '/'
+        self.dbs = []
+
+    def tearDown(self):
+        for _db in self.dbs:
+            _db.close()
+        shutil.rmtree(self.path)
+
+    def write(self, _file, _text):
+        with open(self.path + _file, 'wb') as _handle:
+            _handle.write(_text)
+        return self.path + _file
+
+    def index(self, _text):
+        _csv_file = self.write('ids.csv', _text)
+        _count = build_index(_csv_file, index_file(_csv_file))
+        _db = ALIASDB(index_file(_csv_file))
+        self.dbs.append(_db)
+        self.assertEqual(len(_db), _count)
+        return _db
+
+
+class BUILD_INDEX(AliasTestCase):
+    def test_round_trip(self):
+        _db = self.index('3120101,N0MJS,Cort\r\n1,A\r\n4294967295,TOP\r\n')
+        self.assertEqual(len(_db), 3)
+        self.assertEqual(_db[1], 'A')
+        self.assertEqual(_db[3120101], 'N0MJS')
+        self.assertEqual(_db[4294967295], 'TOP')
+        self.assertTrue(3120101 in _db)
+        self.assertFalse(2 in _db)
+        self.assertRaises(KeyError, lambda: _db[2])
+        self.assertEqual(_db.get(2, 'none'), 'none')
+
+    def test_last_row_wins(self):
+        _db = self.index('7,FIRST\n7,SECOND\n')
+        self.assertEqual(len(_db), 1)
+        self.assertEqual(_db[7], 'SECOND')
+
+    def test_bad_rows_skipped(self):
+        _db = self.index('RADIO_ID,CALLSIGN\n,EMPTY\nabc,WORD\n9\n-1,NEGATIVE\n4294967296,TOO_BIG\n\n10,GOOD\n')
+        self.assertEqual(len(_db), 1)
+        self.assertEqual(_db[10], 'GOOD')
+        self.assertFalse(4294967296 in _db)
+        self.assertFalse(-1 in _db)
+
+    def test_long_alias_cut(self):
+        _db = self.index('5,{}\n'.format('X' * (MAX_WIDTH + 10)))
+        self.assertEqual(_db[5], 'X' * MAX_WIDTH)
+
+    def test_empty_file(self):
+        _db = self.index('')
+        self.assertEqual(len(_db), 0)
+        self.assertFalse(1 in _db)
+        self.assertEqual(_db.get(1), None)
+
+    def test_get_alias(self):
+        _db = self.index('3120101,N0MJS\n')
+        self.assertEqual(get_alias('\x2f\x9b\xe5', _db), 'N0MJS')
+        self.assertEqual(get_alias('\x00\x00\x02', _db), 2)
+
+    def test_not_an_index(self):
+        self.assertRaises(ValueError, ALIASDB, self.write('ids.idx', 'not an index at all'))
+
+
+class MK_ALIAS_DB(AliasTestCase):
+    def test_builds_missing_index(self):
+        self.write('ids.csv', '1,ONE\n')
+        _db = mk_alias_db(self.path, 'ids.csv')
+        self.dbs.append(_db)
+        self.assertEqual(_db[1], 'ONE')
+
+    def test_rebuilds_stale_index(self):
+        _csv_file = self.write('ids.csv', '1,ONE\n')
+        build_index(_csv_file, index_file(_csv_file))
+        self.write('ids.csv', '1,UNO\n')
+        os.utime(index_file(_csv_file), (time() - 60, time() - 60))
+        _db = mk_alias_db(self.path, 'ids.csv')
+        self.dbs.append(_db)
+        self.assertEqual(_db[1], 'UNO')
+
+    def test_rebuilds_bad_index(self):
+        self.write('ids.csv', '1,ONE\n')
+        self.write('ids.idx', 'garbage')
+        _db = mk_alias_db(self.path, 'ids.csv')
+        self.dbs.append(_db)
+        self.assertEqual(_db[1], 'ONE')
+
+    def test_no_alias_file(self):
+        self.assertEqual(mk_alias_db(self.path, 'ids.csv'), {})
+
+
+class DOWNLOAD(AliasTestCase):
+    def setUp(self):
+        AliasTestCase.setUp(self)
+        self.old = self.write('ids.csv', '1,OLD\n')
+        self.new = self.write('new.csv', '1,NEW\n')
+
+    def contents(self):
+        with open(self.old, 'rb') as _handle:
+            return _handle.read()
+
+    def leftovers(self):
+        return [_file for _file in os.listdir(self.path) if _file.endswith('.tmp')]
+
+    def test_local_file(self):
+        self.assertTrue(download(self.path, 'ids.csv', self.new, 0).endswith('successfully downloaded'))
+        self.assertEqual(self.contents(), '1,NEW\n')
+
+    def test_file_url(self):
+        self.assertTrue(download(self.path, 'ids.csv', 'file://' + self.new, 0).endswith('successfully downloaded'))
+        self.assertEqual(self.contents(), '1,NEW\n')
+
+    def test_missing_source_keeps_old_file(self):
+        self.assertTrue(download(self.path, 'ids.csv', self.path + 'missing.csv', 0).endswith('could not be downloaded'))
+        self.assertEqual(self.contents(), '1,OLD\n')
+        self.assertEqual(self.leftovers(), [])
+
+    def test_unreachable_url_keeps_old_file(self):
+        hb_alias.DOWNLOAD_TIMEOUT, _timeout = 2, hb_alias.DOWNLOAD_TIMEOUT
+        try:
+            self.assertTrue(download(self.path, 'ids.csv', 'http://127.0.0.1:1/ids.csv', 0).endswith('could not be downloaded'))
+        finally:
+            hb_alias.DOWNLOAD_TIMEOUT = _timeout
+        self.assertEqual(self.contents(), '1,OLD\n')
+        self.assertEqual(self.leftovers(), [])
+
+    def test_current_file_not_downloaded(self):
+        self.assertTrue(download(self.path, 'ids.csv', self.new, 3600).endswith('is current, not downloaded'))
+        self.assertEqual(self.contents(), '1,OLD\n')
+
+    def test_missing_file_downloaded(self):
+        os.remove(self.old)
+        self.assertTrue(download(self.path, 'ids.csv', self.new, 3600).endswith('successfully downloaded'))
+        self.assertEqual(self.contents(), '1,NEW\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
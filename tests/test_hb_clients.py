@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Tests for the order HBCLIENTS times clients out in. Run from the top of the
+tree with:
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hb_clients import HBCLIENTS
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+TIMEOUT = 15
+
+
+def radio_id(_number):
+    return '\x00\x00' + chr(_number)
+
+
+class EXPIRE(unittest.TestCase):
+    def setUp(self):
+        self.clients = HBCLIENTS(TIMEOUT)
+        self.now = time()
+
+    def add(self, _number):
+        return self.clients.add(radio_id(_number), '192.0.2.{}'.format(_number), 62031)
+
+    def test_nothing_before_deadline(self):
+        self.add(1)
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT - 1), [])
+        self.assertTrue(radio_id(1) in self.clients)
+
+    def test_deadline_order(self):
+        _clients = [self.add(_number) for _number in (1, 2, 3)]
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT + 1), _clients)
+        self.assertEqual(len(self.clients), 0)
+
+    def test_deadline_order_by_last_ping(self):
+        _first, _second, _third = self.add(1), self.add(2), self.add(3)
+        _first.last_ping, _second.last_ping, _third.last_ping = self.now - 1, self.now - 3, self.now - 2
+        self.clients.set_timeout(TIMEOUT)
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT), [_second, _third, _first])
+
+    def test_touched_client_pushed_back(self):
+        _first, _second = self.add(1), self.add(2)
+        self.clients.touch(_first)
+        _first.last_ping = self.now + 10
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT + 1), [_second])
+        self.assertTrue(radio_id(1) in self.clients)
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT + 5), [])
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT + 11), [_first])
+
+    def test_replaced_client_skipped(self):
+        _old = self.add(1)
+        _new = self.clients.add(radio_id(1), '198.51.100.1', 62031)
+        self.assertFalse(_old is _new)
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT + 1), [_new])
+
+    def test_removed_client_skipped(self):
+        self.add(1)
+        _second = self.add(2)
+        self.clients.remove(radio_id(1))
+        self.assertEqual(self.clients.expire(self.now + TIMEOUT + 1), [_second])
+
+    def test_shorter_timeout(self):
+        _client = self.add(1)
+        self.clients.set_timeout(5)
+        self.assertEqual(self.clients.expire(self.now + 6), [_client])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2018  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+'''
+Tests for hblink.reload_systems: a reload that can't build everything it
+needs changes nothing, and the running master goes on answering. The
+systems listen on real UDP sockets on 127.0.0.1, and datagrams are read
+from them by hand, so the reactor is never run. Run from the top of the
+tree with:
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import socket
+import shutil
+import logging
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import reactor
+
+import hb_config
+from hblink import HBSYSTEM, systems, reload_systems
+
+__author__     = 'Cortney T. Buffington, N0MJS'
+__copyright__  = 'Copyright (c) 2018 Cortney T. Buffington, N0MJS and the K0USY Group'
+__license__    = 'GNU GPLv3'
+__maintainer__ = 'Cort Buffington, N0MJS'
+__email__      = 'n0mjs@me.com'
+
+CONFIG_FILE = '''
+[GLOBAL]
+PATH: {path}
+PING_TIME: {ping_time}
+MAX_MISSED: 3
+CAPTURE_FILE: {path}hblink.capture
+
+[REPORTS]
+REPORT: False
+REPORT_INTERVAL: 60
+REPORT_PORT: 4321
+REPORT_CLIENTS: 127.0.0.1
+
+[LOGGER]
+LOG_FILE: /dev/null
+LOG_HANDLERS: null
+LOG_LEVEL: CRITICAL
+LOG_NAME: HBlink
+
+[ALIASES]
+TRY_DOWNLOAD: False
+PATH: {path}
+PEER_FILE: peer_ids.csv
+SUBSCRIBER_FILE: subscriber_ids.csv
+TGID_FILE: talkgroup_ids.csv
+PEER_URL: {path}peer_ids.csv
+SUBSCRIBER_URL: {path}subscriber_ids.csv
+STALE_DAYS: 7
+
+[AMBE]
+EXPORT_IP: 127.0.0.1
+EXPORT_PORT: 1234
+EXPORT_BACKEND: RING
+RING_FILE: {ring_file}
+'''
+
+MASTER = '''
+[{name}]
+MODE: MASTER
+ENABLED: True
+REPEAT: True
+EXPORT_AMBE: {export_ambe}
+IP: 127.0.0.1
+PORT: {port}
+PASSPHRASE: s3cr37w0rd
+GROUP_HANGTIME: 5
+'''
+
+RPTL = 'RPTL\x00\x00\x00\x01'
+
+
+class RELOAD(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp() + '/'
+        self.logger = logging.getLogger('test_hblink_reload')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.config = self.build(MASTER.format(name='MASTER-1', export_ambe=False, port=0))
+        systems['MASTER-1'] = HBSYSTEM('MASTER-1', self.config, self.logger, None)
+        reactor.listenUDP(0, systems['MASTER-1'], interface='127.0.0.1')
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)
+        self.client.bind(('127.0.0.1', 0))
+
+    def tearDown(self):
+        for _system in systems.values():
+            _system.transport.connectionLost()
+        systems.clear()
+        self.client.close()
+        shutil.rmtree(self.path)
+
+    def build(self, _systems, _ping_time = 5, _ring_file = None):
+        with open(self.path + 'hblink.cfg', 'w') as _handle:
+            _handle.write(CONFIG_FILE.format(path=self.path, ping_time=_ping_time, ring_file=_ring_file or self.path + 'hblink.ring'))
+            _handle.write(_systems)
+        return hb_config.build_config(self.path + 'hblink.cfg')
+
+    # The master's reply to a login, read off its socket by hand
+    def login(self, _system):
+        self.client.sendto(RPTL, ('127.0.0.1', _system.transport.getHost().port))
+        _system.transport.doRead()
+        return self.client.recv(1024)
+
+    def assertUnchanged(self, _running):
+        self.assertTrue(systems['MASTER-1'] is _running)
+        self.assertTrue(_running.transport.protocol is _running)
+        self.assertEqual(sorted(self.config['SYSTEMS']), ['MASTER-1'])
+        self.assertTrue(self.config['SYSTEMS']['MASTER-1'] is _running._config)
+        self.assertEqual(self.config['GLOBAL']['PING_TIME'], 5)
+        self.assertEqual(self.config['AMBE']['RING_FILE'], self.path + 'hblink.ring')
+        self.assertEqual(_running._clients._timeout, 15)
+        self.assertTrue(self.login(_running).startswith('RPTACK'))
+
+    def test_changed_system_fails(self):
+        _running = systems['MASTER-1']
+        _new = self.build(MASTER.format(name='MASTER-1', export_ambe=True, port=0), _ring_file=self.path + 'missing/hblink.ring')
+        self.assertFalse(reload_systems(self.config, _new, self.logger, None, HBSYSTEM))
+        self.assertUnchanged(_running)
+
+    def test_added_system_fails(self):
+        _running = systems['MASTER-1']
+        _new = self.build(MASTER.format(name='MASTER-1', export_ambe=False, port=0) + MASTER.format(name='MASTER-2', export_ambe=True, port=0), _ping_time=7, _ring_file=self.path + 'missing/hblink.ring')
+        self.assertFalse(reload_systems(self.config, _new, self.logger, None, HBSYSTEM))
+        self.assertUnchanged(_running)
+        self.assertFalse('MASTER-2' in systems)
+
+    def test_port_taken(self):
+        _running = systems['MASTER-1']
+        _taken = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _taken.bind(('127.0.0.1', 0))
+        try:
+            _new = self.build(MASTER.format(name='MASTER-1', export_ambe=False, port=0) + MASTER.format(name='MASTER-2', export_ambe=False, port=_taken.getsockname()[1]), _ping_time=7)
+            self.assertFalse(reload_systems(self.config, _new, self.logger, None, HBSYSTEM))
+        finally:
+            _taken.close()
+        self.assertUnchanged(_running)
+
+    def test_reload(self):
+        _running = systems['MASTER-1']
+        _new = self.build(MASTER.format(name='MASTER-1', export_ambe=False, port=0).replace('GROUP_HANGTIME: 5', 'GROUP_HANGTIME: 10'), _ping_time=7)
+        self.assertTrue(reload_systems(self.config, _new, self.logger, None, HBSYSTEM))
+        _restarted = systems['MASTER-1']
+        self.assertFalse(_restarted is _running)
+        self.assertTrue(_restarted.transport.protocol is _restarted)
+        self.assertEqual(_restarted._config['GROUP_HANGTIME'], 10)
+        self.assertEqual(_restarted._clients._timeout, 21)
+        self.assertTrue(self.login(_restarted).startswith('RPTACK'))
+
+
+if __name__ == '__main__':
+    unittest.main()